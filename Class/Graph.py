@@ -1,24 +1,50 @@
-import requests
+from Utils.graph_client import graph_client
+from Utils.graph_token import graph_token
 from Utils.tools import Tools, CustomException
 from Utils.querys import Querys
-from Models.IntranetGraphTokenModel import IntranetGraphTokenModel as TokenModel
-from datetime import datetime, timedelta
+from Utils.hilos import IndiceHilos, HILOS_MAX_CONSULTAS, subjects_relacionados, limpiar_subject_respuesta
+from Utils.reglas_exclusion import reglas_exclusion
+from datetime import datetime, timedelta, timezone
 import hashlib
 import traceback
+import threading
+import socket
+import os
 
 from Utils.constants import (
-    MICROSOFT_CLIENT_ID, MICROSOFT_CLIENT_SECRET, MICROSOFT_TENANT_ID,
-    MICROSOFT_API_SCOPE, MICROSOFT_URL, MICROSOFT_URL_GRAPH, PARENT_FOLDER,
-    TARGET_FOLDER, EMAIL_USER
+    MICROSOFT_URL_GRAPH, PARENT_FOLDER,
+    TARGET_FOLDER, EMAIL_USER, SYNC_INTERVALO_SEGUNDOS, SYNC_LEASE_SEGUNDOS,
+    SYNC_SOLO_METADATOS, GRAPH_NOTIFICACIONES_URL, GRAPH_NOTIFICACIONES_CLIENT_STATE,
+    GRAPH_SUSCRIPCION_MINUTOS
 )
+from Class.SyncWorker import sync_worker, sincronizar_fuentes
+
+# Single-flight dentro del proceso: una sola sincronización por buzón/carpeta a la vez,
+# las peticiones concurrentes esperan y comparten su resultado
+_sync_lock = threading.Lock()
+_sync_en_vuelo = dict()
+
+# Exclusión por buzón/carpeta dentro del proceso entre la sincronización y la ingesta por notificación
+_fuente_locks = dict()
+
+# Caché en memoria de ids de carpeta de Graph por (buzón, carpeta); respaldada en intranet_sync_estado
+_folder_ids = dict()
+
+# Identificador de este proceso para el lease de sincronización entre workers
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
 
 class Graph:
 
-    def __init__(self, db):
+    def __init__(self, db, buzon=EMAIL_USER, carpeta=TARGET_FOLDER):
         self.db = db
         self.tools = Tools()
         self.querys = Querys(self.db)
         self.token = None
+        self.indice_hilos = None  # Índice de hilos de la sincronización en curso
+        self.ultimo_status_graph = None  # Status HTTP de la última petición de _make_request
+        # Fuente (buzón/carpeta) que sincroniza esta instancia; ver SYNC_FUENTES
+        self.buzon = buzon
+        self.carpeta = carpeta
 
     def _build_graph_url(self, endpoint):
         """
@@ -30,144 +56,444 @@ class Graph:
             base_url = base_url.replace('/users', '')  # Quitar /users para endpoints /me
         return f"{base_url}/{endpoint.lstrip('/')}"
 
-    # Función para obtener correos con sincronización inteligente
+    # Función para obtener correos desde BD y revalidar en segundo plano (stale-while-revalidate)
     def obtener_correos(self, forzar_sync=False):
         """
-        Obtiene correos implementando sincronización inteligente:
-        1. Si no hay correos en BD o forzar_sync=True -> Sync completo
-        2. Si hay correos en BD -> Solo sincronizar nuevos
-        3. Retorna correos desde BD
+        Retorna de inmediato los correos desde BD junto con el estado de la última
+        sincronización. La sincronización con Graph corre en segundo plano (SyncWorker):
+        1. forzar_sync=True -> Se solicita un sync completo
+        2. Último sync exitoso más antiguo que el intervalo -> Se solicita un sync incremental
         """
-        
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        try:
+            correos_bd = self.querys.obtener_correos_bd(limite=100)
+            ultimo_sync = self.querys.obtener_ultimo_sync()
+            ultimo_sync_exitoso = self.querys.obtener_ultimo_sync_exitoso()
 
-        if not self.token:
-            return self.tools.output(400, "No se pudo obtener token de acceso.", {'emails': []})
+            if forzar_sync or self._sync_desactualizado(ultimo_sync_exitoso):
+                sync_worker.solicitar_sync(forzar_sync)
+
+            result = {
+                'emails': correos_bd,
+                'ultimo_sync': ultimo_sync,
+                'ultimo_sync_exitoso': ultimo_sync_exitoso,
+                'sync_en_curso': sync_worker.sync_pendiente()
+            }
 
+            return self.tools.output(200, "Correos obtenidos desde BD.", result)
+
+        except Exception as e:
+            print(f"Error obteniendo correos desde BD: {e}")
+            return self.tools.output(500, "Error obteniendo correos.", {'emails': []})
+
+    # Función para forzar una sincronización completa dentro de la petición
+    def sincronizar_correos(self):
+        """
+        Ejecuta una sincronización completa con Microsoft Graph de todos los buzones/carpetas
+        configurados (en paralelo) y retorna los correos desde BD
+        """
         try:
-            # Determinar tipo de sincronización
-            correos_existentes = self.querys.obtener_correos_bd(limite=1)
-            tipo_sync = 'completo' if (not correos_existentes or forzar_sync) else 'incremental'
-            
-            # Iniciar log de sincronización
-            log_id = self.querys.crear_log_sync(tipo_sync)
-            
-            # Ejecutar sincronización
-            stats_sync = self.sincronizar_correos_inteligente(tipo_sync)
-            
-            # Finalizar log
-            if log_id:
-                self.querys.finalizar_log_sync(
-                    log_id, 
-                    correos_nuevos=stats_sync.get('nuevos', 0),
-                    correos_actualizados=stats_sync.get('actualizados', 0),
-                    estado=1
-                )
-            
+            resultados = sincronizar_fuentes(forzar=True)
+            exitosos = [resultado for resultado in resultados.values() if 'error' not in resultado]
+            if not exitosos:
+                raise CustomException("No se pudo sincronizar ningún buzón.")
+
+            # Estadísticas totales de todas las fuentes
+            sync_stats = dict()
+            for resultado in exitosos:
+                for clave, valor in resultado['sync_stats'].items():
+                    sync_stats[clave] = sync_stats.get(clave, 0) + valor
+
             # Obtener correos desde BD para retornar
             correos_bd = self.querys.obtener_correos_bd(limite=100)
-            
+
             # Preparar respuesta
             result = {
-                'token': self.token, 
                 'emails': correos_bd,
-                'sync_stats': stats_sync,
-                'tipo_sync': tipo_sync
+                'sync_stats': sync_stats,
+                'tipo_sync': 'completo',
+                'fuentes': resultados
             }
 
-            return self.tools.output(200, f"Sincronización {tipo_sync} completada.", result)
-            
+            return self.tools.output(200, "Sincronización completo completada.", result)
+
         except Exception as e:
-            # Log de error
-            if 'log_id' in locals() and log_id:
-                self.querys.finalizar_log_sync(log_id, estado=0, mensaje_error=str(e))
-            
             print(f"Error en sincronización: {e}")
-            
+
             # Fallback: retornar correos existentes en BD
             correos_bd = self.querys.obtener_correos_bd(limite=100)
             return self.tools.output(200, "Error en sync, mostrando correos locales.", {'emails': correos_bd})
 
+    # Función para ejecutar una sincronización sin solapamientos (single-flight)
+    def ejecutar_sincronizacion(self, forzar_sync=False):
+        """
+        Ejecuta la sincronización garantizando una sola sincronización por buzón/carpeta:
+        - Dentro del proceso: si ya hay una en curso, se espera y se comparte su resultado
+        - Entre workers: lease en intranet_sync_estado; si otro proceso lo tiene, se retorna
+          el resultado del último sync completado
+        Returns: dict con tipo_sync y sync_stats. Lanza la excepción si la sync falla
+        """
+        clave = (self.buzon, self.carpeta)
+
+        with _sync_lock:
+            vuelo = _sync_en_vuelo.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = {'evento': threading.Event(), 'resultado': None, 'error': None}
+                _sync_en_vuelo[clave] = vuelo
+
+        if not lider:
+            # Otra petición de este proceso ya está sincronizando: esperar su resultado
+            vuelo['evento'].wait(timeout=SYNC_LEASE_SEGUNDOS)
+            if vuelo['resultado'] is not None:
+                return vuelo['resultado']
+            raise CustomException(vuelo['error'] or "La sincronización en curso no terminó a tiempo.")
+
+        try:
+            # Si hay una ingesta por notificación de la misma fuente en curso se espera (es breve)
+            with self._lock_fuente():
+                vuelo['resultado'] = self._ejecutar_sincronizacion_con_lease(forzar_sync)
+            return vuelo['resultado']
+
+        except Exception as e:
+            vuelo['error'] = str(e)
+            raise
+
+        finally:
+            with _sync_lock:
+                _sync_en_vuelo.pop(clave, None)
+            vuelo['evento'].set()
+
+    # Helper para obtener el lock en proceso del buzón/carpeta
+    def _lock_fuente(self):
+        with _sync_lock:
+            return _fuente_locks.setdefault((self.buzon, self.carpeta), threading.Lock())
+
+    # Función para ejecutar una sincronización registrándola en el log
+    def _ejecutar_sincronizacion_con_lease(self, forzar_sync=False):
+        """
+        Toma el lease del buzón/carpeta y ejecuta la sincronización inteligente
+        registrándola en intranet_sync_log:
+        1. Si no hay correos en BD o forzar_sync=True -> Sync completo
+        2. Si hay correos en BD -> Solo sincronizar cambios
+        """
+        if not self.querys.adquirir_lease_sync(self.buzon, self.carpeta, LEASE_OWNER, SYNC_LEASE_SEGUNDOS):
+            # Otro worker está sincronizando: retornar el último resultado completado
+            print("Sync en curso en otro proceso, retornando el último sync completado")
+            ultimo_sync = self.querys.obtener_ultimo_sync_exitoso(self.buzon, self.carpeta) or {}
+            return {
+                'tipo_sync': ultimo_sync.get('tipo_sync', 'en_curso'),
+                'sync_stats': {
+                    'nuevos': ultimo_sync.get('correos_nuevos', 0),
+                    'actualizados': ultimo_sync.get('correos_actualizados', 0)
+                },
+                'compartido': True
+            }
+
+        try:
+            # Obtenemos el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
+
+            if not self.token:
+                raise CustomException("No se pudo obtener token de acceso.")
+
+            # Determinar tipo de sincronización
+            correos_existentes = self.querys.obtener_correos_bd(limite=1)
+            tipo_sync = 'completo' if (not correos_existentes or forzar_sync) else 'incremental'
+
+            # Iniciar log de sincronización
+            log_id = self.querys.crear_log_sync(tipo_sync, self.buzon, self.carpeta)
+
+            try:
+                # Ejecutar sincronización
+                stats_sync = self.sincronizar_correos_inteligente(tipo_sync)
+
+            except Exception as e:
+                # Log de error
+                if log_id:
+                    self.querys.finalizar_log_sync(log_id, estado=0, mensaje_error=str(e))
+                raise
+
+            # Finalizar log
+            if log_id:
+                self.querys.finalizar_log_sync(
+                    log_id,
+                    correos_nuevos=stats_sync.get('nuevos', 0),
+                    correos_actualizados=stats_sync.get('actualizados', 0),
+                    correos_eliminados=stats_sync.get('eliminados', 0),
+                    estado=1
+                )
+
+            return {'tipo_sync': tipo_sync, 'sync_stats': stats_sync}
+
+        finally:
+            self.querys.liberar_lease_sync(self.buzon, self.carpeta, LEASE_OWNER)
+
+    # Helper para saber si la última sincronización exitosa ya está vencida
+    def _sync_desactualizado(self, ultimo_sync_exitoso):
+        """Indica si el último sync exitoso es más antiguo que el intervalo del worker"""
+        if not ultimo_sync_exitoso or not ultimo_sync_exitoso.get('fecha_fin'):
+            return True
+
+        fecha_fin = datetime.fromisoformat(ultimo_sync_exitoso['fecha_fin'])
+        return datetime.now() - fecha_fin > timedelta(seconds=SYNC_INTERVALO_SEGUNDOS)
+
     # Función para sincronización inteligente de correos
     def sincronizar_correos_inteligente(self, tipo_sync='incremental'):
         """
         Sincronización inteligente de correos:
-        - Obtiene correos desde Graph API
+        - Obtiene correos desde Graph API página por página (sin acumular el buzón en memoria)
         - Compara con BD usando message_id
         - Inserta solo correos nuevos
         - Actualiza correos modificados
         """
-        stats = {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0}
+        stats = {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0,
+                 'eliminados': 0, 'paginas': 0}
+        self.indice_hilos = None
         
-        # Obtener correos desde Microsoft Graph
-        folder_id = self.get_folder_id(TARGET_FOLDER)
+        estado_sync = self.querys.obtener_estado_sync(self.buzon, self.carpeta) or {}
+
+        # Obtener correos desde Microsoft Graph (id de carpeta desde caché)
+        folder_id = self.obtener_folder_id(estado_sync)
         if not folder_id:
             return stats
-            
-        emails_graph = self.extraer_correos(folder_id)
-        if not emails_graph:
-            return stats
-        
-        # Filtrar correos spam
-        emails_filtrados = [
-            email for email in emails_graph
-            if not email['from']['emailAddress']['address'].lower().startswith(('postmaster', 'noreply'))
-            and not email['subject'].startswith(('[!!Spam]', '[!!Massmail]'))
-        ]
-        
-        # Obtener message_ids existentes en BD para comparación rápida
-        message_ids_existentes = self.querys.obtener_message_ids_existentes()
+
+        # En sync incremental se parte del último deltaLink guardado (solo cambios)
+        delta_link = estado_sync.get('delta_link') if tipo_sync == 'incremental' else None
+
+        # Si una ronda anterior quedó interrumpida se reanuda desde su último checkpoint
+        checkpoint_link = estado_sync.get('checkpoint_link')
+        if checkpoint_link:
+            print(f"Reanudando sincronización desde checkpoint del {estado_sync.get('fecha_checkpoint')}")
+
+        # Puntos de partida en orden: checkpoint, deltaLink y, como último recurso, ronda completa
+        inicios = [url for url in (checkpoint_link, delta_link) if url] + [None]
+        carpeta_revalidada = False
+        while inicios:
+            url_inicio = inicios[0]
+            try:
+                # Solo una ronda completa desde cero ve todos los correos: permite barrer los que ya no están
+                self._procesar_paginas_correos(
+                    self.extraer_correos(folder_id, url_inicio), stats, barrido=url_inicio is None
+                )
+                break
+            except CustomException:
+                if stats['paginas']:
+                    raise
+
+                if self.ultimo_status_graph == 404 and not carpeta_revalidada:
+                    # La carpeta cacheada ya no existe (recreada o movida): resolver su id de nuevo.
+                    # Los enlaces guardados apuntan al id anterior, así que se hace una ronda completa
+                    print("Carpeta no encontrada en Graph, se vuelve a resolver su id")
+                    carpeta_revalidada = True
+                    folder_id = self.obtener_folder_id(invalidar=True)
+                    if not folder_id:
+                        raise
+                    if checkpoint_link:
+                        self.querys.guardar_checkpoint_sync(self.buzon, self.carpeta, None)
+                    inicios = [None]
+                    continue
+
+                if url_inicio is None:
+                    raise
+                # Enlace expirado o rechazado por Graph antes de procesar páginas: probar el siguiente
+                print("Checkpoint/deltaLink inválido, se intenta desde el siguiente punto de partida")
+                if url_inicio == checkpoint_link:
+                    self.querys.guardar_checkpoint_sync(self.buzon, self.carpeta, None)
+                inicios.pop(0)
         
-        for email_graph in emails_filtrados:
+        return stats
+    
+    # Helper para consumir las páginas de Graph a medida que llegan
+    def _procesar_paginas_correos(self, paginas, stats, barrido=False):
+        """
+        Consume el generador de extraer_correos: filtra, detecta hilos y persiste
+        cada página apenas llega (una transacción por página), de modo que la memoria
+        queda acotada a una página y el progreso parcial ya queda guardado en BD.
+        Los correos eliminados o movidos fuera de la carpeta (@removed de delta) se
+        desactivan por página. Con barrido=True (ronda completa desde cero) al terminar
+        se desactivan además los correos activos que Graph ya no devolvió.
+        """
+        nuevo_delta_link = None
+        ids_vistos = set() if barrido else None
+
+        for pagina in paginas:
+            stats['paginas'] += 1
+
+            # Los correos spam/automáticos ya vienen excluidos desde extraer_correos
+            if pagina['correos']:
+                stats_lote = self._procesar_lote_correos(pagina['correos'])
+                for clave, valor in stats_lote.items():
+                    stats[clave] = stats.get(clave, 0) + valor
+
+            if pagina['eliminados']:
+                stats['eliminados'] += self.querys.desactivar_correos_eliminados(pagina['eliminados'])
+
+            if ids_vistos is not None:
+                ids_vistos.update(pagina['ids'])
+
+            if pagina['delta_link']:
+                nuevo_delta_link = pagina['delta_link']
+            elif pagina['next_link']:
+                # Página ya persistida: si el sync se interrumpe, se reanuda desde la siguiente
+                self.querys.guardar_checkpoint_sync(self.buzon, self.carpeta, pagina['next_link'])
+
+            # Extender el lease para que otro proceso no tome un sync que sigue avanzando
+            self.querys.renovar_lease_sync(self.buzon, self.carpeta, LEASE_OWNER, SYNC_LEASE_SEGUNDOS)
+
+        # Barrido por ids: solo si la ronda completa terminó (se recibió el deltaLink)
+        if nuevo_delta_link and ids_vistos is not None:
+            ausentes = self.querys.obtener_message_ids_activos(
+                self.buzon, self.carpeta,
+                incluir_sin_origen=(self.buzon, self.carpeta) == (EMAIL_USER, TARGET_FOLDER)
+            ) - ids_vistos
+            if ausentes:
+                print(f"Barrido de sync: {len(ausentes)} correos ya no están en la carpeta")
+                stats['eliminados'] += self.querys.desactivar_correos_eliminados(list(ausentes))
+
+        # Guardar el deltaLink solo cuando la ronda terminó y se procesaron los cambios
+        if nuevo_delta_link:
+            self.querys.guardar_delta_link(self.buzon, self.carpeta, nuevo_delta_link)
+
+        return stats
+
+    # Helper para procesar una página de correos de Graph en bloque
+    def _procesar_lote_correos(self, emails_graph):
+        """
+        Procesa una página de correos de Graph:
+        - Carga en una sola query el índice (message_id, hash) de la ventana de la página
+        - Detecta si los correos nuevos son respuesta a un hilo existente: con pocos correos
+          nuevos (ingesta por notificación, deltas pequeños) por consultas indexadas y con más
+          en memoria (IndiceHilos)
+        - Inserta/actualiza toda la página en una sola transacción
+        Returns: dict con conteos nuevos, actualizados, sin_cambios y respuestas_procesadas
+        """
+        correos_data = []
+        for email_graph in emails_graph:
             try:
-                message_id = email_graph.get('id')
-                if not message_id:
+                if not email_graph.get('id'):
                     continue
-                
-                # Preparar datos del correo para BD
-                correo_data = self._preparar_datos_correo(email_graph)
-                
-                if message_id in message_ids_existentes:
-                    # Correo existe, verificar si hay cambios
-                    correo_existente = self.querys.obtener_correo_por_message_id(message_id)
-                    if correo_existente:
-                        # Comparar hash para detectar cambios
-                        hash_nuevo = self.querys.generar_hash_contenido(
-                            correo_data.get('subject', ''),
-                            correo_data.get('body_preview', ''),
-                            correo_data.get('from_email', '')
-                        )
-                        
-                        if hash_nuevo != correo_existente.get('hash_contenido'):
-                            # Hay cambios, actualizar
-                            self.querys.actualizar_correo(message_id, correo_data)
-                            stats['actualizados'] += 1
-                        else:
-                            stats['sin_cambios'] += 1
-                else:
-                    # Correo nuevo - verificar si es respuesta a un hilo existente
-                    conversation_id = correo_data.get('conversation_id')
-                    
-                    # Verificar si es respuesta usando múltiples criterios
-                    ticket_existente = self._es_respuesta_a_hilo_existente(conversation_id, correo_data)
-                    
-                    if ticket_existente:
-                        # Es una respuesta a un hilo existente
-                        if self._procesar_respuesta_hilo(correo_data, ticket_existente):
-                            stats['respuestas_procesadas'] += 1
-                    else:
-                        # Es un correo completamente nuevo, crear nuevo ticket
-                        self.querys.insertar_correo(correo_data)
-                        stats['nuevos'] += 1
-                    
+                correos_data.append(self._preparar_datos_correo(email_graph))
             except Exception as e:
-                print(f"Error procesando correo {message_id}: {e}")
+                print(f"Error preparando correo {email_graph.get('id')}: {e}")
                 continue
-        
+
+        existentes = self._obtener_indice_cambios(correos_data)
+        candidatos = [c for c in correos_data if c['message_id'] not in existentes]
+
+        # Pocos correos nuevos: consultas indexadas por correo en lugar de cargar la ventana de
+        # hilos. Con más, el índice de hilos se construye una sola vez por sync
+        por_consulta = self.indice_hilos is None and len(candidatos) <= HILOS_MAX_CONSULTAS
+        if self.indice_hilos is None and not por_consulta:
+            self.indice_hilos = IndiceHilos(self.querys.obtener_correos_indice_hilos())
+
+        # Conversaciones anteriores a la ventana del índice: una búsqueda IN por conversation_id por página
+        if self.indice_hilos is not None:
+            pendientes = self.indice_hilos.conversaciones_pendientes(candidatos)
+            if pendientes:
+                self.indice_hilos.agregar_conversaciones(
+                    pendientes, self.querys.obtener_tickets_por_conversation_ids(pendientes)
+                )
+
+        nuevos = list()
+        for correo_data in correos_data:
+            if correo_data['message_id'] in existentes:
+                continue
+            try:
+                # Correo nuevo - verificar si es respuesta a un hilo existente
+                if por_consulta:
+                    ticket_existente = self._buscar_hilo_bd(correo_data)
+                else:
+                    ticket_existente = self.indice_hilos.buscar_hilo(correo_data)
+                if ticket_existente:
+                    correo_data['es_respuesta'] = True
+                    correo_data['ticket_padre_id'] = ticket_existente.get('id')
+                else:
+                    nuevos.append(correo_data['message_id'])
+            except Exception as e:
+                print(f"Error detectando hilo del correo {correo_data['message_id']}: {e}")
+
+        # Metadatos de attachments de los correos nuevos en $batch (sin descargar su contenido)
+        adjuntos = self._obtener_metadatos_adjuntos([
+            correo_data['message_id'] for correo_data in correos_data
+            if correo_data['message_id'] not in existentes and correo_data.get('has_attachments')
+        ])
+
+        stats = self.querys.upsert_correos_lote(correos_data, existentes)
+        # attachments_count se escribe junto con las filas de attachments (misma transacción)
+        self.querys.guardar_adjuntos_correos(adjuntos)
+
+        # Los correos nuevos de esta página quedan disponibles como hilo para las siguientes
+        if self.indice_hilos is not None:
+            for fila in self.querys.obtener_correos_indice_hilos(message_ids=nuevos):
+                self.indice_hilos.agregar(fila)
+
         return stats
-    
+
+    # Helper para resolver el hilo de un correo nuevo con consultas indexadas
+    def _buscar_hilo_bd(self, correo_data):
+        """
+        Aplica los criterios de IndiceHilos.buscar_hilo consultando la BD, para lotes con
+        pocos correos nuevos donde cargar la ventana completa de hilos cuesta más:
+        1. conversation_id (idx_conversation_id)
+        2. Subject con prefijos RE:/FW:/... con la misma huella que un correo del remitente
+           (idx_subject_huella_from_email)
+        3. Correo más reciente del remitente con subject relacionado (idx_from_email)
+        Returns: dict con info del correo existente o None si es correo nuevo
+        """
+        ticket = self.querys.obtener_ticket_por_conversation_id(correo_data.get('conversation_id'))
+        if ticket:
+            return ticket
+
+        subject = (correo_data.get('subject') or '').strip()
+        from_email = (correo_data.get('from_email') or '').lower()
+        if not subject or not from_email:
+            return None
+
+        subject_limpio = limpiar_subject_respuesta(subject)
+        if subject_limpio != subject:  # Tenía prefijos de respuesta
+            ticket = self.querys.buscar_ticket_por_subject_similar(subject_limpio, from_email)
+            if ticket:
+                return ticket
+
+        ticket = self.querys.buscar_ticket_reciente_por_email(from_email)
+        if ticket and subjects_relacionados(subject, ticket.get('subject', '')):
+            return ticket
+
+        return None
+
+    # Helper para cargar el índice de detección de cambios de una página
+    def _obtener_indice_cambios(self, correos_data):
+        """
+        Carga {message_id: hash_contenido} de los correos del buzón recibidos entre la fecha
+        mínima y máxima de la página, de modo que la comparación se hace completamente en memoria.
+        Se consulta por los message_ids de la página cuando la ventana es muy amplia (p. ej. un
+        correo antiguo modificado en una ronda delta) o trae muchas más filas que la página
+        (buzón compartido con mucho tráfico).
+        """
+        max_dias_ventana = 31
+        max_filas_por_correo = 10
+        message_ids = [correo['message_id'] for correo in correos_data]
+        fechas = [correo['received_date'] for correo in correos_data if correo.get('received_date')]
+        if not fechas:
+            return self.querys.obtener_hashes_existentes(message_ids)
+
+        # Fechas sin zona horaria (correos sin receivedDateTime) no se comparan con las de Graph
+        fechas_mixtas = len({fecha.tzinfo is None for fecha in fechas}) > 1
+        fecha_desde, fecha_hasta = (None, None) if fechas_mixtas else (min(fechas), max(fechas))
+        if fechas_mixtas or (fecha_hasta - fecha_desde) > timedelta(days=max_dias_ventana):
+            return self.querys.obtener_hashes_existentes(message_ids)
+
+        indice = self.querys.obtener_indice_hashes_ventana(
+            fecha_desde, fecha_hasta,
+            buzon=self.buzon,
+            incluir_sin_origen=self.buzon == EMAIL_USER,
+            limite=max_filas_por_correo * len(message_ids)
+        )
+        if indice is None:
+            return self.querys.obtener_hashes_existentes(message_ids)
+
+        return indice
+
     # Helper para preparar datos del correo
     def _preparar_datos_correo(self, email_graph):
         """Convierte un correo de Graph API al formato de BD"""
@@ -181,6 +507,8 @@ class Graph:
         
         return {
             'message_id': email_graph.get('id'),
+            'buzon': self.buzon,
+            'carpeta': self.carpeta,
             'conversation_id': email_graph.get('conversationId'),  # Agregar conversationId
             'subject': email_graph.get('subject', ''),
             'from_email': from_data.get('address', ''),
@@ -189,288 +517,528 @@ class Graph:
                 email_graph.get('receivedDateTime', '').replace('Z', '+00:00')
             ) if email_graph.get('receivedDateTime') else datetime.now(),
             'body_preview': email_graph.get('bodyPreview', ''),
-            'body_content': email_graph.get('body', {}).get('content', '') if email_graph.get('body') else '',
+            'body_content': email_graph['body'].get('content', '') if email_graph.get('body') else None,
+            'body_cargado': 1 if email_graph.get('body') else 0,
             'estado': 1,
             'attachments_count': attachments_count,
             'has_attachments': has_attachments
         }
 
-    # Helper para determinar si un correo es respuesta a un hilo existente
-    def _es_respuesta_a_hilo_existente(self, conversation_id, correo_data):
+    # Función para obtener el ID de una carpeta específica
+    def get_folder_id(self, target_folder: str):
+
+        """Obtiene el ID de una carpeta específica dentro del correo del usuario."""
+        result = None
+        url = f"{MICROSOFT_URL_GRAPH}{self.buzon}/mailFolders/{target_folder}"
+        data = self._make_request(url)
+        if data:
+            result = data['id']
+        return result
+
+    # Función para obtener el id de la carpeta sincronizada con caché
+    def obtener_folder_id(self, estado_sync=None, invalidar=False):
         """
-        Verifica si un correo entrante es respuesta a una conversación existente
-        Usa múltiples criterios para detectar hilos:
-        1. conversation_id (principal)
-        2. Subject patterns (RE:, FW:, etc.)
-        3. Análisis de remitente vs tickets existentes
-        
-        Returns: dict con info del ticket existente o None si es correo nuevo
+        El id de una carpeta prácticamente no cambia: se pide a Graph una sola vez y luego
+        se toma de memoria o de intranet_sync_estado, sin ida y vuelta al inicio de cada sync.
+        invalidar=True descarta el id cacheado (p. ej. tras un 404) y lo vuelve a resolver.
         """
-        
-        # Criterio 1: Buscar por conversation_id (más confiable)
-        if conversation_id:
-            ticket_existente = self.querys.obtener_ticket_por_conversation_id(conversation_id)
-            if ticket_existente:
-                return ticket_existente
-        
-        # Criterio 2: Analizar subject para patrones de respuesta
-        subject = correo_data.get('subject', '').strip()
-        if subject:
-            # Limpiar subject de prefijos RE:, FW:, etc.
-            subject_limpio = self._limpiar_subject_respuesta(subject)
-            
-            if subject_limpio != subject:  # Tenía prefijos de respuesta
-                # Buscar tickets con subject similar
-                ticket_por_subject = self.querys.buscar_ticket_por_subject_similar(subject_limpio, 
-                                                                                 correo_data.get('from_email'))
-                if ticket_por_subject:
-                    return ticket_por_subject
-        
-        # Criterio 3: Buscar por email del remitente en tickets recientes (últimos 7 días)
-        from_email = correo_data.get('from_email')
-        if from_email:
-            ticket_reciente = self.querys.buscar_ticket_reciente_por_email(from_email, days=7)
-            if ticket_reciente and subject:
-                # Verificar si el subject actual contiene palabras clave del ticket original
-                if self._subjects_relacionados(subject, ticket_reciente.get('subject', '')):
-                    return ticket_reciente
-            
-        return None
+        clave = (self.buzon, self.carpeta)
+
+        if invalidar:
+            _folder_ids.pop(clave, None)
+        else:
+            if clave in _folder_ids:
+                return _folder_ids[clave]
+
+            if estado_sync is None:
+                estado_sync = self.querys.obtener_estado_sync(self.buzon, self.carpeta) or {}
+            if estado_sync.get('folder_id'):
+                _folder_ids[clave] = estado_sync['folder_id']
+                return estado_sync['folder_id']
 
-    # Helper para procesar la respuesta de un hilo existente
-    def _procesar_respuesta_hilo(self, correo_data, ticket_existente):
+        folder_id = self.get_folder_id(self.carpeta)
+        if folder_id:
+            _folder_ids[clave] = folder_id
+            self.querys.guardar_folder_id_sync(self.buzon, self.carpeta, folder_id)
+        return folder_id
+
+    # Helper con los campos de correo que se piden a Graph
+    def _campos_select(self):
+        """En modo solo metadatos no se descarga body: el cuerpo se trae al abrir el correo"""
+        campos = "from,subject,receivedDateTime,bodyPreview,conversationId,id,hasAttachments"
+        if not SYNC_SOLO_METADATOS:
+            campos += ",body"
+        return campos
+
+    # Función para crear o renovar la suscripción a notificaciones de cambio de Graph
+    def asegurar_suscripcion(self):
         """
-        Procesa un correo que es respuesta a un hilo existente
-        - Actualiza el ticket con la nueva respuesta
-        - Registra la respuesta en el historial
-        - NO crea un nuevo ticket
+        Mantiene vigente la suscripción de Graph a los correos nuevos de la carpeta, para que
+        cada correo llegue por /notificaciones_graph en segundos. Solo renueva cuando quedan
+        menos de 12 horas; si la suscripción ya no existe en Graph, la crea de nuevo.
+        Sin GRAPH_NOTIFICACIONES_URL no hace nada (queda solo la sincronización periódica).
         """
+        if not GRAPH_NOTIFICACIONES_URL:
+            return None
+
         try:
-            ticket_id = ticket_existente.get('id')
-            
-            # Registrar la respuesta en el historial del ticket
-            respuesta_data = {
-                'ticket_id': ticket_id,
-                'message_id': correo_data.get('message_id'),
-                'from_email': correo_data.get('from_email'),
-                'from_name': correo_data.get('from_name'),
-                'subject': correo_data.get('subject'),
-                'body_content': correo_data.get('body_content'),
-                'received_date': correo_data.get('received_date'),
-                'tipo': 'respuesta_entrante'
+            estado_sync = self.querys.obtener_estado_sync(self.buzon, self.carpeta) or {}
+            suscripcion_id = estado_sync.get('suscripcion_id')
+            expira = estado_sync.get('suscripcion_expira')
+            if suscripcion_id and expira and datetime.fromisoformat(expira) - datetime.now() > timedelta(hours=12):
+                return suscripcion_id
+
+            self.token = graph_token.obtener(self.db)
+            if not self.token:
+                return None
+
+            headers = {
+                'Authorization': f'Bearer {self.token}',
+                'Content-Type': 'application/json'
             }
-            
-            # Registrar en el historial del ticket
-            self.querys.registrar_respuesta_entrante_ticket(respuesta_data)
-            
-            # Actualizar la fecha de última actividad del ticket
-            self.querys.actualizar_ultima_actividad_ticket(ticket_id)
-            
-            return True
-            
+            nueva_expiracion = datetime.now(timezone.utc) + timedelta(minutes=GRAPH_SUSCRIPCION_MINUTOS)
+            expiracion_iso = nueva_expiracion.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+            response = None
+            if suscripcion_id:
+                response = graph_client.patch(
+                    self._build_graph_url(f"subscriptions/{suscripcion_id}"),
+                    headers=headers,
+                    json={'expirationDateTime': expiracion_iso}
+                )
+
+            if response is None or response.status_code == 404:
+                folder_id = self.obtener_folder_id(estado_sync)
+                if not folder_id:
+                    return None
+
+                response = graph_client.post(self._build_graph_url("subscriptions"), headers=headers, json={
+                    'changeType': 'created',
+                    'notificationUrl': GRAPH_NOTIFICACIONES_URL,
+                    'resource': f"users/{self.buzon}/mailFolders/{folder_id}/messages",
+                    'expirationDateTime': expiracion_iso,
+                    'clientState': GRAPH_NOTIFICACIONES_CLIENT_STATE
+                })
+
+            if response.status_code not in (200, 201):
+                print(f"Error creando/renovando suscripción de Graph: {response.status_code} - {response.text}")
+                return None
+
+            suscripcion_id = response.json().get('id', suscripcion_id)
+            self.querys.guardar_suscripcion_sync(
+                self.buzon, self.carpeta, suscripcion_id,
+                datetime.now() + timedelta(minutes=GRAPH_SUSCRIPCION_MINUTOS)
+            )
+            print(f"Suscripción de notificaciones vigente: {suscripcion_id}")
+            return suscripcion_id
+
         except Exception as e:
-            print(f"Error procesando respuesta del hilo: {e}")
-            return False
+            print(f"Error asegurando suscripción de notificaciones: {e}")
+            return None
 
-    # Helper para limpiar el subject de un correo
-    def _limpiar_subject_respuesta(self, subject):
+    # Función para recibir notificaciones de cambio de Graph
+    def procesar_notificaciones(self, data: dict):
         """
-        Limpia prefijos de respuesta del subject (RE:, FW:, etc.)
-        Returns: subject limpio sin prefijos
+        Valida el clientState de cada notificación y encola los ids de los correos,
+        agrupados por suscripción (una por buzón/carpeta), para que el worker los traiga
+        puntualmente. No consulta Graph ni BD: Graph espera la respuesta en pocos segundos.
+        Returns: cantidad de correos encolados
         """
-        import re
-        
-        # Patrones comunes de respuesta en diferentes idiomas
-        patrones_respuesta = [
-            r'^RE:\s*',     # Respuesta en inglés/español
-            r'^RES:\s*',    # Respuesta en español
-            r'^FW:\s*',     # Reenvío en inglés
-            r'^RV:\s*',     # Reenvío en español
-            r'^FWD:\s*',    # Reenvío alternativo
-            r'^AW:\s*',     # Respuesta en alemán
-            r'^SV:\s*',     # Respuesta en sueco/noruego
-            r'^\[SPAM\]\s*' # Filtros de spam
-        ]
-        
-        subject_limpio = subject
-        for patron in patrones_respuesta:
-            subject_limpio = re.sub(patron, '', subject_limpio, flags=re.IGNORECASE)
-        
-        return subject_limpio.strip()
+        por_suscripcion = dict()
+        for notificacion in data.get('value', []):
+            if notificacion.get('clientState') != GRAPH_NOTIFICACIONES_CLIENT_STATE:
+                print(f"Notificación descartada: clientState inválido ({notificacion.get('subscriptionId')})")
+                continue
 
-    # Helper para verificar si dos subjects están relacionados
-    def _subjects_relacionados(self, subject1, subject2):
+            message_id = (notificacion.get('resourceData') or {}).get('id')
+            if message_id:
+                por_suscripcion.setdefault(notificacion.get('subscriptionId'), []).append(message_id)
+
+        for suscripcion_id, message_ids in por_suscripcion.items():
+            sync_worker.encolar_mensajes(message_ids, suscripcion_id)
+        return sum(len(message_ids) for message_ids in por_suscripcion.values())
+
+    # Función para traer desde Graph solo los correos avisados por notificaciones
+    def ingerir_correos_notificados(self, message_ids):
         """
-        Verifica si dos subjects están relacionados (mismo hilo)
+        Trae los correos notificados (GETs agrupados en $batch) y los procesa con el mismo
+        pipeline de la sincronización: reglas de exclusión, hilos y upsert por lote.
+        Usa la misma exclusión que la sincronización (lock de la fuente en el proceso y lease
+        entre workers) para no insertar a la vez los correos de una ronda delta en curso; si
+        la fuente está ocupada, los correos quedan para la siguiente ronda delta.
         """
-        if not subject1 or not subject2:
-            return False
-            
-        # Limpiar ambos subjects
-        s1_limpio = self._limpiar_subject_respuesta(subject1).lower()
-        s2_limpio = self._limpiar_subject_respuesta(subject2).lower()
-        
-        # Verificar similitud (al menos 70% de coincidencia)
-        if len(s1_limpio) == 0 or len(s2_limpio) == 0:
-            return False
-            
-        # Algoritmo simple de similitud por palabras
-        palabras1 = set(s1_limpio.split())
-        palabras2 = set(s2_limpio.split())
-        
-        if len(palabras1.union(palabras2)) == 0:
-            return False
-            
-        similitud = len(palabras1.intersection(palabras2)) / len(palabras1.union(palabras2))
-        return similitud >= 0.7
+        lock = self._lock_fuente()
+        if not lock.acquire(blocking=False):
+            return self._diferir_ingesta(message_ids)
 
-    # Función para validar si el token existe y si está vigente
-    def validar_existencia_token(self, result: dict):
-        
-        # Si hay un token en BD, validar si aún está vigente
-        if result:
-            fecha_vencimiento_str = result.get('fecha_vencimiento')
-            if fecha_vencimiento_str:
-                # Convertir string a datetime si es necesario
-                if isinstance(fecha_vencimiento_str, str):
-                    fecha_vencimiento = datetime.fromisoformat(fecha_vencimiento_str.replace('Z', '+00:00'))
-                else:
-                    fecha_vencimiento = fecha_vencimiento_str
-                
-                # Comparar con tiempo actual
-                ahora = datetime.now()
-                print(f"Fecha vencimiento: {fecha_vencimiento}")
-                print(f"Fecha actual: {ahora}")
-                
-                if ahora < fecha_vencimiento:
-                    # Token aún vigente
-                    print("Token vigente, retornando desde BD")
-                    return result['token']
-                else:
-                    # Token expirado, desactivar
-                    print("Token expirado, desactivando...")
-                    token_id = result.get('id')
-                    if token_id:
-                        # Crear nueva instancia de Querys para desactivar token
-                        self.querys.desactivar_token(token_id)
-                        print(f"Token {token_id} desactivado")
-
-        # Si no hay token válido, obtener uno nuevo desde Microsoft Graph
-        print("Obteniendo nuevo token desde Microsoft Graph API...")
-        return self._crear_nuevo_token()
+        try:
+            if not self.querys.adquirir_lease_sync(self.buzon, self.carpeta, LEASE_OWNER, SYNC_LEASE_SEGUNDOS):
+                return self._diferir_ingesta(message_ids)
 
-    # Función para obtener el ID de una carpeta específica
-    def get_folder_id(self, target_folder: str):
+            try:
+                return self._ingerir_correos(message_ids)
+            finally:
+                self.querys.liberar_lease_sync(self.buzon, self.carpeta, LEASE_OWNER)
 
-        """Obtiene el ID de una carpeta específica dentro del correo del usuario."""
-        result = None
-        url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/mailFolders/{target_folder}"
-        data = self._make_request(url)
-        if data:
-            result = data['id']
-        return result
+        finally:
+            lock.release()
+
+    # Helper para dejar los correos notificados a la siguiente ronda delta
+    def _diferir_ingesta(self, message_ids):
+        """La ronda delta trae los mismos correos; se solicita una para no esperar el intervalo"""
+        print(f"Sync en curso en {self.buzon}:{self.carpeta}, {len(message_ids)} correos notificados quedan para la ronda delta")
+        sync_worker.solicitar_sync()
+        return {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0,
+                'diferidos': len(message_ids)}
 
-    # Función para extraer correos de una carpeta específica
-    def extraer_correos(self, folder_id: str):
-        """Recupera correos electrónicos de una carpeta específica."""
-        emails = []
-        max_iterations = 100
+    # Helper que trae y procesa los correos notificados (con el lease de la fuente tomado)
+    def _ingerir_correos(self, message_ids):
+        self.token = graph_token.obtener(self.db)
+        if not self.token:
+            raise CustomException("No se pudo obtener token de acceso.")
+
+        respuestas = graph_client.batch(self.token, [
+            {
+                'id': indice,
+                'method': 'GET',
+                'url': f"{MICROSOFT_URL_GRAPH}{self.buzon}/messages/{message_id}?$select={self._campos_select()}"
+            }
+            for indice, message_id in enumerate(message_ids)
+        ])
+
+        emails = [
+            respuesta['body'] for respuesta in respuestas.values()
+            if respuesta.get('status') == 200 and respuesta.get('body')
+        ]
+        emails = [email for email in emails if not reglas_exclusion.excluir(email)]
+
+        if not emails:
+            return {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0}
+
+        return self._procesar_lote_correos(emails)
+
+    # Función para extraer correos de una carpeta específica usando delta query
+    def extraer_correos(self, folder_id: str, delta_link: str = None):
+        """
+        Generador que recupera correos de una carpeta usando messages/delta de Microsoft Graph
+        y entrega una página a la vez como un dict:
+        - correos: correos de la página (sin spam/automáticos)
+        - eliminados: ids que Graph reporta como @removed (eliminados o movidos de la carpeta)
+        - ids: todos los ids presentes en la página (incluidos los excluidos)
+        - delta_link / next_link
+        - Sin delta_link: ronda inicial, enumera todos los correos de la carpeta
+        - Con delta_link: solo trae los correos creados/modificados desde esa ronda
+          (también acepta el nextLink de un checkpoint para reanudar una ronda)
+        delta_link es None salvo en la última página de la ronda; next_link es la URL de
+        la página siguiente (None en la última).
+        Lanza CustomException si falla una petición, para no dar la ronda por terminada.
+        """
+        max_iterations = 1000
         iteration = 0
 
-        if folder_id:
-            url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/mailFolders/{folder_id}/messages?$top=100&$select=from,subject,receivedDateTime,bodyPreview,body,conversationId,id,hasAttachments"
+        if not folder_id:
+            return
+
+        url = delta_link or (
+            f"{MICROSOFT_URL_GRAPH}{self.buzon}/mailFolders/{folder_id}/messages/delta?$select={self._campos_select()}"
+        )
+        # En delta el tamaño de página se controla con Prefer en lugar de $top
+        headers = {'Prefer': 'odata.maxpagesize=100'}
 
-            while url and iteration < max_iterations:
-                print(f"Haciendo solicitud a: {url}")
-                data = self._make_request(url)
-                if not data:
-                    break
+        while url and iteration < max_iterations:
+            print(f"Haciendo solicitud a: {url}")
+            data = self._make_request(url, headers)
+            if data is None:
+                raise CustomException("Error consultando correos en Microsoft Graph.")
 
-                new_emails = data.get('value', [])
-                if not new_emails:
-                    print("No se recuperaron nuevos correos. Deteniendo.")
-                    break
+            valores = data.get('value', [])
 
-                emails.extend(new_emails)
-                url = data.get('@odata.nextLink')  # Paginación
-                iteration += 1
+            # La última página trae @odata.deltaLink en lugar de @odata.nextLink
+            url = data.get('@odata.nextLink')
+            iteration += 1
 
-        return emails
+            # Los correos spam/automáticos se descartan antes de preparar datos, hilos y hashes
+            yield {
+                'correos': [
+                    email for email in valores
+                    if '@removed' not in email and not reglas_exclusion.excluir(email)
+                ],
+                'eliminados': [
+                    email['id'] for email in valores
+                    if '@removed' in email and email.get('id')
+                ],
+                'ids': [email['id'] for email in valores if '@removed' not in email and email.get('id')],
+                'delta_link': data.get('@odata.deltaLink'),
+                'next_link': url
+            }
 
     # Función para realizar peticiones a la API de Microsoft Graph
-    def _make_request(self, endpoint):
+    def _make_request(self, endpoint, headers_extra=None):
         """Realiza una petición GET a Microsoft Graph API."""
+        self.ultimo_status_graph = None
         if not self.token:
             print("No se pudo obtener el token de acceso.")
             return None
 
         headers = {'Authorization': f'Bearer {self.token}'}
-        response = requests.get(endpoint, headers=headers)
+        if headers_extra:
+            headers.update(headers_extra)
+        response = graph_client.get(endpoint, headers=headers)
+        self.ultimo_status_graph = response.status_code
 
         if response.status_code == 200:
             return response.json()
+        if response.status_code == 401:
+            # Token revocado o vencido antes de tiempo: forzar renovación en la próxima llamada
+            graph_token.invalidar()
         print(f"Error en la solicitud: {response.status_code} - {response.text}")
         return None
 
-    # Función para crear un nuevo token desde Microsoft Graph API
-    def _crear_nuevo_token(self):
-        """Crea un nuevo token desde Microsoft Graph API."""
-        url = f"{MICROSOFT_URL}{MICROSOFT_TENANT_ID}/oauth2/v2.0/token"
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        data = {
-            'client_id': MICROSOFT_CLIENT_ID,
-            'scope': ' '.join(MICROSOFT_API_SCOPE),
-            'client_secret': MICROSOFT_CLIENT_SECRET,
-            'grant_type': 'client_credentials'
-        }
-        response = requests.post(url, headers=headers, data=data)
-        if response.status_code == 200:
-            token = response.json().get('access_token')
-            expires_in = response.json().get('expires_in')
-            
-            data_insert = {
-                "token": token,
-                "fecha_vencimiento": datetime.now() + timedelta(seconds=expires_in)
-            }
-            # Crear nueva instancia de Querys para insertar token
-            self.querys.insertar_datos(TokenModel, data_insert)
-            return token
-        
-        print(f"Error obteniendo el token: {response.status_code} - {response.text}")
-        return None
+    # Helper para obtener el buzón de origen de un correo (buzón principal si no está registrado)
+    def _buzon_correo(self, message_id):
+        return self.querys.obtener_buzones_correos([message_id]).get(message_id) or EMAIL_USER
 
     # Función para obtener los attachments de un correo específico
     def obtener_attachments(self, data: dict):
         
         messageId = data['messageId']
-        self.token = data['token']
+        self.token = data.get('token')
         attachments = list()
 
+        # La bandeja ya no entrega el token al frontend: obtenerlo en el servidor si no llega
+        if not self.token:
+            self.token = graph_token.obtener(self.db)
+
         if messageId:
-            url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{messageId}/attachments"
+            url = f"{MICROSOFT_URL_GRAPH}{self._buzon_correo(messageId)}/messages/{messageId}/attachments"
             data = self._make_request(url)
             if data:
                 attachments = data.get('value', [])
 
         return self.tools.output(200, "Datos encontrados.", attachments)
     
+    # Función para obtener los metadatos de attachments de varios correos
+    def obtener_attachments_lote(self, data: dict):
+        """
+        Retorna los metadatos (sin contenido) de los attachments de varios correos:
+        {messageId: [attachments]}. Se sirven desde intranet_correos_adjuntos (capturados
+        durante la sincronización); solo los correos sin attachments registrados se
+        consultan a Graph con JSON $batch y quedan guardados para las siguientes consultas.
+        """
+        message_ids = [message_id for message_id in data.get('messageIds', []) if message_id]
+
+        if not message_ids:
+            return self.tools.output(400, "messageIds es requerido.", {})
+
+        attachments = self.querys.obtener_adjuntos_correos(message_ids)
+        pendientes = [message_id for message_id in message_ids if message_id not in attachments]
+
+        if pendientes:
+            self.token = graph_token.obtener(self.db)
+
+            if not self.token:
+                return self.tools.output(400, "No se pudo obtener token de acceso.", {})
+
+            desde_graph = self._obtener_metadatos_adjuntos(
+                pendientes, self.querys.obtener_buzones_correos(pendientes)
+            )
+            self.querys.guardar_adjuntos_correos(desde_graph)
+
+            for message_id in pendientes:
+                attachments[message_id] = desde_graph.get(message_id, [])
+
+        return self.tools.output(200, "Datos encontrados.", attachments)
+
+    # Helper para obtener desde Graph los metadatos de attachments de varios correos con JSON $batch
+    def _obtener_metadatos_adjuntos(self, message_ids, buzones=None):
+        """
+        Una ida y vuelta por cada 20 correos. buzones: {message_id: buzon}; los correos
+        sin buzón usan el de esta instancia.
+        Returns: {message_id: [attachments]} solo con los correos consultados con éxito
+        """
+        if not message_ids:
+            return {}
+
+        buzones = buzones or {}
+        respuestas = graph_client.batch(self.token, [
+            {
+                'id': indice,
+                'method': 'GET',
+                'url': f"{MICROSOFT_URL_GRAPH}{buzones.get(message_id, self.buzon)}/messages/{message_id}/attachments"
+                       "?$select=id,name,contentType,size,isInline"
+            }
+            for indice, message_id in enumerate(message_ids)
+        ])
+
+        attachments = dict()
+        for indice, message_id in enumerate(message_ids):
+            respuesta = respuestas.get(str(indice), {})
+            if respuesta.get('status') == 200:
+                attachments[message_id] = (respuesta.get('body') or {}).get('value', [])
+            else:
+                print(f"Error obteniendo attachments de {message_id}: {respuesta.get('status')}")
+
+        return attachments
+
+    # Función para completar desde Graph el conversation_id de correos antiguos
+    def completar_conversation_ids(self, data: dict):
+        """
+        Backfill de conversation_id para correos guardados antes de que se almacenara.
+        Consulta Graph en lotes $batch y actualiza la BD en una sola sentencia por lote.
+        - desde_id: siguiente_desde_id de la llamada anterior; el backfill avanza hacia los
+          correos más antiguos aunque algunos fallen (error de red, 403) y sigan pendientes
+        """
+        limite = int(data.get('limite', 500))
+        desde_id = data.get('desde_id')
+
+        pendientes = self.querys.obtener_message_ids_sin_conversation(limite, desde_id)
+        if not pendientes:
+            return self.tools.output(200, "No hay correos pendientes de conversation_id.", {
+                'actualizados': 0,
+                'siguiente_desde_id': None
+            })
+        message_ids = [message_id for _, message_id in pendientes]
+
+        self.token = graph_token.obtener(self.db)
+        if not self.token:
+            return self.tools.output(400, "No se pudo obtener token de acceso.", {})
+
+        buzones = self.querys.obtener_buzones_correos(message_ids)
+        respuestas = graph_client.batch(self.token, [
+            {
+                'id': indice,
+                'method': 'GET',
+                'url': f"{MICROSOFT_URL_GRAPH}{buzones.get(message_id, EMAIL_USER)}/messages/{message_id}?$select=conversationId"
+            }
+            for indice, message_id in enumerate(message_ids)
+        ])
+
+        conversation_ids = dict()
+        for indice, message_id in enumerate(message_ids):
+            respuesta = respuestas.get(str(indice), {})
+            conversation_id = (respuesta.get('body') or {}).get('conversationId')
+            if respuesta.get('status') == 200 and conversation_id:
+                conversation_ids[message_id] = conversation_id
+            elif respuesta.get('status') in (200, 404):
+                # El correo ya no existe en el buzón o Graph no tiene su conversación:
+                # marcarlo para no volver a consultarlo
+                conversation_ids[message_id] = ''
+
+        actualizados = self.querys.actualizar_conversation_ids(conversation_ids)
+        return self.tools.output(200, "conversation_id completados.", {
+            'consultados': len(message_ids),
+            'actualizados': actualizados,
+            'fallidos': len(message_ids) - len(conversation_ids),
+            # Último lote: no quedan correos más antiguos por consultar en esta pasada
+            'siguiente_desde_id': pendientes[-1][0] if len(pendientes) == limite else None
+        })
+
+    # Función para obtener el cuerpo completo de un correo (carga diferida con caché en BD)
+    def obtener_cuerpo_correo(self, data: dict):
+        """
+        Retorna el cuerpo completo de un correo. La primera vez que se abre se trae
+        desde Microsoft Graph y se guarda en BD; las siguientes se sirve desde BD.
+        """
+        message_id = data.get('messageId') or data.get('message_id')
+
+        if not message_id:
+            return self.tools.output(400, "messageId es requerido.", {})
+
+        try:
+            correo = self.querys.obtener_correo_por_message_id(message_id)
+            if not correo:
+                return self.tools.output(404, "Correo no encontrado.", {})
+
+            if correo.get('body_cargado') or correo.get('body_content'):
+                return self.tools.output(200, "Cuerpo del correo obtenido desde BD.", {
+                    'messageId': message_id,
+                    'body': correo.get('body_content') or ''
+                })
+
+            # Obtener el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
+
+            if not self.token:
+                return self.tools.output(400, "No se pudo obtener token de acceso.", {})
+
+            body_content = self._cargar_cuerpo_desde_graph(message_id, correo.get('buzon'))
+            if body_content is None:
+                return self.tools.output(404, "No se pudo obtener el cuerpo del correo desde Graph.", {})
+
+            return self.tools.output(200, "Cuerpo del correo obtenido desde Graph.", {
+                'messageId': message_id,
+                'body': body_content
+            })
+
+        except Exception as e:
+            print(f"Error obteniendo cuerpo del correo: {e}")
+            return self.tools.output(500, "Error obteniendo cuerpo del correo.", {})
+
+    # Helper para traer desde Graph el cuerpo de un correo y guardarlo en BD
+    def _cargar_cuerpo_desde_graph(self, message_id, buzon=None):
+        """Retorna el contenido HTML del cuerpo o None si Graph no lo entrega (requiere self.token)"""
+        url = f"{MICROSOFT_URL_GRAPH}{buzon or EMAIL_USER}/messages/{message_id}?$select=body"
+        data_graph = self._make_request(url)
+        if not data_graph:
+            return None
+
+        body_content = (data_graph.get('body') or {}).get('content', '')
+        self.querys.guardar_cuerpo_correo(message_id, body_content)
+        return body_content
+
+    # Función para obtener el detalle completo de un ticket o correo (incluye el cuerpo)
+    def obtener_detalle_ticket(self, data: dict):
+        """
+        Los listados no incluyen el cuerpo de los correos; este detalle lo entrega junto con
+        los nombres de estado, técnico, prioridad y tipos. Recibe ticket_id o message_id.
+        Si el cuerpo aún no está en BD (sync de solo metadatos) se trae desde Graph.
+        """
+        ticket_id = data.get('ticket_id')
+        message_id = data.get('message_id') or data.get('messageId')
+
+        if not ticket_id and not message_id:
+            return self.tools.output(400, "Se requiere ticket_id o message_id.", {})
+
+        try:
+            detalle = self.querys.obtener_detalle_ticket(ticket_id, message_id)
+            if not detalle:
+                return self.tools.output(404, "Ticket no encontrado.", {})
+
+            if not detalle['bodyLoaded']:
+                self.token = graph_token.obtener(self.db)
+                body_content = self._cargar_cuerpo_desde_graph(detalle['id'], detalle.get('buzon')) if self.token else None
+                if body_content is not None:
+                    detalle['body'] = body_content
+                    detalle['bodyLoaded'] = True
+
+            return self.tools.output(200, "Detalle del ticket obtenido.", detalle)
+
+        except Exception as e:
+            print(f"Error obteniendo detalle del ticket: {e}")
+            return self.tools.output(500, "Error obteniendo detalle del ticket.", {})
+
     # Función para obtener correos solo desde BD (sin sincronizar)
-    def obtener_correos_bd_solo(self, limite=100, offset=0, estado=None):
+    def obtener_correos_bd_solo(self, limite=100, offset=0, estado=None, cursor=None):
         """
         Obtiene correos únicamente desde la base de datos sin sincronizar
-        Útil para cargas rápidas y paginación
+        Útil para cargas rápidas y paginación (por offset o por cursor keyset)
         """
         try:
-            correos = self.querys.obtener_correos_bd(limite, offset, estado)
+            cursor = self.tools.decodificar_cursor(cursor) if cursor else None
+            pagina = self.querys.obtener_pagina_correos_bd(limite, offset, estado, cursor)
             ultimo_sync = self.querys.obtener_ultimo_sync_exitoso()
             
             result = {
-                'emails': correos,
+                'emails': pagina['emails'],
                 'ultimo_sync': ultimo_sync,
-                'total_mostrados': len(correos)
+                'total_mostrados': len(pagina['emails']),
+                'siguiente_cursor': pagina['siguiente_cursor']
             }
             
             return self.tools.output(200, "Correos obtenidos desde BD.", result)
+
+        except CustomException as e:
+            return self.tools.output(400, e.message, {'emails': []})
             
         except Exception as e:
             print(f"Error obteniendo correos desde BD: {e}")
@@ -553,9 +1121,13 @@ class Graph:
         limite = data.get('limite', 100)
         offset = data.get('offset', 0)
         tecnico_id = data.get('tecnico_id', None)
+        # incluir_total=False omite el conteo (scroll infinito)
+        incluir_total = data.get('incluir_total', True)
         
         try:
-            resultado = self.querys.obtener_tickets_correos(vista, limite, offset, tecnico_id)
+            # Cursor keyset opcional (siguiente_cursor de la página anterior); si llega, se ignora offset
+            cursor = self.tools.decodificar_cursor(data['cursor']) if data.get('cursor') else None
+            resultado = self.querys.obtener_tickets_correos(vista, limite, offset, tecnico_id, cursor, incluir_total)
             
             # Mensaje dinámico según filtros aplicados
             mensaje = f"Tickets obtenidos para vista '{vista}'"
@@ -563,6 +1135,9 @@ class Graph:
                 mensaje += f" filtrado por técnico ID {tecnico_id}"
             
             return self.tools.output(200, mensaje, resultado)
+
+        except CustomException as e:
+            return self.tools.output(400, e.message, {})
                 
         except Exception as e:
             print(f"Error obteniendo tickets de correos: {e}")
@@ -667,8 +1242,13 @@ class Graph:
         - vista: str - Vista base (todos, sin, abiertos, proceso, comp, tecnico_X)
         - limite: int - Límite de resultados
         - offset: int - Desplazamiento para paginación
+        - cursor: str - siguiente_cursor de la página anterior (paginación keyset, reemplaza offset)
+        - incluir_total: bool - False para no calcular el total (scroll infinito)
         """
         try:
+            # Cursor keyset opcional (siguiente_cursor de la página anterior); si llega, se ignora offset
+            cursor = self.tools.decodificar_cursor(data['cursor']) if data.get('cursor') else None
+
             # Extraer parámetros con nombres del frontend
             filtros = {
                 'vista': data.get('vista', 'todos'),
@@ -679,7 +1259,9 @@ class Graph:
                 'macroproceso': data.get('fMacro') if data.get('fMacro') else None,
                 'tipo_ticket': data.get('fTipoTicket') if data.get('fTipoTicket') else None,
                 'limite': data.get('limite', 100),
-                'offset': data.get('offset', 0)
+                'offset': data.get('offset', 0),
+                'cursor': cursor,
+                'incluir_total': data.get('incluir_total', True)
             }
             
             # Llamar al query optimizado
@@ -687,13 +1269,16 @@ class Graph:
             
             # Contar filtros activos para mensaje
             filtros_activos = sum(1 for k, v in filtros.items() 
-                                if k not in ['vista', 'limite', 'offset'] and v is not None)
+                                if k not in ['vista', 'limite', 'offset', 'cursor', 'incluir_total'] and v is not None)
             
             mensaje = f"Tickets filtrados para vista '{filtros['vista']}'"
             if filtros_activos > 0:
                 mensaje += f" con {filtros_activos} filtro(s) aplicado(s)"
             
             return self.tools.output(200, mensaje, resultado)
+
+        except CustomException as e:
+            return self.tools.output(400, e.message, {})
                 
         except Exception as e:
             print(f"Error filtrando tickets: {e}")
@@ -785,9 +1370,8 @@ class Graph:
             if not respuesta.strip():
                 return self.tools.output(400, "Se requiere contenido de la respuesta.", {})
             
-            # Obtener el token desde la base de datos
-            result = self.querys.get_token()
-            self.token = self.validar_existencia_token(result)
+            # Obtener el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
 
             if not self.token:
                 return self.tools.output(400, "No se pudo obtener token de acceso.", {})
@@ -816,13 +1400,14 @@ class Graph:
             }
 
             # Enviar respuesta usando Microsoft Graph API
-            url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages/{message_id}/reply"
+            buzon = correo_original.get('buzon') or EMAIL_USER
+            url = f"https://graph.microsoft.com/v1.0/users/{buzon}/messages/{message_id}/reply"
             headers = {
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = graph_client.post(url, headers=headers, json=payload)
 
             if response.status_code in [200, 202]:
                 # Registrar la respuesta en la base de datos
@@ -856,21 +1441,21 @@ class Graph:
             if not message_id:
                 return self.tools.output(400, "Se requiere message_id.", {})
             
-            # Obtener el token desde la base de datos
-            result = self.querys.get_token()
-            self.token = self.validar_existencia_token(result)
+            # Obtener el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
 
             if not self.token:
                 return self.tools.output(400, "No se pudo obtener token de acceso.", {})
 
             # Primero obtener el mensaje original para extraer el conversation ID
-            url_original = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages/{message_id}"
+            buzon = self._buzon_correo(message_id)
+            url_original = f"https://graph.microsoft.com/v1.0/users/{buzon}/messages/{message_id}"
             headers = {
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json"
             }
             
-            response_original = requests.get(url_original, headers=headers)
+            response_original = graph_client.get(url_original, headers=headers)
 
             if response_original.status_code != 200:
                 print(f"Error obteniendo mensaje original: {response_original.text}")
@@ -884,14 +1469,14 @@ class Graph:
 
             # Usar método robusto: obtener mensajes recientes y filtrar localmente
             # Esto evita el problema de filtros complejos en Microsoft Graph
-            url_conversacion = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages"
+            url_conversacion = f"https://graph.microsoft.com/v1.0/users/{buzon}/messages"
             params = {
                 "$top": "100",  # Aumentar para asegurar que capturemos toda la conversación
                 "$orderby": "receivedDateTime desc",
                 "$select": "id,conversationId,subject,from,receivedDateTime,body,isRead"
             }
             
-            response_hilo = requests.get(url_conversacion, headers=headers, params=params)
+            response_hilo = graph_client.get(url_conversacion, headers=headers, params=params)
             
             if response_hilo.status_code == 200:
                 todos_mensajes = response_hilo.json().get('value', [])
@@ -953,9 +1538,8 @@ class Graph:
                 "data": {}
             }
         
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
@@ -968,8 +1552,9 @@ class Graph:
             }
             
             # Obtener el correo original para saber a quién responder (usar usuario específico)
-            correo_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}"
-            response_correo = requests.get(correo_url, headers=headers_correo)
+            buzon = self._buzon_correo(message_id)
+            correo_url = f"{MICROSOFT_URL_GRAPH}{buzon}/messages/{message_id}"
+            response_correo = graph_client.get(correo_url, headers=headers_correo)
             
             if response_correo.status_code != 200:
                 print(f"Error obteniendo correo original - Status: {response_correo.status_code}")
@@ -978,35 +1563,9 @@ class Graph:
             correo_data = response_correo.json()
             
             # Preparar el mensaje de respuesta automática
-            mensaje_respuesta = f"""
-            <div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <h3 style="color: #0066cc;">Confirmación de Recepción - Ticket #{ticket_id}</h3>
-                
-                <p>Estimado/a {correo_data.get('from', {}).get('emailAddress', {}).get('name', 'usuario')},</p>
-                
-                <p>Hemos recibido su solicitud <strong>(ID: {ticket_id})</strong> y nuestro equipo de soporte la está revisando.</p>
-                
-                <p>Su solicitud será analizada y asignada al nivel de atención correspondiente.</p>
-                
-                <p>Si desea agregar comentarios adicionales, por favor responda a este correo electrónico.</p>
-                
-                <div style="margin: 20px 0; padding: 15px; background-color: #f8f9fa; border-left: 4px solid #dc3545; border-radius: 4px;">
-                    <p style="margin: 0; font-size: 14px; color: #721c24;">
-                        <strong>⚠️ Nota importante:</strong> Este es un mensaje automático generado por el sistema. 
-                        Para cualquier consulta adicional sobre su ticket, responda directamente a este correo 
-                        o contacte a nuestro equipo de soporte.
-                    </p>
-                </div>
-                
-                <p style="margin-top: 30px;">
-                    Atentamente,<br>
-                    <strong>El equipo de soporte de Avantika</strong><br>
-                    <span style="font-size: 12px; color: #666;">
-                        Avántika Colombia S.A.S | Gestión de Tecnologías de la Información
-                    </span>
-                </p>
-            </div>
-            """
+            mensaje_respuesta = self._html_respuesta_automatica(
+                ticket_id, correo_data.get('from', {}).get('emailAddress', {}).get('name', 'usuario')
+            )
             
             # Preparar datos para la respuesta
             reply_data = {
@@ -1014,7 +1573,7 @@ class Graph:
             }
             
             # URL para responder al correo (usar usuario específico)
-            reply_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}/reply"
+            reply_url = f"{MICROSOFT_URL_GRAPH}{buzon}/messages/{message_id}/reply"
             
             # Enviar la respuesta
             headers_reply = {
@@ -1022,7 +1581,7 @@ class Graph:
                 'Content-Type': 'application/json'
             }
             
-            response_reply = requests.post(reply_url, json=reply_data, headers=headers_reply)
+            response_reply = graph_client.post(reply_url, json=reply_data, headers=headers_reply)
             
             if response_reply.status_code == 202:
                 return self.tools.output(200, "Respuesta automática enviada exitosamente.", {
@@ -1064,46 +1623,15 @@ class Graph:
         if not message_id_clean or len(message_id_clean) < 10:
             return self.tools.output(400, f"Message ID inválido: '{message_id_clean}'")
             
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
             
         try:
             # Preparar el mensaje de respuesta automática con datos desde frontend
-            mensaje_respuesta = f"""
-            <div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <h3 style="color: #0066cc;">Confirmación de Recepción - Ticket #{ticket_id}</h3>
-                
-                <p>Estimado/a {from_name},</p>
-                
-                <p>Hemos recibido su solicitud <strong>(ID: {ticket_id})</strong> y nuestro equipo de soporte la está revisando.</p>
-                
-                <p><strong>Asunto:</strong> {subject}</p>
-                
-                <p>Su solicitud será analizada y asignada al nivel de atención correspondiente.</p>
-                
-                <p>Si desea agregar comentarios adicionales, por favor responda a este correo electrónico.</p>
-                
-                <div style="margin: 20px 0; padding: 15px; background-color: #f8f9fa; border-left: 4px solid #dc3545; border-radius: 4px;">
-                    <p style="margin: 0; font-size: 14px; color: #721c24;">
-                        <strong>⚠️ Nota importante:</strong> Este es un mensaje automático generado por el sistema. 
-                        Para cualquier consulta adicional sobre su ticket, responda directamente a este correo 
-                        o contacte a nuestro equipo de soporte.
-                    </p>
-                </div>
-                
-                <p style="margin-top: 30px;">
-                    Atentamente,<br>
-                    <strong>El equipo de soporte de Avantika</strong><br>
-                    <span style="font-size: 12px; color: #666;">
-                        Avántika Colombia S.A.S | Gestión de Tecnologías de la Información
-                    </span>
-                </p>
-            </div>
-            """
+            mensaje_respuesta = self._html_respuesta_automatica(ticket_id, from_name, subject)
             
             # Preparar datos para la respuesta
             reply_data = {
@@ -1111,7 +1639,7 @@ class Graph:
             }
             
             # URL para responder al correo (usar usuario específico)
-            reply_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}/reply"
+            reply_url = f"{MICROSOFT_URL_GRAPH}{self._buzon_correo(message_id_clean)}/messages/{message_id}/reply"
             
             # Enviar la respuesta
             headers_reply = {
@@ -1119,7 +1647,7 @@ class Graph:
                 'Content-Type': 'application/json'
             }
             
-            response_reply = requests.post(reply_url, json=reply_data, headers=headers_reply)
+            response_reply = graph_client.post(reply_url, json=reply_data, headers=headers_reply)
             
             if response_reply.status_code == 202:
                 print(f"✅ Respuesta automática optimizada enviada para ticket {ticket_id} a {from_email}")
@@ -1137,6 +1665,117 @@ class Graph:
             print(f"Error enviando respuesta automática optimizada: {e}")
             return self.tools.output(500, f"Error interno del servidor: {str(e)}")
 
+    # Función para construir el HTML de la respuesta automática de confirmación de ticket
+    def _html_respuesta_automatica(self, ticket_id, nombre, subject=None):
+        linea_asunto = f"""
+                <p><strong>Asunto:</strong> {subject}</p>
+                """ if subject is not None else ""
+
+        return f"""
+            <div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+                <h3 style="color: #0066cc;">Confirmación de Recepción - Ticket #{ticket_id}</h3>
+                
+                <p>Estimado/a {nombre},</p>
+                
+                <p>Hemos recibido su solicitud <strong>(ID: {ticket_id})</strong> y nuestro equipo de soporte la está revisando.</p>
+                {linea_asunto}
+                <p>Su solicitud será analizada y asignada al nivel de atención correspondiente.</p>
+                
+                <p>Si desea agregar comentarios adicionales, por favor responda a este correo electrónico.</p>
+                
+                <div style="margin: 20px 0; padding: 15px; background-color: #f8f9fa; border-left: 4px solid #dc3545; border-radius: 4px;">
+                    <p style="margin: 0; font-size: 14px; color: #721c24;">
+                        <strong>⚠️ Nota importante:</strong> Este es un mensaje automático generado por el sistema. 
+                        Para cualquier consulta adicional sobre su ticket, responda directamente a este correo 
+                        o contacte a nuestro equipo de soporte.
+                    </p>
+                </div>
+                
+                <p style="margin-top: 30px;">
+                    Atentamente,<br>
+                    <strong>El equipo de soporte de Avantika</strong><br>
+                    <span style="font-size: 12px; color: #666;">
+                        Avántika Colombia S.A.S | Gestión de Tecnologías de la Información
+                    </span>
+                </p>
+            </div>
+            """
+
+    # Función para enviar respuestas automáticas de varios tickets con JSON $batch
+    def enviar_respuestas_automaticas_lote(self, data: dict):
+        """
+        Envía la confirmación de recepción de varios tickets agrupando las llamadas
+        a Graph en peticiones $batch (hasta 20 operaciones por petición).
+        Recibe {'tickets': [{'message_id', 'ticket_id', 'from_name'?, 'subject'?}, ...]};
+        los tickets sin from_name se completan con un GET en lote del correo original.
+        """
+        tickets = [
+            ticket for ticket in data.get('tickets', [])
+            if ticket.get('message_id') and ticket.get('ticket_id')
+        ]
+
+        if not tickets:
+            return self.tools.output(400, "Se requiere una lista de tickets con message_id y ticket_id.", {})
+
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
+
+        if not self.token:
+            return self.tools.output(400, "No se pudo obtener token de acceso.", {})
+
+        try:
+            buzones = self.querys.obtener_buzones_correos([ticket['message_id'] for ticket in tickets])
+
+            # 1. Completar remitente/asunto de los tickets que no los traen
+            sin_datos = [ticket for ticket in tickets if not ticket.get('from_name')]
+            if sin_datos:
+                respuestas = graph_client.batch(self.token, [
+                    {
+                        'id': indice,
+                        'method': 'GET',
+                        'url': f"{MICROSOFT_URL_GRAPH}{buzones.get(ticket['message_id'], EMAIL_USER)}/messages/{ticket['message_id']}?$select=from,subject"
+                    }
+                    for indice, ticket in enumerate(sin_datos)
+                ])
+                for indice, ticket in enumerate(sin_datos):
+                    body = respuestas.get(str(indice), {}).get('body') or {}
+                    ticket['from_name'] = body.get('from', {}).get('emailAddress', {}).get('name', 'usuario')
+                    ticket.setdefault('subject', body.get('subject'))
+
+            # 2. Enviar todas las respuestas en lote
+            respuestas = graph_client.batch(self.token, [
+                {
+                    'id': indice,
+                    'method': 'POST',
+                    'url': f"{MICROSOFT_URL_GRAPH}{buzones.get(ticket['message_id'], EMAIL_USER)}/messages/{ticket['message_id']}/reply",
+                    'body': {
+                        'comment': self._html_respuesta_automatica(
+                            ticket['ticket_id'], ticket.get('from_name') or 'usuario', ticket.get('subject')
+                        )
+                    }
+                }
+                for indice, ticket in enumerate(tickets)
+            ])
+
+            resultados = list()
+            for indice, ticket in enumerate(tickets):
+                status = respuestas.get(str(indice), {}).get('status')
+                if status != 202:
+                    print(f"❌ Error enviando respuesta automática del ticket {ticket['ticket_id']} - Status: {status}")
+                resultados.append({
+                    'ticket_id': ticket['ticket_id'],
+                    'message_id': ticket['message_id'],
+                    'status': 'enviado' if status == 202 else 'error',
+                    'codigo': status
+                })
+
+            enviados = sum(1 for resultado in resultados if resultado['status'] == 'enviado')
+            return self.tools.output(200, f"Respuestas automáticas enviadas: {enviados} de {len(resultados)}.", resultados)
+
+        except Exception as e:
+            print(f"Error enviando respuestas automáticas en lote: {e}")
+            return self.tools.output(500, f"Error interno del servidor: {str(e)}", {})
+
     # Función para enviar un nuevo correo automático en lugar de responder al original
     def enviar_correo_nuevo_automatico(self, data):
         """
@@ -1151,9 +1790,8 @@ class Graph:
         if not ticket_id or not from_email:
             return self.tools.output(400, "Se requieren ticket_id y from_email")
 
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
@@ -1224,7 +1862,7 @@ class Graph:
             }
             
 
-            response_send = requests.post(send_url, json=email_data, headers=headers_send)
+            response_send = graph_client.post(send_url, json=email_data, headers=headers_send)
             if response_send.status_code != 202:
                 print(f"📋 Response body: {response_send.text}")
             
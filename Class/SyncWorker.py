@@ -0,0 +1,191 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from Config.db import session_maker
+from Utils.querys import Querys
+
+from Utils.constants import (
+    SYNC_INTERVALO_SEGUNDOS, SYNC_AUTOMATICO, SYNC_FUENTES, SYNC_MAX_CONCURRENCIA, EMAIL_USER, TARGET_FOLDER
+)
+
+# Función para sincronizar una fuente (buzón/carpeta) con su propia sesión de BD
+def _sincronizar_fuente(buzon, carpeta, forzar=False, suscribir=False):
+    # Import diferido: Class.Graph importa este módulo
+    from Class.Graph import Graph
+
+    db = session_maker()
+    try:
+        graph = Graph(db, buzon, carpeta)
+        if suscribir:
+            graph.asegurar_suscripcion()
+        return graph.ejecutar_sincronizacion(forzar)
+    finally:
+        db.close()
+
+# Función para sincronizar en paralelo todos los buzones/carpetas configurados
+def sincronizar_fuentes(forzar=False, suscribir=False, fuentes=None):
+    """
+    Sincroniza cada fuente de SYNC_FUENTES en paralelo (hasta SYNC_MAX_CONCURRENCIA hilos).
+    Cada fuente usa su propia sesión de BD, lease y deltaLink, así un buzón lento o con
+    error no retrasa ni bloquea a los demás.
+    Returns: {"buzon:carpeta": resultado de ejecutar_sincronizacion o {'error': mensaje}}
+    """
+    fuentes = fuentes or SYNC_FUENTES
+    resultados = dict()
+    hilos = max(1, min(SYNC_MAX_CONCURRENCIA, len(fuentes)))
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="sync-fuente") as pool:
+        futuros = {
+            (buzon, carpeta): pool.submit(_sincronizar_fuente, buzon, carpeta, forzar, suscribir)
+            for buzon, carpeta in fuentes
+        }
+
+        for (buzon, carpeta), futuro in futuros.items():
+            try:
+                resultados[f"{buzon}:{carpeta}"] = futuro.result()
+            except Exception as e:
+                print(f"Error sincronizando {buzon}:{carpeta}: {e}")
+                print(traceback.extract_tb(e.__traceback__))
+                resultados[f"{buzon}:{carpeta}"] = {'error': str(e)}
+
+    return resultados
+
+class SyncWorker:
+    """
+    Sincronizador de correos en segundo plano.
+    Ejecuta la sincronización con Microsoft Graph fuera del ciclo de las peticiones HTTP:
+    - Periódicamente cada SYNC_INTERVALO_SEGUNDOS (respaldo de las notificaciones), solo con SYNC_AUTOMATICO
+    - Bajo demanda con solicitar_sync (p. ej. desde /obtener_correos)
+    - Ingesta puntual de los correos avisados por notificaciones de Graph (encolar_mensajes)
+    """
+
+    def __init__(self, intervalo=SYNC_INTERVALO_SEGUNDOS, automatico=SYNC_AUTOMATICO):
+        self.intervalo = intervalo
+        self.automatico = automatico  # Sync periódico; sin él solo se atienden solicitudes e ingestas
+        self.en_curso = False
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._detener = threading.Event()
+        self._forzar = False
+        self._sync_solicitado = False
+        self._mensajes_pendientes = dict()  # suscripcion_id -> set de message_ids
+        self._hilo = None
+
+    # Función para iniciar el hilo del worker
+    def iniciar(self, sync_inicial=True):
+        """Inicia el hilo de sincronización (si no está corriendo) y dispara un primer sync"""
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, name="sync-correos", daemon=True)
+            self._hilo.start()
+
+        if sync_inicial:
+            self.solicitar_sync()
+
+    # Función para detener el hilo del worker
+    def detener(self):
+        """Detiene el hilo de sincronización al terminar el ciclo en curso"""
+        self._detener.set()
+        self._evento.set()
+
+    # Función para solicitar un sync bajo demanda
+    def solicitar_sync(self, forzar=False):
+        """
+        Despierta al worker para que sincronice de inmediato (sin bloquear al llamador).
+        Sin sync automático el hilo no está corriendo: se inicia para atender la solicitud
+        (no hace sync periódico)
+        """
+        with self._lock:
+            self._forzar = self._forzar or forzar
+            self._sync_solicitado = True
+
+        self.iniciar(sync_inicial=False)
+        self._evento.set()
+
+    # Función para saber si hay un sync en curso o solicitado y aún no iniciado
+    def sync_pendiente(self):
+        with self._lock:
+            return self.en_curso or self._sync_solicitado
+
+    # Función para encolar correos avisados por notificaciones de Graph
+    def encolar_mensajes(self, message_ids, suscripcion_id=None):
+        """
+        Encola message_ids para traerlos puntualmente desde Graph (sin sync completo).
+        La suscripción indica de qué buzón/carpeta vienen.
+        """
+        if not message_ids:
+            return
+
+        with self._lock:
+            self._mensajes_pendientes.setdefault(suscripcion_id, set()).update(message_ids)
+
+        # Sin sync automático el hilo no está corriendo: iniciarlo solo para la ingesta
+        self.iniciar(sync_inicial=False)
+        self._evento.set()
+
+    # Ciclo principal: espera el intervalo o una solicitud y sincroniza
+    def _ciclo(self):
+        while not self._detener.is_set():
+            despertado = self._evento.wait(timeout=self.intervalo if self.automatico else None)
+            if self._detener.is_set():
+                break
+
+            self._evento.clear()
+            with self._lock:
+                forzar, self._forzar = self._forzar, False
+                sync_solicitado, self._sync_solicitado = self._sync_solicitado, False
+                # Se marca en curso al tomar la solicitud para que sync_pendiente no quede en falso
+                self.en_curso = sync_solicitado
+                pendientes, self._mensajes_pendientes = self._mensajes_pendientes, dict()
+
+            for suscripcion_id, message_ids in pendientes.items():
+                self._ejecutar_ingesta(suscripcion_id, list(message_ids))
+
+            # Vencido el intervalo sin avisos se sincroniza igual (respaldo de las notificaciones)
+            if sync_solicitado or (self.automatico and not despertado):
+                self._ejecutar(forzar)
+
+    # Ejecuta la sincronización de todas las fuentes (cada una con su propia sesión de BD)
+    def _ejecutar(self, forzar=False):
+        self.en_curso = True
+        try:
+            resultados = sincronizar_fuentes(forzar, suscribir=True)
+            for fuente, resultado in resultados.items():
+                if 'error' in resultado:
+                    continue
+                print(f"Sync en segundo plano de {fuente} ({resultado['tipo_sync']}) completado: {resultado['sync_stats']}")
+
+        except Exception as e:
+            print(f"Error en sync en segundo plano: {e}")
+            print(traceback.extract_tb(e.__traceback__))
+
+        finally:
+            self.en_curso = False
+
+    # Trae desde Graph solo los correos notificados, con su propia sesión de BD
+    def _ejecutar_ingesta(self, suscripcion_id, message_ids):
+        from Class.Graph import Graph
+
+        db = session_maker()
+        try:
+            # Fuente dueña de la suscripción; si no se conoce, el buzón principal
+            estado_sync = Querys(db).obtener_estado_sync_por_suscripcion(suscripcion_id) if suscripcion_id else None
+            buzon, carpeta = EMAIL_USER, TARGET_FOLDER
+            if estado_sync:
+                buzon, carpeta = estado_sync['buzon'], estado_sync['carpeta']
+
+            stats = Graph(db, buzon, carpeta).ingerir_correos_notificados(message_ids)
+            print(f"Ingesta por notificación de {len(message_ids)} correos de {buzon}:{carpeta}: {stats}")
+
+        except Exception as e:
+            print(f"Error en ingesta por notificación: {e}")
+            print(traceback.extract_tb(e.__traceback__))
+
+        finally:
+            db.close()
+
+
+sync_worker = SyncWorker()
@@ -1,14 +1,13 @@
-import requests
+from Utils.graph_client import graph_client
+from Utils.graph_token import graph_token
 from Utils.tools import Tools, CustomException
 from Utils.querys import Querys
-from Models.IntranetGraphTokenModel import IntranetGraphTokenModel as TokenModel
-from datetime import datetime, timedelta
+from datetime import datetime
 import hashlib
 import traceback
 
 from Utils.constants import (
-    MICROSOFT_CLIENT_ID, MICROSOFT_CLIENT_SECRET, MICROSOFT_TENANT_ID,
-    MICROSOFT_API_SCOPE, MICROSOFT_URL, MICROSOFT_URL_GRAPH, PARENT_FOLDER,
+    MICROSOFT_URL_GRAPH, PARENT_FOLDER,
     TARGET_FOLDER, EMAIL_USER
 )
 
@@ -20,58 +19,9 @@ class Tickets:
         self.querys = Querys(self.db)
         self.token = None
 
-    # Función auxiliar para validar token (compartida con Graph)
-    def validar_existencia_token(self, result: dict):
-        # Si hay un token en BD, validar si aún está vigente
-        if result:
-            fecha_vencimiento_str = result.get('fecha_vencimiento')
-            if fecha_vencimiento_str:
-                # Convertir string a datetime si es necesario
-                if isinstance(fecha_vencimiento_str, str):
-                    fecha_vencimiento = datetime.fromisoformat(fecha_vencimiento_str.replace('Z', '+00:00'))
-                else:
-                    fecha_vencimiento = fecha_vencimiento_str
-                
-                # Comparar con tiempo actual
-                ahora = datetime.now()
-                
-                if ahora < fecha_vencimiento:
-                    # Token aún vigente
-                    return result['token']
-                else:
-                    # Token expirado, desactivar
-                    token_id = result.get('id')
-                    if token_id:
-                        self.querys.desactivar_token(token_id)
-
-        # Si no hay token válido, obtener uno nuevo desde Microsoft Graph
-        return self._crear_nuevo_token()
-
-    # Función auxiliar para crear nuevo token
-    def _crear_nuevo_token(self):
-        """Crea un nuevo token desde Microsoft Graph API."""
-        url = f"{MICROSOFT_URL}{MICROSOFT_TENANT_ID}/oauth2/v2.0/token"
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        data = {
-            'client_id': MICROSOFT_CLIENT_ID,
-            'scope': ' '.join(MICROSOFT_API_SCOPE),
-            'client_secret': MICROSOFT_CLIENT_SECRET,
-            'grant_type': 'client_credentials'
-        }
-        response = requests.post(url, headers=headers, data=data)
-        if response.status_code == 200:
-            token = response.json().get('access_token')
-            expires_in = response.json().get('expires_in')
-            
-            data_insert = {
-                "token": token,
-                "fecha_vencimiento": datetime.now() + timedelta(seconds=expires_in)
-            }
-            self.querys.insertar_datos(TokenModel, data_insert)
-            return token
-        
-        print(f"Error obteniendo el token: {response.status_code} - {response.text}")
-        return None
+    # Helper para obtener el buzón de origen de un correo (buzón principal si no está registrado)
+    def _buzon_correo(self, message_id):
+        return self.querys.obtener_buzones_correos([message_id]).get(message_id) or EMAIL_USER
 
     # Función para convertir correo a ticket
     def convertir_correo_ticket(self, data: dict):
@@ -105,9 +55,13 @@ class Tickets:
         limite = data.get('limite', 100)
         offset = data.get('offset', 0)
         tecnico_id = data.get('tecnico_id', None)
+        # incluir_total=False omite el conteo (scroll infinito)
+        incluir_total = data.get('incluir_total', True)
         
         try:
-            resultado = self.querys.obtener_tickets_correos(vista, limite, offset, tecnico_id)
+            # Cursor keyset opcional (siguiente_cursor de la página anterior); si llega, se ignora offset
+            cursor = self.tools.decodificar_cursor(data['cursor']) if data.get('cursor') else None
+            resultado = self.querys.obtener_tickets_correos(vista, limite, offset, tecnico_id, cursor, incluir_total)
             
             # Mensaje dinámico según filtros aplicados
             mensaje = f"Tickets obtenidos para vista '{vista}'"
@@ -115,11 +69,20 @@ class Tickets:
                 mensaje += f" filtrado por técnico ID {tecnico_id}"
             
             return self.tools.output(200, mensaje, resultado)
+
+        except CustomException as e:
+            return self.tools.output(400, e.message, {})
                 
         except Exception as e:
             print(f"Error obteniendo tickets de correos: {e}")
             return self.tools.output(500, "Error obteniendo tickets.", {})
     
+    # Función para obtener el detalle completo de un ticket (incluye el cuerpo del correo)
+    def obtener_detalle_ticket(self, data: dict):
+        # Import diferido: el detalle comparte la carga del cuerpo desde Graph con la bandeja
+        from Class.Graph import Graph
+        return Graph(self.db).obtener_detalle_ticket(data)
+
     # Función para obtener estados de tickets
     def obtener_estados_tickets(self):
         """
@@ -210,6 +173,9 @@ class Tickets:
         Filtra tickets usando los campos reales de la tabla intranet_correos_microsoft
         """
         try:
+            # Cursor keyset opcional (siguiente_cursor de la página anterior); si llega, se ignora offset
+            cursor = self.tools.decodificar_cursor(data['cursor']) if data.get('cursor') else None
+
             # Extraer parámetros con nombres del frontend
             filtros = {
                 'vista': data.get('vista', 'todos'),
@@ -220,7 +186,9 @@ class Tickets:
                 'macroproceso': data.get('fMacro') if data.get('fMacro') else None,
                 'tipo_ticket': data.get('fTipoTicket') if data.get('fTipoTicket') else None,
                 'limite': data.get('limite', 100),
-                'offset': data.get('offset', 0)
+                'offset': data.get('offset', 0),
+                'cursor': cursor,
+                'incluir_total': data.get('incluir_total', True)
             }
             
             # Llamar al query optimizado
@@ -228,13 +196,16 @@ class Tickets:
             
             # Contar filtros activos para mensaje
             filtros_activos = sum(1 for k, v in filtros.items() 
-                                if k not in ['vista', 'limite', 'offset'] and v is not None)
+                                if k not in ['vista', 'limite', 'offset', 'cursor', 'incluir_total'] and v is not None)
             
             mensaje = f"Tickets filtrados para vista '{filtros['vista']}'"
             if filtros_activos > 0:
                 mensaje += f" con {filtros_activos} filtro(s) aplicado(s)"
             
             return self.tools.output(200, mensaje, resultado)
+
+        except CustomException as e:
+            return self.tools.output(400, e.message, {})
                 
         except Exception as e:
             print(f"Error filtrando tickets: {e}")
@@ -323,21 +294,20 @@ class Tickets:
             if not message_id or not respuesta:
                 return self.tools.output(400, "Se requieren message_id y respuesta.", {})
 
-            # Obtener el token desde la base de datos
-            result = self.querys.get_token()
-            self.token = self.validar_existencia_token(result)
+            # Obtener el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
 
             if not self.token:
                 return self.tools.output(400, "No se pudo obtener token de acceso.", {})
 
             # Obtener información del correo original para la respuesta
-            url_correo = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages/{message_id}"
+            url_correo = f"https://graph.microsoft.com/v1.0/users/{self._buzon_correo(message_id)}/messages/{message_id}"
             headers_info = {
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json"
             }
             
-            response_info = requests.get(url_correo, headers=headers_info)
+            response_info = graph_client.get(url_correo, headers=headers_info)
 
             if response_info.status_code != 200:
                 print(f"Error obteniendo correo original: {response_info.text}")
@@ -363,13 +333,13 @@ class Tickets:
             }
 
             # Enviar respuesta usando Microsoft Graph API
-            url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages/{message_id}/reply"
+            url = f"https://graph.microsoft.com/v1.0/users/{self._buzon_correo(message_id)}/messages/{message_id}/reply"
             headers = {
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = graph_client.post(url, headers=headers, json=payload)
 
             if response.status_code in [200, 202]:
                 # Registrar la respuesta en la base de datos
@@ -403,21 +373,20 @@ class Tickets:
             if not message_id:
                 return self.tools.output(400, "Se requiere message_id.", {})
             
-            # Obtener el token desde la base de datos
-            result = self.querys.get_token()
-            self.token = self.validar_existencia_token(result)
+            # Obtener el token (caché en memoria del proceso)
+            self.token = graph_token.obtener(self.db)
 
             if not self.token:
                 return self.tools.output(400, "No se pudo obtener token de acceso.", {})
 
             # Primero obtener el mensaje original para extraer el conversation ID
-            url_original = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages/{message_id}"
+            url_original = f"https://graph.microsoft.com/v1.0/users/{self._buzon_correo(message_id)}/messages/{message_id}"
             headers = {
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json"
             }
             
-            response_original = requests.get(url_original, headers=headers)
+            response_original = graph_client.get(url_original, headers=headers)
 
             if response_original.status_code != 200:
                 print(f"Error obteniendo mensaje original: {response_original.text}")
@@ -430,14 +399,14 @@ class Tickets:
                 return self.tools.output(400, "No se pudo obtener conversation ID.", {})
 
             # Usar método robusto: obtener mensajes recientes y filtrar localmente
-            url_conversacion = f"https://graph.microsoft.com/v1.0/users/{EMAIL_USER}/messages"
+            url_conversacion = f"https://graph.microsoft.com/v1.0/users/{self._buzon_correo(message_id)}/messages"
             params = {
                 "$top": "100",  # Aumentar para asegurar que capturemos toda la conversación
                 "$orderby": "receivedDateTime desc",
                 "$select": "id,conversationId,subject,from,receivedDateTime,body,isRead"
             }
             
-            response_hilo = requests.get(url_conversacion, headers=headers, params=params)
+            response_hilo = graph_client.get(url_conversacion, headers=headers, params=params)
             
             if response_hilo.status_code == 200:
                 todos_mensajes = response_hilo.json().get('value', [])
@@ -498,9 +467,8 @@ class Tickets:
                 "data": {}
             }
         
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
@@ -513,8 +481,8 @@ class Tickets:
             }
             
             # Obtener el correo original para saber a quién responder
-            correo_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}"
-            response_correo = requests.get(correo_url, headers=headers_correo)
+            correo_url = f"{MICROSOFT_URL_GRAPH}{self._buzon_correo(message_id)}/messages/{message_id}"
+            response_correo = graph_client.get(correo_url, headers=headers_correo)
             
             if response_correo.status_code != 200:
                 print(f"Error obteniendo correo original - Status: {response_correo.status_code}")
@@ -559,7 +527,7 @@ class Tickets:
             }
             
             # URL para responder al correo
-            reply_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}/reply"
+            reply_url = f"{MICROSOFT_URL_GRAPH}{self._buzon_correo(message_id)}/messages/{message_id}/reply"
             
             # Enviar la respuesta
             headers_reply = {
@@ -567,7 +535,7 @@ class Tickets:
                 'Content-Type': 'application/json'
             }
             
-            response_reply = requests.post(reply_url, json=reply_data, headers=headers_reply)
+            response_reply = graph_client.post(reply_url, json=reply_data, headers=headers_reply)
             
             if response_reply.status_code == 202:
                 return self.tools.output(200, "Respuesta automática enviada exitosamente.", {
@@ -609,9 +577,8 @@ class Tickets:
         if not message_id_clean or len(message_id_clean) < 10:
             return self.tools.output(400, f"Message ID inválido: '{message_id_clean}'")
             
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
@@ -656,7 +623,7 @@ class Tickets:
             }
             
             # URL para responder al correo
-            reply_url = f"{MICROSOFT_URL_GRAPH}{EMAIL_USER}/messages/{message_id}/reply"
+            reply_url = f"{MICROSOFT_URL_GRAPH}{self._buzon_correo(message_id)}/messages/{message_id}/reply"
             
             # Enviar la respuesta
             headers_reply = {
@@ -664,7 +631,7 @@ class Tickets:
                 'Content-Type': 'application/json'
             }
             
-            response_reply = requests.post(reply_url, json=reply_data, headers=headers_reply)
+            response_reply = graph_client.post(reply_url, json=reply_data, headers=headers_reply)
             
             if response_reply.status_code == 202:
                 print(f"✅ Respuesta automática optimizada enviada para ticket {ticket_id} a {from_email}")
@@ -696,9 +663,8 @@ class Tickets:
         if not ticket_id or not from_email:
             return self.tools.output(400, "Se requieren ticket_id y from_email")
             
-        # Obtenemos el token desde la base de datos
-        result = self.querys.get_token()
-        self.token = self.validar_existencia_token(result)
+        # Obtenemos el token (caché en memoria del proceso)
+        self.token = graph_token.obtener(self.db)
 
         if not self.token:
             return self.tools.output(400, "No se pudo obtener token de acceso.")
@@ -769,7 +735,7 @@ class Tickets:
                 'Content-Type': 'application/json'
             }
             
-            response_send = requests.post(send_url, json=mail_data, headers=headers_send)
+            response_send = graph_client.post(send_url, json=mail_data, headers=headers_send)
             
             if response_send.status_code == 202:
                 print(f"✅ Correo nuevo automático enviado para ticket {ticket_id} a {from_email}")
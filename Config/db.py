@@ -37,6 +37,7 @@ engine = sqlalchemy.create_engine(
     max_overflow=20,
     pool_pre_ping=True,  # Verifica la conexión antes de usarla
     pool_recycle=3600,   # Recicla conexiones cada hora
+    fast_executemany=True,  # executemany en bloque (pyodbc) para inserciones/actualizaciones por lote
     connect_args={
         "timeout": 30,   # Timeout de conexión
         "autocommit": True
@@ -0,0 +1,39 @@
+from Config.db import BASE
+from sqlalchemy import Column, String, BigInteger, Integer, DateTime, Index
+from datetime import datetime
+
+class IntranetCorreosAdjuntosModel(BASE):
+
+    __tablename__= "intranet_correos_adjuntos"
+
+    id = Column(BigInteger, primary_key=True)
+    message_id = Column(String(255), nullable=False)  # Correo al que pertenece (intranet_correos_microsoft.message_id)
+    attachment_id = Column(String(255), nullable=False)  # ID del attachment en Microsoft Graph
+    nombre = Column(String(500))
+    content_type = Column(String(255))
+    size = Column(BigInteger, default=0)  # Tamaño en bytes
+    is_inline = Column(Integer, default=0)  # 0=Adjunto, 1=Imagen embebida en el cuerpo
+    created_at = Column(DateTime, default=datetime.now)
+
+    # Índices para mejorar performance
+    __table_args__ = (
+        Index('idx_adjuntos_message_id', 'message_id'),
+    )
+
+    def __init__(self, data: dict):
+        self.message_id = data['message_id']
+        self.attachment_id = data['attachment_id']
+        self.nombre = data.get('nombre', '')
+        self.content_type = data.get('content_type', '')
+        self.size = data.get('size', 0)
+        self.is_inline = data.get('is_inline', 0)
+
+    def to_dict(self):
+        """Convierte al formato de metadatos de attachment de Graph que usa el frontend"""
+        return {
+            'id': self.attachment_id,
+            'name': self.nombre,
+            'contentType': self.content_type,
+            'size': self.size,
+            'isInline': bool(self.is_inline)
+        }
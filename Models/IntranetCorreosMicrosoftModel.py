@@ -1,5 +1,5 @@
 from Config.db import BASE
-from sqlalchemy import Column, String, BigInteger, Text, Integer, DateTime, Date, Index
+from sqlalchemy import Column, String, BigInteger, Text, Integer, DateTime, Date, Index, text
 from datetime import datetime
 
 class IntranetCorreosMicrosoftModel(BASE):
@@ -8,13 +8,17 @@ class IntranetCorreosMicrosoftModel(BASE):
     
     id = Column(BigInteger, primary_key=True)
     message_id = Column(String(255), unique=True, nullable=False)  # ID único de Microsoft
+    buzon = Column(String(255))  # Buzón de origen (NULL = buzón principal EMAIL_USER)
+    carpeta = Column(String(255))  # Carpeta de origen dentro del buzón
     conversation_id = Column(String(255))  # ID de conversación de Microsoft Graph
     subject = Column(String(500))
+    subject_huella = Column(String(64))  # SHA-256 del subject normalizado (sin RE:/FW:...) para detectar hilos
     from_email = Column(String(255))
     from_name = Column(String(255))
     received_date = Column(DateTime)
     body_preview = Column(Text)
     body_content = Column(Text)
+    body_cargado = Column(Integer, default=0)  # 0=Solo metadatos, 1=Cuerpo completo en BD
     estado = Column(Integer, default=1)
     hash_contenido = Column(String(64))  # Para detectar cambios
     attachments_count = Column(Integer, default=0)
@@ -38,17 +42,41 @@ class IntranetCorreosMicrosoftModel(BASE):
         Index('idx_received_date', 'received_date'),
         Index('idx_from_email', 'from_email'),
         Index('idx_conversation_id', 'conversation_id'),
+        Index('idx_subject_huella_from_email', 'subject_huella', 'from_email'),
+        Index('idx_buzon_carpeta', 'buzon', 'carpeta'),
+
+        # Índices filtrados de los listados. Las consultas deben escribir activo/ticket como
+        # literales (Querys._filtros_base): con parámetros SQL Server no usa índices filtrados
+        # Bandeja (ticket=0): listado por received_date, con o sin estado
+        Index('idx_bandeja_recibido', 'received_date', 'id',
+              mssql_where=text('ticket = 0 AND activo = 1'), mssql_include=['estado']),
+        Index('idx_bandeja_estado_recibido', 'estado', 'received_date', 'id',
+              mssql_where=text('ticket = 0 AND activo = 1')),
+        # Cola de tickets (ticket=1): filtrar_tickets ordena por created_at, obtener_tickets_correos por received_date
+        Index('idx_tickets_creado', 'created_at', 'id',
+              mssql_where=text('ticket = 1 AND activo = 1'),
+              mssql_include=['estado', 'asignado', 'prioridad', 'tipo_soporte', 'tipo_ticket', 'macroproceso']),
+        Index('idx_tickets_estado_creado', 'estado', 'created_at', 'id',
+              mssql_where=text('ticket = 1 AND activo = 1')),
+        Index('idx_tickets_asignado_creado', 'asignado', 'created_at', 'id',
+              mssql_where=text('ticket = 1 AND activo = 1')),
+        Index('idx_tickets_recibido', 'received_date', 'id',
+              mssql_where=text('ticket = 1 AND activo = 1'), mssql_include=['estado', 'asignado']),
     )
 
     def __init__(self, data: dict):
         self.message_id = data.get('message_id')
+        self.buzon = data.get('buzon')
+        self.carpeta = data.get('carpeta')
         self.conversation_id = data.get('conversation_id')
         self.subject = data.get('subject', '')
+        self.subject_huella = data.get('subject_huella')
         self.from_email = data.get('from_email', '')
         self.from_name = data.get('from_name', '')
         self.received_date = data.get('received_date')
         self.body_preview = data.get('body_preview', '')
         self.body_content = data.get('body_content', '')
+        self.body_cargado = data.get('body_cargado', 0)
         self.estado = data.get('estado', 1)
         self.ticket = data.get('ticket', 0)
         self.asignado = data.get('asignado', None)
@@ -67,13 +95,17 @@ class IntranetCorreosMicrosoftModel(BASE):
         return {
             'id': self.id,
             'message_id': self.message_id,
+            'buzon': self.buzon,
+            'carpeta': self.carpeta,
             'conversation_id': self.conversation_id,
             'subject': self.subject,
+            'subject_huella': self.subject_huella,
             'from_email': self.from_email,
             'from_name': self.from_name,
             'received_date': self.received_date.isoformat() if self.received_date else None,
             'body_preview': self.body_preview,
             'body_content': self.body_content,
+            'body_cargado': self.body_cargado,
             'estado': self.estado,
             'hash_contenido': self.hash_contenido,
             'attachments_count': self.attachments_count,
@@ -91,9 +123,12 @@ class IntranetCorreosMicrosoftModel(BASE):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-    def to_frontend_format(self):
-        """Convierte al formato que espera el frontend actual"""
-        return {
+    def to_frontend_format(self, incluir_body=True):
+        """
+        Convierte al formato que espera el frontend actual.
+        Los listados usan incluir_body=False: no cargan body_content (se pide en el detalle)
+        """
+        formato = {
             'id': self.message_id,  # El frontend usa esto como ID
             'ticket_id': self.id,  # Número puro para uso interno
             'ticket_id_display': f"TCK-{self.id:04d}" if self.ticket == 1 else None,  # Formato display para UI
@@ -102,7 +137,6 @@ class IntranetCorreosMicrosoftModel(BASE):
             'from_email': f"{self.from_email}" if self.from_email else '',
             'receivedAt': self.received_date.date().isoformat() if self.received_date else None,
             'preview': self.body_preview,
-            'body': self.body_content,
             'estado': self.estado,
             'ticket': self.ticket,
             'asignado': self.asignado,
@@ -117,3 +151,11 @@ class IntranetCorreosMicrosoftModel(BASE):
             'created_at': self.created_at.date().isoformat() if self.created_at else None,
             'updated_at': self.updated_at.date().isoformat() if self.updated_at else None,
         }
+
+        if incluir_body:
+            formato['body'] = self.body_content
+            formato['bodyLoaded'] = bool(self.body_cargado or self.body_content)
+        else:
+            formato['bodyLoaded'] = bool(self.body_cargado)
+
+        return formato
@@ -0,0 +1,52 @@
+from Config.db import BASE
+from sqlalchemy import Column, String, BigInteger, Text, Integer, DateTime, Index
+from datetime import datetime
+
+class IntranetSyncEstadoModel(BASE):
+
+    __tablename__= "intranet_sync_estado"
+
+    id = Column(BigInteger, primary_key=True)
+    buzon = Column(String(255), nullable=False)  # Correo del buzón sincronizado
+    carpeta = Column(String(255), nullable=False)  # Carpeta sincronizada dentro del buzón
+    folder_id = Column(String(255))  # Id de Graph de la carpeta (se resuelve una vez y se cachea)
+    delta_link = Column(Text)  # @odata.deltaLink de la última ronda delta completada
+    fecha_delta = Column(DateTime)  # Fecha en que se guardó el deltaLink
+    checkpoint_link = Column(Text)  # @odata.nextLink de la siguiente página de una ronda en curso (NULL = sin ronda pendiente)
+    fecha_checkpoint = Column(DateTime)  # Fecha del último checkpoint guardado
+    lease_owner = Column(String(150))  # Proceso que tiene la sincronización en curso
+    lease_expira = Column(DateTime)  # Vencimiento del lease (NULL = libre)
+    suscripcion_id = Column(String(100))  # Suscripción de notificaciones de cambio de Graph
+    suscripcion_expira = Column(DateTime)  # Vencimiento de la suscripción (se renueva antes)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # Un único estado por buzón/carpeta
+    __table_args__ = (
+        Index('idx_buzon_carpeta', 'buzon', 'carpeta', unique=True),
+    )
+
+    def __init__(self, data: dict):
+        self.buzon = data['buzon']
+        self.carpeta = data['carpeta']
+        self.delta_link = data.get('delta_link')
+        self.fecha_delta = data.get('fecha_delta')
+
+    def to_dict(self):
+        """Convierte el modelo a diccionario para serialización JSON"""
+        return {
+            'id': self.id,
+            'buzon': self.buzon,
+            'carpeta': self.carpeta,
+            'folder_id': self.folder_id,
+            'delta_link': self.delta_link,
+            'fecha_delta': self.fecha_delta.isoformat() if self.fecha_delta else None,
+            'checkpoint_link': self.checkpoint_link,
+            'fecha_checkpoint': self.fecha_checkpoint.isoformat() if self.fecha_checkpoint else None,
+            'lease_owner': self.lease_owner,
+            'lease_expira': self.lease_expira.isoformat() if self.lease_expira else None,
+            'suscripcion_id': self.suscripcion_id,
+            'suscripcion_expira': self.suscripcion_expira.isoformat() if self.suscripcion_expira else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
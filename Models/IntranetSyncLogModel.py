@@ -8,6 +8,8 @@ class IntranetSyncLogModel(BASE):
     
     id = Column(BigInteger, primary_key=True)
     tipo_sync = Column(String(50))  # 'incremental', 'completo'
+    buzon = Column(String(255))
+    carpeta = Column(String(255))
     fecha_inicio = Column(DateTime)
     fecha_fin = Column(DateTime)
     correos_nuevos = Column(Integer, default=0)
@@ -26,6 +28,8 @@ class IntranetSyncLogModel(BASE):
 
     def __init__(self, data: dict):
         self.tipo_sync = data.get('tipo_sync', 'incremental')
+        self.buzon = data.get('buzon')
+        self.carpeta = data.get('carpeta')
         self.fecha_inicio = data.get('fecha_inicio', datetime.now())
         self.fecha_fin = data.get('fecha_fin')
         self.correos_nuevos = data.get('correos_nuevos', 0)
@@ -39,6 +43,8 @@ class IntranetSyncLogModel(BASE):
         return {
             'id': self.id,
             'tipo_sync': self.tipo_sync,
+            'buzon': self.buzon,
+            'carpeta': self.carpeta,
             'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
             'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None,
             'correos_nuevos': self.correos_nuevos,
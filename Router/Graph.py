@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Request, Depends, Query
+from fastapi.responses import PlainTextResponse, Response
 from sqlalchemy.orm import Session
 from Class.Graph import Graph
 from Utils.decorator import http_decorator
@@ -10,27 +11,47 @@ graph_router = APIRouter()
 @http_decorator
 def obtener_correos(request: Request, db: Session = Depends(get_db)):
     """
-    Sincroniza correos de Microsoft Graph y los retorna desde BD
-    Implementa sincronización inteligente (solo nuevos correos)
+    Retorna de inmediato los correos desde BD con el estado del último sync
+    La sincronización con Microsoft Graph se ejecuta en segundo plano
     """
     data = getattr(request.state, "json_data", {})
     forzar_sync = data.get('forzar_sync', False)
     response = Graph(db).obtener_correos(forzar_sync)
     return response
 
+@graph_router.post('/notificaciones_graph', tags=["TIC"])
+def notificaciones_graph(
+    request: Request,
+    db: Session = Depends(get_db),
+    validationToken: str = Query(None, description="Token de validación al crear la suscripción")
+):
+    """
+    Receptor de notificaciones de cambio de Microsoft Graph (sin http_decorator:
+    Graph no envía Accept: application/json y espera respuestas específicas).
+    - Validación de la suscripción: devuelve validationToken en texto plano
+    - Notificación: encola los correos para su ingesta y responde 202 de inmediato
+    """
+    if validationToken:
+        return PlainTextResponse(content=validationToken, status_code=200)
+
+    data = getattr(request.state, "json_data", {})
+    Graph(db).procesar_notificaciones(data)
+    return Response(status_code=202)
+
 @graph_router.get('/obtener_correos_bd', tags=["TIC"], response_model=dict)
 def obtener_correos_bd(
     request: Request, 
     db: Session = Depends(get_db),
     limite: int = Query(100, description="Número máximo de correos a obtener"),
     offset: int = Query(0, description="Número de correos a saltar"),
-    estado: str = Query(None, description="Filtrar por estado (nuevo, procesado, convertido_ticket)")
+    estado: str = Query(None, description="Filtrar por estado (nuevo, procesado, convertido_ticket)"),
+    cursor: str = Query(None, description="siguiente_cursor de la página anterior (reemplaza offset)")
 ):
     """
     Obtiene correos únicamente desde la base de datos (sin sincronizar)
     Útil para cargas rápidas y paginación
     """
-    response = Graph(db).obtener_correos_bd_solo(limite, offset, estado)
+    response = Graph(db).obtener_correos_bd_solo(limite, offset, estado, cursor)
     return response
 
 @graph_router.post('/sincronizar_correos', tags=["TIC"], response_model=dict)
@@ -39,7 +60,7 @@ def sincronizar_correos(request: Request, db: Session = Depends(get_db)):
     """
     Fuerza una sincronización completa de correos desde Microsoft Graph
     """
-    response = Graph(db).obtener_correos(forzar_sync=True)
+    response = Graph(db).sincronizar_correos()
     return response
 
 @graph_router.post('/marcar_correo_procesado', tags=["TIC"], response_model=dict)
@@ -83,6 +104,16 @@ def obtener_tickets_correos(request: Request, db: Session = Depends(get_db)):
     response = Graph(db).obtener_tickets_correos(data)
     return response
 
+@graph_router.post('/obtener_detalle_ticket', tags=["TIC"], response_model=dict)
+@http_decorator
+def obtener_detalle_ticket(request: Request, db: Session = Depends(get_db)):
+    """
+    Obtiene el detalle completo de un ticket o correo, con el cuerpo (los listados no lo incluyen)
+    """
+    data = getattr(request.state, "json_data", {})
+    response = Graph(db).obtener_detalle_ticket(data)
+    return response
+
 @graph_router.get('/obtener_estados_tickets', tags=["TIC"], response_model=dict)
 def obtener_estados_tickets(db: Session = Depends(get_db)):
     """
@@ -109,6 +140,36 @@ def obtener_attachments(request: Request, db: Session = Depends(get_db)):
     response = Graph(db).obtener_attachments(data)
     return response
 
+@graph_router.post('/obtener_attachments_lote', tags=["TIC"], response_model=dict)
+@http_decorator
+def obtener_attachments_lote(request: Request, db: Session = Depends(get_db)):
+    """
+    Obtiene los metadatos de attachments de varios correos (desde BD; los faltantes con $batch de Graph)
+    """
+    data = getattr(request.state, "json_data", {})
+    response = Graph(db).obtener_attachments_lote(data)
+    return response
+
+@graph_router.post('/obtener_cuerpo_correo', tags=["TIC"], response_model=dict)
+@http_decorator
+def obtener_cuerpo_correo(request: Request, db: Session = Depends(get_db)):
+    """
+    Obtiene el cuerpo completo de un correo (se trae de Graph la primera vez y queda en BD)
+    """
+    data = getattr(request.state, "json_data", {})
+    response = Graph(db).obtener_cuerpo_correo(data)
+    return response
+
+@graph_router.post('/completar_conversation_ids', tags=["TIC"], response_model=dict)
+@http_decorator
+def completar_conversation_ids(request: Request, db: Session = Depends(get_db)):
+    """
+    Completa desde Graph el conversation_id de correos antiguos (mantenimiento, por lotes)
+    """
+    data = getattr(request.state, "json_data", {})
+    response = Graph(db).completar_conversation_ids(data)
+    return response
+
 @graph_router.post('/obtener_prioridades', tags=["TIC"], response_model=dict)
 def obtener_prioridades(db: Session = Depends(get_db)):
     """
@@ -214,6 +275,16 @@ def enviar_respuesta_automatica_optimizada(request: Request, db: Session = Depen
     response = Graph(db).enviar_respuesta_automatica_optimizada(data)
     return response
 
+@graph_router.post('/enviar_respuestas_automaticas_lote', tags=["TIC"], response_model=dict)
+@http_decorator
+def enviar_respuestas_automaticas_lote(request: Request, db: Session = Depends(get_db)):
+    """
+    Envía las respuestas automáticas de varios tickets en lote ($batch de Graph).
+    """
+    data = getattr(request.state, "json_data", {})
+    response = Graph(db).enviar_respuestas_automaticas_lote(data)
+    return response
+
 @graph_router.post('/enviar_correo_nuevo_automatico', tags=["TIC"], response_model=dict)
 @http_decorator
 def enviar_correo_nuevo_automatico(request: Request, db: Session = Depends(get_db)):
@@ -22,6 +22,14 @@ def obtener_tickets_correos(request: Request, db: Session = Depends(get_db)):
     response = Tickets(db).obtener_tickets_correos(data)
     return response
 
+@tickets_router.post('/obtener_detalle_ticket', tags=["TICKETS"], response_model=dict)
+@http_decorator
+def obtener_detalle_ticket(request: Request, db: Session = Depends(get_db)):
+    """Obtiene el detalle completo de un ticket, con el cuerpo del correo"""
+    data = getattr(request.state, "json_data", {})
+    response = Tickets(db).obtener_detalle_ticket(data)
+    return response
+
 @tickets_router.get('/obtener_estados_tickets', tags=["TICKETS"], response_model=dict)
 def obtener_estados_tickets(db: Session = Depends(get_db)):
     """Obtiene todos los estados de tickets disponibles"""
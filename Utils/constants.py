@@ -21,4 +21,34 @@ EMAIL_USER=os.getenv("EMAIL_USER")
 
 # Horario laboral
 START_WORK_HOUR = time(7, 30)
-END_WORK_HOUR = time(17, 30)
\ No newline at end of file
+END_WORK_HOUR = time(17, 30)
+
+# Sincronización de correos en segundo plano
+SYNC_INTERVALO_SEGUNDOS = int(os.getenv("SYNC_INTERVALO_SEGUNDOS", 300))
+SYNC_AUTOMATICO = os.getenv("SYNC_AUTOMATICO", "1") == "1"
+SYNC_LEASE_SEGUNDOS = int(os.getenv("SYNC_LEASE_SEGUNDOS", 600))
+# Sync opcional solo de metadatos (bodyPreview); el cuerpo completo se trae al abrir el correo
+SYNC_SOLO_METADATOS = os.getenv("SYNC_SOLO_METADATOS", "0") == "1"
+# Buzones/carpetas a sincronizar ("buzon:carpeta,buzon:carpeta"); por defecto EMAIL_USER:TARGET_FOLDER
+SYNC_FUENTES = [
+    tuple(parte.strip() for parte in fuente.split(":", 1)) for fuente in os.getenv("SYNC_FUENTES", "").split(",")
+    if ":" in fuente
+] or [(EMAIL_USER, TARGET_FOLDER)]
+# Máximo de buzones/carpetas sincronizados en paralelo
+SYNC_MAX_CONCURRENCIA = int(os.getenv("SYNC_MAX_CONCURRENCIA", 4))
+
+# Cliente HTTP de Microsoft Graph
+GRAPH_TIMEOUT_CONEXION = float(os.getenv("GRAPH_TIMEOUT_CONEXION", 10))
+GRAPH_TIMEOUT_LECTURA = float(os.getenv("GRAPH_TIMEOUT_LECTURA", 60))
+GRAPH_MAX_REINTENTOS = int(os.getenv("GRAPH_MAX_REINTENTOS", 4))
+GRAPH_POOL_MAX = int(os.getenv("GRAPH_POOL_MAX", 10))
+# Renovación anticipada del token de Graph (segundos antes de su vencimiento)
+GRAPH_TOKEN_MARGEN_SEGUNDOS = int(os.getenv("GRAPH_TOKEN_MARGEN_SEGUNDOS", 300))
+# Reglas de exclusión de correos (prefijos separados por coma)
+SYNC_EXCLUIR_REMITENTES = [r.strip() for r in os.getenv("SYNC_EXCLUIR_REMITENTES", "postmaster,noreply").split(",") if r.strip()]
+SYNC_EXCLUIR_ASUNTOS = [a.strip() for a in os.getenv("SYNC_EXCLUIR_ASUNTOS", "[!!Spam],[!!Massmail]").split(",") if a.strip()]
+
+# Notificaciones de cambio de Microsoft Graph (vacío = sin suscripción, solo sincronización periódica)
+GRAPH_NOTIFICACIONES_URL = os.getenv("GRAPH_NOTIFICACIONES_URL", "")
+GRAPH_NOTIFICACIONES_CLIENT_STATE = os.getenv("GRAPH_NOTIFICACIONES_CLIENT_STATE", "")
+GRAPH_SUSCRIPCION_MINUTOS = int(os.getenv("GRAPH_SUSCRIPCION_MINUTOS", 4200))
@@ -0,0 +1,181 @@
+import time
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+from Utils.constants import (
+    MICROSOFT_URL_GRAPH, GRAPH_TIMEOUT_CONEXION, GRAPH_TIMEOUT_LECTURA,
+    GRAPH_MAX_REINTENTOS, GRAPH_POOL_MAX
+)
+
+# Estados transitorios de Graph que se reintentan
+ESTADOS_REINTENTABLES = (429, 502, 503, 504)
+# En POST (envío de correos, respuestas) solo se reintenta cuando Graph garantiza que no procesó la petición
+ESTADOS_REINTENTABLES_POST = (429, 503)
+# Tope de espera entre reintentos (segundos)
+ESPERA_MAXIMA = 60
+# Máximo de operaciones por petición JSON $batch (límite de Graph)
+BATCH_MAXIMO = 20
+
+class GraphClient:
+    """
+    Cliente HTTP compartido para Microsoft Graph.
+    - Una sola requests.Session con pool de conexiones (keep-alive) para todo el proceso
+    - Timeouts de conexión y lectura en todas las llamadas
+    - Reintentos con backoff exponencial que respeta Retry-After en 429/503
+    - Registro del tiempo de cada llamada
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL_MAX, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (GRAPH_TIMEOUT_CONEXION, GRAPH_TIMEOUT_LECTURA)
+        self.max_reintentos = GRAPH_MAX_REINTENTOS
+
+        # Raíz de la versión de Graph (p. ej. https://graph.microsoft.com/v1.0) para $batch
+        partes = urlsplit(MICROSOFT_URL_GRAPH or '')
+        version = partes.path.strip('/').split('/')[0] if partes.path.strip('/') else ''
+        self.url_raiz = f"{partes.scheme}://{partes.netloc}/{version}".rstrip('/')
+
+    # Función para realizar una petición GET
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    # Función para realizar una petición POST
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    # Función para realizar una petición PATCH
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    # Función para realizar una petición con reintentos y medición de tiempo
+    def request(self, method, url, **kwargs):
+        """
+        Realiza la petición y retorna el requests.Response final.
+        Si se agotan los reintentos retorna la última respuesta recibida o relanza
+        la última excepción de red.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        reintentables = ESTADOS_REINTENTABLES if method == 'GET' else ESTADOS_REINTENTABLES_POST
+        ruta = urlsplit(url).path
+
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                duracion = (time.perf_counter() - inicio) * 1000
+                print(f"Graph {method} {ruta} falló tras {duracion:.0f} ms: {e}")
+
+                # Un POST que alcanzó a enviarse pudo haberse procesado; solo se reintenta si no conectó
+                puede_reintentar = method == 'GET' or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not puede_reintentar or intento >= self.max_reintentos:
+                    raise
+                self._esperar(intento)
+                intento += 1
+                continue
+
+            duracion = (time.perf_counter() - inicio) * 1000
+            print(f"Graph {method} {ruta} -> {response.status_code} ({duracion:.0f} ms)")
+
+            if response.status_code not in reintentables or intento >= self.max_reintentos:
+                return response
+
+            self._esperar(intento, response.headers.get('Retry-After'))
+            intento += 1
+
+    # Función para convertir una URL absoluta de Graph en relativa a la versión (formato $batch)
+    def ruta_batch(self, url):
+        if url.startswith(self.url_raiz):
+            url = url[len(self.url_raiz):]
+        return url if url.startswith('/') else f"/{url}"
+
+    # Función para ejecutar varias operaciones de Graph con JSON $batch
+    def batch(self, token, operaciones):
+        """
+        Agrupa operaciones independientes en peticiones /$batch de hasta 20 y
+        retorna las respuestas indexadas por id: {id: {'status', 'headers', 'body'}}.
+
+        Cada operación es un dict con 'id', 'method', 'url' (absoluta o relativa a la
+        versión) y opcionalmente 'body' y 'headers'. Las sub-respuestas 429 se reintentan
+        respetando Retry-After; si la petición $batch completa falla, las operaciones de
+        ese bloque quedan con status 0.
+        """
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+        respuestas = dict()
+
+        for i in range(0, len(operaciones), BATCH_MAXIMO):
+            pendientes = list()
+            for operacion in operaciones[i:i + BATCH_MAXIMO]:
+                peticion = {
+                    'id': str(operacion['id']),
+                    'method': operacion.get('method', 'GET'),
+                    'url': self.ruta_batch(operacion['url'])
+                }
+                if operacion.get('body') is not None:
+                    peticion['body'] = operacion['body']
+                    peticion['headers'] = {'Content-Type': 'application/json'}
+                if operacion.get('headers'):
+                    peticion.setdefault('headers', {}).update(operacion['headers'])
+                pendientes.append(peticion)
+
+            intento = 0
+            while pendientes:
+                response = self.post(f"{self.url_raiz}/$batch", headers=headers, json={'requests': pendientes})
+
+                if response.status_code != 200:
+                    print(f"Error en petición $batch: {response.status_code} - {response.text}")
+                    for peticion in pendientes:
+                        respuestas[peticion['id']] = {'status': 0, 'headers': {}, 'body': None}
+                    break
+
+                por_id = {peticion['id']: peticion for peticion in pendientes}
+                reintentar = list()
+                retry_after = None
+
+                for sub in response.json().get('responses', []):
+                    sub_headers = sub.get('headers') or {}
+                    if sub.get('status') == 429 and intento < self.max_reintentos and sub.get('id') in por_id:
+                        reintentar.append(por_id[sub['id']])
+                        retry_after = sub_headers.get('Retry-After') or retry_after
+                        continue
+
+                    respuestas[sub.get('id')] = {
+                        'status': sub.get('status'),
+                        'headers': sub_headers,
+                        'body': sub.get('body')
+                    }
+
+                pendientes = reintentar
+                if pendientes:
+                    self._esperar(intento, retry_after)
+                    intento += 1
+
+        return respuestas
+
+    # Función para esperar antes de reintentar
+    def _esperar(self, intento, retry_after=None):
+        """Espera lo indicado por Retry-After o, si no viene, un backoff exponencial"""
+        espera = None
+        if retry_after:
+            try:
+                espera = float(retry_after)
+            except ValueError:
+                espera = None
+
+        if espera is None:
+            espera = 2 ** intento
+
+        espera = min(espera, ESPERA_MAXIMA)
+        print(f"Reintentando petición a Graph en {espera:.1f} s (intento {intento + 1}/{self.max_reintentos})")
+        time.sleep(espera)
+
+
+graph_client = GraphClient()
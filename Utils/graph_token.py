@@ -0,0 +1,155 @@
+import threading
+from datetime import datetime, timedelta
+
+from Config.db import session_maker
+from Utils.querys import Querys
+from Utils.graph_client import graph_client
+from Models.IntranetGraphTokenModel import IntranetGraphTokenModel as TokenModel
+from Utils.constants import (
+    MICROSOFT_CLIENT_ID, MICROSOFT_CLIENT_SECRET, MICROSOFT_TENANT_ID,
+    MICROSOFT_API_SCOPE, MICROSOFT_URL, GRAPH_TOKEN_MARGEN_SEGUNDOS
+)
+
+class GraphTokenCache:
+    """
+    Caché en memoria del token de acceso a Microsoft Graph (compartida por todo el proceso).
+    - Mientras el token está vigente se entrega sin consultar BD ni Microsoft
+    - Dentro del margen previo al vencimiento se renueva en segundo plano (refresh-ahead)
+    - La renovación es única por proceso (lock); la tabla intranet_graph_token solo se
+      usa para compartir el token entre workers
+    """
+
+    def __init__(self, margen=GRAPH_TOKEN_MARGEN_SEGUNDOS):
+        self.margen = timedelta(seconds=margen)
+        self._actual = (None, None)  # (token, fecha_vencimiento), se reemplaza en bloque
+        self._lock = threading.Lock()
+        self._renovando = False
+
+    # Función para obtener un token vigente
+    def obtener(self, db=None):
+        """
+        Retorna un token vigente. Solo bloquea al llamador cuando no hay token en memoria
+        o ya venció; dentro del margen entrega el actual y renueva en segundo plano.
+        """
+        token, vence = self._actual
+        ahora = datetime.now()
+
+        if token and ahora < vence - self.margen:
+            return token
+
+        if token and ahora < vence:
+            self._renovar_en_segundo_plano()
+            return token
+
+        with self._lock:
+            # Otro hilo pudo haberlo renovado mientras se esperaba el lock
+            token, vence = self._actual
+            if token and datetime.now() < vence:
+                return token
+
+            if db is not None:
+                return self._renovar(db)
+
+            db = session_maker()
+            try:
+                return self._renovar(db)
+            finally:
+                db.close()
+
+    # Función para invalidar el token en memoria (p. ej. tras un 401 de Graph)
+    def invalidar(self):
+        with self._lock:
+            self._actual = (None, None)
+
+    # Función para disparar una renovación anticipada sin bloquear al llamador
+    def _renovar_en_segundo_plano(self):
+        with self._lock:
+            if self._renovando:
+                return
+            self._renovando = True
+
+        threading.Thread(target=self._renovar_anticipado, name="graph-token", daemon=True).start()
+
+    # Renovación anticipada con su propia sesión de BD
+    def _renovar_anticipado(self):
+        db = session_maker()
+        try:
+            with self._lock:
+                token, vence = self._actual
+                if token and datetime.now() < vence - self.margen:
+                    return
+                self._renovar(db)
+        except Exception as e:
+            print(f"Error renovando token de Graph en segundo plano: {e}")
+        finally:
+            db.close()
+            self._renovando = False
+
+    # Función para renovar el token (se llama con el lock tomado)
+    def _renovar(self, db):
+        """Toma el token de BD si otro worker ya lo renovó; si no, pide uno nuevo a Microsoft"""
+        querys = Querys(db)
+        result = querys.get_token()
+
+        if result and result.get('fecha_vencimiento'):
+            fecha_vencimiento = result['fecha_vencimiento']
+            if isinstance(fecha_vencimiento, str):
+                fecha_vencimiento = datetime.fromisoformat(fecha_vencimiento.replace('Z', '+00:00')).replace(tzinfo=None)
+
+            ahora = datetime.now()
+            if ahora < fecha_vencimiento - self.margen:
+                print("Token de Graph tomado desde BD")
+                self._guardar(result['token'], fecha_vencimiento)
+                return result['token']
+
+            if ahora >= fecha_vencimiento and result.get('id'):
+                querys.desactivar_token(result['id'])
+
+        token, fecha_vencimiento = self._crear_nuevo_token()
+        if token:
+            querys.insertar_datos(TokenModel, {
+                "token": token,
+                "fecha_vencimiento": fecha_vencimiento
+            })
+            self._guardar(token, fecha_vencimiento)
+            return token
+
+        # Si Microsoft no respondió, se sigue usando el token actual mientras no venza
+        token, vence = self._actual
+        if token and datetime.now() < vence:
+            return token
+        return None
+
+    # Función para guardar el token en memoria
+    def _guardar(self, token, fecha_vencimiento):
+        self._actual = (token, fecha_vencimiento)
+
+    # Función para crear un nuevo token desde Microsoft Graph API
+    def _crear_nuevo_token(self):
+        """Pide un token nuevo (client_credentials) y retorna (token, fecha_vencimiento)"""
+        print("Obteniendo nuevo token desde Microsoft Graph API...")
+        url = f"{MICROSOFT_URL}{MICROSOFT_TENANT_ID}/oauth2/v2.0/token"
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        data = {
+            'client_id': MICROSOFT_CLIENT_ID,
+            'scope': ' '.join(MICROSOFT_API_SCOPE),
+            'client_secret': MICROSOFT_CLIENT_SECRET,
+            'grant_type': 'client_credentials'
+        }
+
+        try:
+            response = graph_client.post(url, headers=headers, data=data)
+        except Exception as e:
+            print(f"Error obteniendo el token: {e}")
+            return None, None
+
+        if response.status_code == 200:
+            token = response.json().get('access_token')
+            expires_in = response.json().get('expires_in')
+            return token, datetime.now() + timedelta(seconds=expires_in)
+
+        print(f"Error obteniendo el token: {response.status_code} - {response.text}")
+        return None, None
+
+
+graph_token = GraphTokenCache()
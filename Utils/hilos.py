@@ -0,0 +1,159 @@
+import re
+import hashlib
+from datetime import datetime
+
+# Prefijos de respuesta/reenvío en diferentes idiomas (RE:, RES:, FW:, RV:, FWD:, AW:, SV:)
+# y marcas de spam, repetidos al inicio del subject ("RE: RV: FW: ..."). Compilado una sola vez.
+PATRON_PREFIJOS_RESPUESTA = re.compile(
+    r'^(?:\s*(?:(?:RE|RES|FW|RV|FWD|AW|SV)\s*:|\[SPAM\]))+\s*',
+    flags=re.IGNORECASE
+)
+PATRON_ESPACIOS = re.compile(r'\s+')
+# Hasta esta cantidad de correos nuevos por página los hilos se resuelven con consultas
+# indexadas por correo; con más se construye el IndiceHilos (una carga por sincronización)
+HILOS_MAX_CONSULTAS = 5
+
+# Función para limpiar el subject de un correo
+def limpiar_subject_respuesta(subject):
+    """
+    Limpia prefijos de respuesta del subject (RE:, FW:, etc.)
+    Returns: subject limpio sin prefijos
+    """
+    return PATRON_PREFIJOS_RESPUESTA.sub('', subject or '').strip()
+
+# Función para normalizar un subject (sin prefijos, minúsculas y espacios simples)
+def normalizar_subject(subject):
+    return PATRON_ESPACIOS.sub(' ', limpiar_subject_respuesta(subject)).lower()
+
+# Función para calcular la huella del subject normalizado (columna subject_huella)
+def huella_subject(subject):
+    """
+    Huella SHA-256 del subject normalizado. Un correo y sus respuestas/reenvíos
+    ("RE: RV: Asunto") comparten huella, por lo que el emparejamiento de hilos es
+    una búsqueda por igualdad sobre el índice (subject_huella, from_email).
+    Retorna None si el subject queda vacío.
+    """
+    normalizado = normalizar_subject(subject)
+    if not normalizado:
+        return None
+    return hashlib.sha256(normalizado.encode('utf-8')).hexdigest()
+
+# Función para verificar si dos subjects están relacionados
+def subjects_relacionados(subject1, subject2):
+    """
+    Verifica si dos subjects están relacionados (mismo hilo)
+    """
+    if not subject1 or not subject2:
+        return False
+
+    # Limpiar ambos subjects
+    s1_limpio = normalizar_subject(subject1)
+    s2_limpio = normalizar_subject(subject2)
+
+    # Verificar similitud (al menos 70% de coincidencia)
+    if len(s1_limpio) == 0 or len(s2_limpio) == 0:
+        return False
+
+    # Algoritmo simple de similitud por palabras
+    palabras1 = set(s1_limpio.split())
+    palabras2 = set(s2_limpio.split())
+
+    if len(palabras1.union(palabras2)) == 0:
+        return False
+
+    similitud = len(palabras1.intersection(palabras2)) / len(palabras1.union(palabras2))
+    return similitud >= 0.7
+
+
+class IndiceHilos:
+    """
+    Índice en memoria de los correos recientes (estado 1) para detectar respuestas
+    a hilos existentes sin consultar la BD por cada correo nuevo.
+    Se construye una vez por sincronización y se amplía con los correos que se
+    insertan en cada página.
+
+    Claves:
+    - conversation_id -> correo más reciente de la conversación
+    - (huella del subject normalizado, from_email) -> correo más reciente
+    - from_email -> correos del remitente, del más reciente al más antiguo
+    """
+
+    def __init__(self, filas=None):
+        self.por_conversacion = dict()
+        self.por_subject = dict()
+        self.por_email = dict()
+        self.conversaciones_consultadas = set()  # conversation_ids ya buscados en BD
+
+        # Se agregan del más antiguo al más reciente para que el último gane
+        for fila in sorted(filas or [], key=lambda f: f.get('created_at') or datetime.min):
+            self.agregar(fila)
+
+    # Función para agregar un correo al índice
+    def agregar(self, fila):
+        """Agrega un correo (dict con id, subject, from_email, conversation_id, created_at)"""
+        from_email = (fila.get('from_email') or '').lower()
+        huella = fila.get('subject_huella') or huella_subject(fila.get('subject'))
+
+        if fila.get('conversation_id'):
+            self.por_conversacion[fila['conversation_id']] = fila
+        if from_email:
+            self.por_email.setdefault(from_email, []).insert(0, fila)
+            if huella:
+                self.por_subject[(huella, from_email)] = fila
+
+    # Función para listar las conversaciones que aún no están en el índice
+    def conversaciones_pendientes(self, correos_data):
+        """conversation_ids de los correos que no están en el índice ni se han buscado en BD"""
+        return {
+            correo['conversation_id'] for correo in correos_data
+            if correo.get('conversation_id')
+            and correo['conversation_id'] not in self.por_conversacion
+            and correo['conversation_id'] not in self.conversaciones_consultadas
+        }
+
+    # Función para agregar conversaciones anteriores a la ventana del índice
+    def agregar_conversaciones(self, conversation_ids, tickets):
+        """
+        Registra el resultado de buscar conversation_ids en BD ({conversation_id: correo}).
+        Solo alimenta la clave por conversación: los correos antiguos no deben pasar
+        por delante de los recientes en los criterios por remitente.
+        """
+        self.conversaciones_consultadas.update(conversation_ids)
+        for conversation_id, fila in tickets.items():
+            self.por_conversacion.setdefault(conversation_id, fila)
+
+    # Función para resolver si un correo nuevo es respuesta a un hilo existente
+    def buscar_hilo(self, correo_data):
+        """
+        Aplica en memoria los mismos criterios que la detección por BD:
+        1. conversation_id (principal)
+        2. Subject con prefijos RE:/FW:/... con la misma huella que un correo del remitente
+        3. Correo más reciente del remitente con subject relacionado
+
+        Returns: dict con info del correo existente o None si es correo nuevo
+        """
+        # Criterio 1: Buscar por conversation_id (más confiable)
+        conversation_id = correo_data.get('conversation_id')
+        if conversation_id and conversation_id in self.por_conversacion:
+            return self.por_conversacion[conversation_id]
+
+        subject = (correo_data.get('subject') or '').strip()
+        from_email = (correo_data.get('from_email') or '').lower()
+        correos_remitente = self.por_email.get(from_email, [])
+
+        # Criterio 2: Analizar subject para patrones de respuesta
+        if subject:
+            subject_limpio = limpiar_subject_respuesta(subject)
+
+            if subject_limpio != subject:  # Tenía prefijos de respuesta
+                clave = (correo_data.get('subject_huella') or huella_subject(subject), from_email)
+                if clave in self.por_subject:
+                    return self.por_subject[clave]
+
+        # Criterio 3: Correo más reciente del remitente con subject relacionado
+        if correos_remitente and subject:
+            ticket_reciente = correos_remitente[0]
+            if subjects_relacionados(subject, ticket_reciente.get('subject', '')):
+                return ticket_reciente
+
+        return None
@@ -1,17 +1,33 @@
 from Utils.tools import Tools, CustomException
-from sqlalchemy import text, func, case
-from datetime import datetime, date
+from sqlalchemy.orm import load_only
+from sqlalchemy import text, func, case, insert, update, bindparam, and_, or_, literal_column
+from datetime import datetime, date, timedelta
 from Models.IntranetGraphTokenModel import IntranetGraphTokenModel as TokenModel
 from Models.IntranetCorreosMicrosoftModel import IntranetCorreosMicrosoftModel as CorreosMicrosoftModel
 from Models.IntranetSyncLogModel import IntranetSyncLogModel as SyncLogModel
+from Models.IntranetSyncEstadoModel import IntranetSyncEstadoModel as SyncEstadoModel
+from Models.IntranetCorreosAdjuntosModel import IntranetCorreosAdjuntosModel as AdjuntosModel
 from Models.IntranetEstadosTickets import IntranetEstadosTickets
 from Models.IntranetUsuariosGestionTicModel import IntranetUsuariosGestionTicModel
 from Models.IntranetTipoPrioridadModel import IntranetTipoPrioridadModel
 from Models.IntranetTipoSoporteModel import IntranetTipoSoporteModel
 from Models.IntranetTipoTicketModel import IntranetTipoTicketModel
 from Models.IntranetPerfilesMacroprocesoModel import IntranetPerfilesMacroprocesoModel
+from Utils.hilos import huella_subject
 
+import re
 import hashlib
+from contextlib import contextmanager
+
+# Búsqueda de tickets: número de ticket explícito (TCK-0123 o #123), número suelto y palabras para CONTAINSTABLE
+PATRON_TICKET_ID = re.compile(r'^\s*(?:TCK-?|#)(\d+)\s*$', flags=re.IGNORECASE)
+PATRON_NUMERO = re.compile(r'^\s*(\d+)\s*$')
+PATRON_PALABRAS = re.compile(r'\w+', flags=re.UNICODE)
+# Columnas del índice de texto completo (migration_correos.crear_indice_texto_completo)
+COLUMNAS_TEXTO_COMPLETO = "subject, from_name, from_email, body_preview"
+
+# Disponibilidad del índice de texto completo (se consulta una vez por proceso)
+_texto_completo_disponible = None
 
 class Querys:
 
@@ -175,30 +191,77 @@ class Querys:
     # Query para obtener correos desde la base de datos con filtros y paginación
     def obtener_correos_bd(self, limite=100, offset=0, estado=None):
         """Obtiene correos desde la base de datos con filtros y paginación"""
+        return self.obtener_pagina_correos_bd(limite, offset, estado)['emails']
+
+    # Query para obtener una página de la bandeja por offset o por cursor (keyset)
+    def obtener_pagina_correos_bd(self, limite=100, offset=0, estado=None, cursor=None):
+        """
+        Obtiene una página de la bandeja ordenada por (received_date, id) descendente.
+        Con cursor ((received_date, id) de la última fila de la página anterior) se busca
+        desde esa fila en lugar de usar OFFSET: cualquier página cuesta lo mismo que la
+        primera y no se desplaza cuando llegan correos nuevos.
+        Returns: dict con emails y siguiente_cursor (None en la última página)
+        """
         try:
-            # Filtrar correos activos y no descartados (estado != 0)
-            query = self.db.query(CorreosMicrosoftModel).filter(
-                CorreosMicrosoftModel.ticket == 0,
-                CorreosMicrosoftModel.activo == 1,
+            # Filtrar correos activos y no descartados (estado != 0); solo columnas del listado
+            query = self.db.query(CorreosMicrosoftModel).options(
+                self._columnas_listado()
+            ).filter(
+                *self._filtros_base(ticket=0),
                 CorreosMicrosoftModel.estado != 0  # Excluir correos descartados
             )
             
             # Filtro por estado específico si se especifica
             if estado:
                 query = query.filter(CorreosMicrosoftModel.estado == estado)
+
+            if cursor:
+                query = query.filter(self._condicion_cursor(
+                    CorreosMicrosoftModel.received_date, CorreosMicrosoftModel.id, cursor
+                ))
+                offset = 0
             
-            # Ordenar por fecha recibida (más recientes primero)
-            query = query.order_by(CorreosMicrosoftModel.received_date.desc())
+            # Ordenar por fecha recibida (más recientes primero); id desempata para un orden estable
+            query = query.order_by(CorreosMicrosoftModel.received_date.desc(), CorreosMicrosoftModel.id.desc())
             
-            # Paginación
-            correos = query.offset(offset).limit(limite).all()
+            # Paginación (una fila extra indica si hay página siguiente)
+            correos = query.offset(offset).limit(limite + 1).all()
+            hay_mas = len(correos) > limite
+            correos = correos[:limite]
             
-            # Convertir a formato frontend
-            return [correo.to_frontend_format() for correo in correos]
+            # Convertir a formato frontend (el cuerpo se pide al abrir el correo)
+            return {
+                'emails': [correo.to_frontend_format(incluir_body=False) for correo in correos],
+                'siguiente_cursor': self.tools.codificar_cursor(
+                    correos[-1].received_date, correos[-1].id
+                ) if hay_mas else None
+            }
             
         except Exception as e:
             print(f"Error obteniendo correos de BD: {e}")
-            return []
+            return {'emails': [], 'siguiente_cursor': None}
+
+    # Helper con las columnas que cargan los listados (sin body_content, que solo va en el detalle)
+    def _columnas_listado(self):
+        return load_only(*[
+            getattr(CorreosMicrosoftModel, columna) for columna in (
+                'id', 'message_id', 'subject', 'from_name', 'from_email', 'received_date',
+                'body_preview', 'body_cargado', 'estado', 'ticket', 'asignado', 'prioridad',
+                'tipo_soporte', 'tipo_ticket', 'macroproceso', 'fecha_vencimiento', 'sla',
+                'has_attachments', 'attachments_count', 'created_at', 'updated_at'
+            )
+        ])
+
+    # Helper para la condición de paginación keyset: filas posteriores al cursor en orden descendente
+    def _condicion_cursor(self, columna_fecha, columna_id, cursor):
+        """cursor: (fecha, id) de la última fila entregada -> (fecha, id) < cursor"""
+        fecha, ultimo_id = cursor
+        if fecha is None:
+            return columna_id < ultimo_id
+        return or_(
+            columna_fecha < fecha,
+            and_(columna_fecha == fecha, columna_id < ultimo_id)
+        )
 
     # Query para insertar un nuevo correo
     def insertar_correo(self, correo_data):
@@ -211,6 +274,7 @@ class Querys:
                 correo_data.get('from_email', '')
             )
             correo_data['hash_contenido'] = hash_contenido
+            correo_data['subject_huella'] = huella_subject(correo_data.get('subject'))
             
             nuevo_correo = CorreosMicrosoftModel(correo_data)
             self.db.add(nuevo_correo)
@@ -249,17 +313,549 @@ class Querys:
             print(f"Error actualizando correo: {e}")
             return None
     
-    # Query para obtener todos los message_ids existentes en BD
-    def obtener_message_ids_existentes(self):
-        """Obtiene todos los message_ids existentes en BD"""
+    # Query para obtener los hashes de un lote de correos existentes en BD
+    def obtener_hashes_existentes(self, message_ids):
+        """
+        Obtiene {message_id: hash_contenido} de los message_ids dados en una sola consulta
+        """
         try:
-            result = self.db.query(CorreosMicrosoftModel.message_id).all()
-            return {row[0] for row in result}  # Set para búsqueda rápida
-            
+            if not message_ids:
+                return {}
+
+            result = self.db.query(
+                CorreosMicrosoftModel.message_id,
+                CorreosMicrosoftModel.hash_contenido
+            ).filter(
+                CorreosMicrosoftModel.message_id.in_(list(message_ids))
+            ).all()
+
+            return {row[0]: row[1] for row in result}
+
+        except Exception as e:
+            print(f"Error obteniendo hashes existentes: {e}")
+            return {}
+
+    # Helper para construir la fila de inserción de un correo (mismos valores que el modelo)
+    def _fila_insert_correo(self, correo_data, hash_contenido, ahora):
+        """Construye la fila completa para la inserción por lote de un correo"""
+        fila = {
+            'message_id': correo_data.get('message_id'),
+            'buzon': correo_data.get('buzon'),
+            'carpeta': correo_data.get('carpeta'),
+            'conversation_id': correo_data.get('conversation_id'),
+            'subject': correo_data.get('subject', ''),
+            'subject_huella': huella_subject(correo_data.get('subject')),
+            'from_email': correo_data.get('from_email', ''),
+            'from_name': correo_data.get('from_name', ''),
+            'received_date': correo_data.get('received_date'),
+            'body_preview': correo_data.get('body_preview', ''),
+            'body_content': correo_data.get('body_content') or '',
+            'body_cargado': correo_data.get('body_cargado', 0),
+            'estado': correo_data.get('estado', 1),
+            'hash_contenido': hash_contenido,
+            'attachments_count': correo_data.get('attachments_count', 0),
+            'has_attachments': correo_data.get('has_attachments', 0),
+            'ticket': 0,
+            'asignado': None,
+            'prioridad': None,
+            'tipo_soporte': None,
+            'tipo_ticket': None,
+            'macroproceso': None,
+            'fecha_vencimiento': None,
+            'sla': None,
+            'activo': 1,
+            'created_at': ahora,
+            'updated_at': ahora
+        }
+
+        # Respuesta a un hilo existente: se registra igual que registrar_respuesta_entrante_ticket
+        if correo_data.get('es_respuesta'):
+            fila['subject'] = f"[RESPUESTA] {correo_data.get('subject', '')}"
+            fila['body_preview'] = (correo_data.get('subject') or '')[:100]
+            fila['estado'] = 2  # Estado 2 = Respuesta procesada (no aparece en buzón)
+
+        return fila
+
+    # Query para insertar/actualizar una página de correos en una sola transacción
+    def upsert_correos_lote(self, correos_data, existentes=None):
+        """
+        Inserta o actualiza una página completa de correos de Graph en una sola transacción
+        (executemany con fast_executemany) en lugar de un SELECT + commit por correo.
+        - correos_data: lista de dicts en formato _preparar_datos_correo. Los correos nuevos
+          marcados con 'es_respuesta' se registran como respuesta del ticket 'ticket_padre_id'
+        - existentes: dict {message_id: hash_contenido}; si no se envía se consulta en BD
+        Returns: dict con conteos nuevos, actualizados, sin_cambios y respuestas_procesadas
+        """
+        stats = {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0}
+        if not correos_data:
+            return stats
+
+        if existentes is None:
+            existentes = self.obtener_hashes_existentes(
+                [correo.get('message_id') for correo in correos_data]
+            )
+
+        ahora = datetime.now()
+        filas_insert = []
+        filas_update = []
+        tickets_con_respuesta = set()
+        vistos = set()
+
+        for correo_data in correos_data:
+            message_id = correo_data.get('message_id')
+            if not message_id or message_id in vistos:
+                continue
+            vistos.add(message_id)
+
+            hash_nuevo = self.generar_hash_contenido(
+                correo_data.get('subject', ''),
+                correo_data.get('body_preview', ''),
+                correo_data.get('from_email', '')
+            )
+
+            if message_id in existentes:
+                if hash_nuevo != existentes[message_id]:
+                    # Solo se actualizan los campos que vienen de Graph (no el estado del ticket)
+                    filas_update.append({
+                        'b_message_id': message_id,
+                        'conversation_id': correo_data.get('conversation_id'),
+                        'subject': correo_data.get('subject', ''),
+                        'subject_huella': huella_subject(correo_data.get('subject')),
+                        'from_email': correo_data.get('from_email', ''),
+                        'from_name': correo_data.get('from_name', ''),
+                        'received_date': correo_data.get('received_date'),
+                        'body_preview': correo_data.get('body_preview', ''),
+                        # En sync de solo metadatos el cuerpo cacheado se invalida y se recarga al abrirlo
+                        'body_content': correo_data.get('body_content'),
+                        'body_cargado': correo_data.get('body_cargado', 0),
+                        'has_attachments': correo_data.get('has_attachments', 0),
+                        'hash_contenido': hash_nuevo,
+                        'updated_at': ahora
+                    })
+                    stats['actualizados'] += 1
+                else:
+                    stats['sin_cambios'] += 1
+                continue
+
+            filas_insert.append(self._fila_insert_correo(correo_data, hash_nuevo, ahora))
+            if correo_data.get('es_respuesta'):
+                stats['respuestas_procesadas'] += 1
+                if correo_data.get('ticket_padre_id') is not None:
+                    tickets_con_respuesta.add(correo_data['ticket_padre_id'])
+            else:
+                stats['nuevos'] += 1
+
+        tabla = CorreosMicrosoftModel.__table__
+        try:
+            # Inserción, actualización y última actividad quedan completas o no queda nada,
+            # así el respaldo correo por correo parte de la página sin escribir
+            with self._transaccion():
+                if filas_insert:
+                    self.db.execute(insert(tabla), filas_insert)
+
+                if filas_update:
+                    self.db.execute(
+                        update(tabla).where(tabla.c.message_id == bindparam('b_message_id')),
+                        filas_update
+                    )
+
+                if tickets_con_respuesta:
+                    # Última actividad de los tickets que recibieron respuestas
+                    self.db.query(CorreosMicrosoftModel).filter(
+                        CorreosMicrosoftModel.id.in_(list(tickets_con_respuesta))
+                    ).update({CorreosMicrosoftModel.updated_at: ahora}, synchronize_session=False)
+
+            self.db.commit()
+            return stats
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error en upsert por lote, reintentando correo por correo: {e}")
+            return self._upsert_correos_individual(correos_data)
+
+    # Helper para agrupar varias sentencias en una transacción real
+    @contextmanager
+    def _transaccion(self):
+        """
+        El engine abre las conexiones con autocommit (Config/db.py): cada sentencia se
+        confirma sola y db.rollback() no deshace nada. Durante el bloque se desactiva el
+        autocommit de la conexión DBAPI, de modo que todo se confirma al final o se
+        revierte si alguna sentencia falla.
+        """
+        conexion = self.db.connection().connection.dbapi_connection
+        conexion.autocommit = False
+        try:
+            yield
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+        finally:
+            conexion.autocommit = True
+
+    # Helper de respaldo: procesa el lote correo por correo para aislar filas con error
+    def _upsert_correos_individual(self, correos_data):
+        """Procesa un lote correo por correo (respaldo cuando falla la transacción del lote)"""
+        stats = {'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'respuestas_procesadas': 0}
+
+        for correo_data in correos_data:
+            message_id = correo_data.get('message_id')
+            try:
+                existente = self.obtener_hashes_existentes([message_id])
+                if message_id in existente:
+                    hash_nuevo = self.generar_hash_contenido(
+                        correo_data.get('subject', ''),
+                        correo_data.get('body_preview', ''),
+                        correo_data.get('from_email', '')
+                    )
+                    if hash_nuevo != existente[message_id]:
+                        datos_actualizacion = {
+                            campo: correo_data.get(campo)
+                            for campo in ('conversation_id', 'subject', 'from_email', 'from_name',
+                                          'received_date', 'body_preview', 'body_content',
+                                          'body_cargado', 'has_attachments')
+                        }
+                        datos_actualizacion['hash_contenido'] = hash_nuevo
+                        datos_actualizacion['subject_huella'] = huella_subject(correo_data.get('subject'))
+                        self.actualizar_correo(message_id, datos_actualizacion)
+                        stats['actualizados'] += 1
+                    else:
+                        stats['sin_cambios'] += 1
+                elif correo_data.get('es_respuesta'):
+                    if self.registrar_respuesta_entrante_ticket({
+                        **correo_data,
+                        'ticket_id': correo_data.get('ticket_padre_id')
+                    }):
+                        if correo_data.get('ticket_padre_id') is not None:
+                            self.actualizar_ultima_actividad_ticket(correo_data['ticket_padre_id'])
+                        stats['respuestas_procesadas'] += 1
+                elif self.insertar_correo(dict(correo_data)):
+                    stats['nuevos'] += 1
+
+            except Exception as e:
+                print(f"Error procesando correo {message_id}: {e}")
+                continue
+
+        return stats
+
+    # Query para obtener el índice (message_id, hash) de una ventana de fechas de recepción
+    def obtener_indice_hashes_ventana(self, fecha_desde, fecha_hasta, buzon=None, incluir_sin_origen=False,
+                                      limite=None):
+        """
+        Obtiene {message_id: hash_contenido} de los correos del buzón recibidos dentro de la
+        ventana [fecha_desde, fecha_hasta] de la página en una sola consulta, para que la
+        detección de cambios sea proporcional a la ventana y no al tamaño de la tabla.
+        - buzon: solo los correos de ese buzón; incluir_sin_origen agrega los guardados antes
+          de registrar el origen (buzon NULL, solo el buzón principal)
+        - limite: si la ventana tiene más filas retorna None (conviene consultar por message_id)
+        """
+        try:
+            query = self.db.query(
+                CorreosMicrosoftModel.message_id,
+                CorreosMicrosoftModel.hash_contenido
+            ).filter(
+                CorreosMicrosoftModel.received_date >= fecha_desde,
+                CorreosMicrosoftModel.received_date <= fecha_hasta
+            )
+
+            if buzon:
+                condicion = CorreosMicrosoftModel.buzon == buzon
+                if incluir_sin_origen:
+                    condicion = condicion | CorreosMicrosoftModel.buzon.is_(None)
+                query = query.filter(condicion)
+
+            if limite:
+                query = query.limit(limite + 1)
+
+            result = query.all()
+            if limite and len(result) > limite:
+                return None
+
+            return {row[0]: row[1] for row in result}
+
+        except Exception as e:
+            print(f"Error obteniendo índice de hashes por ventana: {e}")
+            return None
+
+    # Query para obtener los correos recientes con los que se construye el índice de hilos
+    def obtener_correos_indice_hilos(self, dias=7, message_ids=None):
+        """
+        Obtiene en una sola consulta los correos activos (estado 1) creados en los últimos
+        `dias` días, o los de la lista message_ids, con los campos que usa la detección de hilos
+        """
+        try:
+            query = self.db.query(
+                CorreosMicrosoftModel.id,
+                CorreosMicrosoftModel.subject,
+                CorreosMicrosoftModel.from_email,
+                CorreosMicrosoftModel.conversation_id,
+                CorreosMicrosoftModel.created_at,
+                CorreosMicrosoftModel.subject_huella
+            ).filter(
+                CorreosMicrosoftModel.estado == 1
+            )
+
+            if message_ids is not None:
+                if not message_ids:
+                    return []
+                query = query.filter(CorreosMicrosoftModel.message_id.in_(message_ids))
+            else:
+                query = query.filter(
+                    CorreosMicrosoftModel.created_at >= datetime.now() - timedelta(days=dias)
+                )
+
+            return [
+                {
+                    'id': row[0],
+                    'subject': row[1],
+                    'from_email': row[2],
+                    'conversation_id': row[3],
+                    'created_at': row[4],
+                    'subject_huella': row[5]
+                }
+                for row in query.all()
+            ]
+
+        except Exception as e:
+            print(f"Error obteniendo correos para el índice de hilos: {e}")
+            return []
+
+    # Query para completar la huella del subject en correos guardados antes de existir la columna
+    def completar_subject_huella(self, lote=1000):
+        """
+        Calcula subject_huella de los correos que no la tienen, recorriendo la tabla por
+        rangos de id y actualizando cada lote con una sola sentencia executemany.
+        Returns: cantidad de correos actualizados
+        """
+        tabla = CorreosMicrosoftModel.__table__
+        ultimo_id = 0
+        actualizados = 0
+
+        try:
+            while True:
+                filas = self.db.query(
+                    CorreosMicrosoftModel.id,
+                    CorreosMicrosoftModel.subject
+                ).filter(
+                    CorreosMicrosoftModel.subject_huella.is_(None),
+                    CorreosMicrosoftModel.id > ultimo_id
+                ).order_by(
+                    CorreosMicrosoftModel.id
+                ).limit(lote).all()
+
+                if not filas:
+                    break
+                ultimo_id = filas[-1][0]
+
+                valores = [
+                    {'b_id': fila[0], 'subject_huella': huella_subject(fila[1])}
+                    for fila in filas
+                ]
+                valores = [valor for valor in valores if valor['subject_huella']]
+                if valores:
+                    self.db.execute(
+                        update(tabla).where(tabla.c.id == bindparam('b_id')),
+                        valores
+                    )
+                    self.db.commit()
+                    actualizados += len(valores)
+
+            return actualizados
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error completando subject_huella: {e}")
+            return actualizados
+
+    # Query para desactivar en bloque correos eliminados o movidos fuera de la carpeta
+    def desactivar_correos_eliminados(self, message_ids, tamano_lote=1000):
+        """
+        Desactiva (activo = 0) los correos de la bandeja que ya no existen en la carpeta.
+        No toca correos convertidos en ticket ni respuestas registradas en un hilo (estado 2).
+        Returns: cantidad de correos desactivados
+        """
+        desactivados = 0
+        try:
+            for i in range(0, len(message_ids), tamano_lote):
+                desactivados += self.db.query(CorreosMicrosoftModel).filter(
+                    CorreosMicrosoftModel.message_id.in_(message_ids[i:i + tamano_lote]),
+                    CorreosMicrosoftModel.ticket == 0,
+                    CorreosMicrosoftModel.activo == 1,
+                    CorreosMicrosoftModel.estado != 2
+                ).update({
+                    CorreosMicrosoftModel.activo: 0,
+                    CorreosMicrosoftModel.updated_at: datetime.now()
+                }, synchronize_session=False)
+
+            self.db.commit()
+            return desactivados
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error desactivando correos eliminados: {e}")
+            return 0
+
+    # Query para obtener los message_id activos de la bandeja (barrido de reconciliación)
+    def obtener_message_ids_activos(self, buzon=None, carpeta=None, incluir_sin_origen=False):
+        """
+        Obtiene el set de message_id de los correos activos de la bandeja que aún no son ticket.
+        Con buzon/carpeta se limita a esa fuente; incluir_sin_origen agrega los correos
+        sincronizados antes de registrar el origen (buzon NULL, solo la fuente principal)
+        """
+        try:
+            query = self.db.query(
+                CorreosMicrosoftModel.message_id
+            ).filter(
+                *self._filtros_base(ticket=0),
+                CorreosMicrosoftModel.estado != 2
+            )
+
+            if buzon:
+                condicion = (CorreosMicrosoftModel.buzon == buzon) & (CorreosMicrosoftModel.carpeta == carpeta)
+                if incluir_sin_origen:
+                    condicion = condicion | CorreosMicrosoftModel.buzon.is_(None)
+                query = query.filter(condicion)
+
+            result = query.all()
+
+            return {row[0] for row in result}
+
         except Exception as e:
-            print(f"Error obteniendo message_ids existentes: {e}")
+            print(f"Error obteniendo message_ids activos: {e}")
             return set()
-    
+
+    # Query para obtener el buzón de origen de varios correos
+    def obtener_buzones_correos(self, message_ids):
+        """Retorna {message_id: buzon} (solo los correos con buzón registrado)"""
+        if not message_ids:
+            return {}
+
+        try:
+            result = self.db.query(
+                CorreosMicrosoftModel.message_id,
+                CorreosMicrosoftModel.buzon
+            ).filter(
+                CorreosMicrosoftModel.message_id.in_(list(message_ids)),
+                CorreosMicrosoftModel.buzon.isnot(None)
+            ).all()
+
+            return {row[0]: row[1] for row in result}
+
+        except Exception as e:
+            print(f"Error obteniendo buzones de correos: {e}")
+            return {}
+
+    # Query para guardar los metadatos de attachments de varios correos
+    def guardar_adjuntos_correos(self, adjuntos: dict):
+        """
+        Reemplaza los attachments registrados de cada correo por los recibidos de Graph
+        ({message_id: [attachments]}) y actualiza su attachments_count, en una transacción:
+        si algo falla no queda un attachments_count sin sus filas (el correo se vuelve a
+        consultar en Graph al pedir sus attachments).
+        """
+        if not adjuntos:
+            return 0
+
+        try:
+            message_ids = list(adjuntos.keys())
+            filas = [
+                {
+                    'message_id': message_id,
+                    'attachment_id': adjunto.get('id'),
+                    'nombre': (adjunto.get('name') or '')[:500],
+                    'content_type': adjunto.get('contentType') or '',
+                    'size': adjunto.get('size') or 0,
+                    'is_inline': 1 if adjunto.get('isInline') else 0,
+                    'created_at': datetime.now()
+                }
+                for message_id, lista in adjuntos.items()
+                for adjunto in lista
+                if adjunto.get('id')
+            ]
+            tabla = CorreosMicrosoftModel.__table__
+
+            with self._transaccion():
+                self.db.query(AdjuntosModel).filter(
+                    AdjuntosModel.message_id.in_(message_ids)
+                ).delete(synchronize_session=False)
+
+                if filas:
+                    self.db.execute(insert(AdjuntosModel.__table__), filas)
+
+                self.db.execute(
+                    update(tabla).where(tabla.c.message_id == bindparam('b_message_id')),
+                    [
+                        {'b_message_id': message_id, 'attachments_count': len(lista)}
+                        for message_id, lista in adjuntos.items()
+                    ]
+                )
+
+            self.db.commit()
+            return len(filas)
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando attachments de correos: {e}")
+            return 0
+
+    # Query para obtener los metadatos de attachments registrados de varios correos
+    def obtener_adjuntos_correos(self, message_ids):
+        """
+        Retorna {message_id: [attachments]} de los correos que ya tienen sus attachments
+        registrados (correos con has_attachments y attachments_count > 0, o sin attachments).
+        Los correos con has_attachments cuyos attachments aún no se han capturado no se incluyen.
+        """
+        if not message_ids:
+            return {}
+
+        try:
+            correos = self.db.query(
+                CorreosMicrosoftModel.message_id,
+                CorreosMicrosoftModel.has_attachments,
+                CorreosMicrosoftModel.attachments_count
+            ).filter(
+                CorreosMicrosoftModel.message_id.in_(list(message_ids))
+            ).all()
+
+            resultado = {
+                row[0]: [] for row in correos
+                if not row[1] or row[2]
+            }
+
+            con_adjuntos = [row[0] for row in correos if row[1] and row[2]]
+            if con_adjuntos:
+                adjuntos = self.db.query(AdjuntosModel).filter(
+                    AdjuntosModel.message_id.in_(con_adjuntos)
+                ).order_by(AdjuntosModel.id).all()
+
+                for adjunto in adjuntos:
+                    resultado[adjunto.message_id].append(adjunto.to_dict())
+
+            return resultado
+
+        except Exception as e:
+            print(f"Error obteniendo attachments de correos: {e}")
+            return {}
+
+    # Query para guardar en caché el cuerpo completo de un correo
+    def guardar_cuerpo_correo(self, message_id, body_content):
+        """Guarda el cuerpo completo de un correo traído bajo demanda desde Graph"""
+        try:
+            actualizados = self.db.query(CorreosMicrosoftModel).filter(
+                CorreosMicrosoftModel.message_id == message_id
+            ).update({
+                CorreosMicrosoftModel.body_content: body_content,
+                CorreosMicrosoftModel.body_cargado: 1
+            }, synchronize_session=False)
+
+            self.db.commit()
+            return actualizados > 0
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando cuerpo del correo {message_id}: {e}")
+            return False
+
     # Query para marcar un correo como procesado o cambiar su estado
     def marcar_correo_procesado(self, message_id, nuevo_estado='procesado'):
         """Marca un correo como procesado o cambia su estado"""
@@ -370,139 +966,62 @@ class Querys:
             return None
     
     # Query para obtener correos convertidos en tickets con filtrado optimizado por vista
-    def obtener_tickets_correos(self, vista=None, limite=100, offset=0, tecnico_id=None):
+    def obtener_tickets_correos(self, vista=None, limite=100, offset=0, tecnico_id=None, cursor=None, incluir_total=True):
         """
         Obtiene correos convertidos en tickets desde la base de datos
         Filtrado optimizado por vista para máximo rendimiento
         Incluye JOIN con IntranetEstadosTickets para obtener el nombre del estado
+        Paginación por offset o por cursor keyset (received_date, id); ver obtener_pagina_correos_bd
+        El total sale de la misma consulta (COUNT(*) OVER()); no se calcula con incluir_total=False
+        ni en páginas por cursor (total None)
         """
         try:
-            # Query base con JOINs: correos activos convertidos a tickets + información completa
-            query = self.db.query(
-                CorreosMicrosoftModel,
-                IntranetEstadosTickets.nombre.label('estado_nombre'),
-                IntranetUsuariosGestionTicModel.nombre.label('tecnico_nombre'),
-                IntranetTipoPrioridadModel.nombre.label('prioridad_nombre'),
-                IntranetTipoSoporteModel.nombre.label('tipo_soporte_nombre'),
-                IntranetTipoTicketModel.nombre.label('tipo_ticket_nombre'),
-                IntranetPerfilesMacroprocesoModel.nombre.label('macroproceso_nombre')
-            ).outerjoin(
-                IntranetEstadosTickets, 
-                CorreosMicrosoftModel.estado == IntranetEstadosTickets.id
-            ).outerjoin(
-                IntranetUsuariosGestionTicModel,
-                CorreosMicrosoftModel.asignado == IntranetUsuariosGestionTicModel.id
-            ).outerjoin(
-                IntranetTipoPrioridadModel,
-                CorreosMicrosoftModel.prioridad == IntranetTipoPrioridadModel.id
-            ).outerjoin(
-                IntranetTipoSoporteModel,
-                CorreosMicrosoftModel.tipo_soporte == IntranetTipoSoporteModel.id
-            ).outerjoin(
-                IntranetTipoTicketModel,
-                CorreosMicrosoftModel.tipo_ticket == IntranetTipoTicketModel.id
-            ).outerjoin(
-                IntranetPerfilesMacroprocesoModel,
-                CorreosMicrosoftModel.macroproceso == IntranetPerfilesMacroprocesoModel.id
-            ).filter(
-                CorreosMicrosoftModel.activo == 1,
-                CorreosMicrosoftModel.ticket == 1
-            )
-            
-            # Aplicar filtros específicos por vista
-            if vista == 'todos':
-                # Ya tenemos el filtro base
-                pass
-            elif vista == 'sin':
-                # Sin asignar: donde asignado es NULL o vacío
-                query = query.filter(
-                    CorreosMicrosoftModel.asignado.is_(None)
-                )
-            elif vista == 'abiertos':
-                # Estado = 1 (Abierto)
-                query = query.filter(CorreosMicrosoftModel.estado == 1)
-            elif vista == 'proceso':
-                # Estado = 2 (En Proceso)
-                query = query.filter(CorreosMicrosoftModel.estado == 2)
-            elif vista == 'comp':
-                # Estado = 4 (Completado)
-                query = query.filter(CorreosMicrosoftModel.estado == 3)
-            elif vista and vista.startswith('tecnico_'):
-                # Filtro por técnico específico: tecnico_1, tecnico_2, etc.
-                tecnico_id_from_vista = vista.replace('tecnico_', '')
-                try:
-                    tecnico_id_int = int(tecnico_id_from_vista)
-                    query = query.filter(CorreosMicrosoftModel.asignado == tecnico_id_int)
-                except ValueError:
-                    # Si no es un número válido, no aplicar filtro
-                    pass
-            
-            # Filtro adicional por tecnico_id específico (parámetro directo)
-            if tecnico_id:
-                query = query.filter(CorreosMicrosoftModel.asignado == tecnico_id)
-            
-            # Ordenar por fecha recibida (más recientes primero)
-            query = query.order_by(CorreosMicrosoftModel.received_date.desc())
-            
-            # Obtener total para paginación (sin JOIN para mejor performance en count)
-            count_query = self.db.query(CorreosMicrosoftModel).filter(
-                CorreosMicrosoftModel.activo == 1,
-                CorreosMicrosoftModel.ticket == 1
-            )
-            
-            # Aplicar los mismos filtros para el conteo
-            if vista == 'sin':
-                count_query = count_query.filter(CorreosMicrosoftModel.asignado.is_(None))
-            elif vista == 'abiertos':
-                count_query = count_query.filter(CorreosMicrosoftModel.estado == 1)
-            elif vista == 'proceso':
-                count_query = count_query.filter(CorreosMicrosoftModel.estado == 2)
-            elif vista == 'comp':
-                count_query = count_query.filter(CorreosMicrosoftModel.estado == 3)
-            elif vista and vista.startswith('tecnico_'):
-                # Aplicar el mismo filtro de técnico para el conteo
-                tecnico_id_from_vista = vista.replace('tecnico_', '')
-                try:
-                    tecnico_id_int = int(tecnico_id_from_vista)
-                    count_query = count_query.filter(CorreosMicrosoftModel.asignado == tecnico_id_int)
-                except ValueError:
-                    pass
-                    
-            # Filtro adicional por tecnico_id para el conteo
-            if tecnico_id:
-                count_query = count_query.filter(CorreosMicrosoftModel.asignado == tecnico_id)
-            
-            total = count_query.count()
-            
-            # Aplicar paginación y obtener resultados
-            resultados = query.offset(offset).limit(limite).all()
+            # Query base con JOINs: correos activos convertidos a tickets (solo columnas del listado)
+            filtros = self._filtros_tickets_vista(vista, tecnico_id)
+            query = self._query_tickets_con_nombres().options(
+                self._columnas_listado()
+            ).filter(*filtros)
+
+            contar = incluir_total and not cursor
+            if contar:
+                query = query.add_columns(func.count().over().label('total'))
+            
+            # Ordenar por fecha recibida (más recientes primero); id desempata para un orden estable
+            query = query.order_by(CorreosMicrosoftModel.received_date.desc(), CorreosMicrosoftModel.id.desc())
+            
+            # Aplicar paginación (keyset si llega cursor) con una fila extra para saber si hay más
+            if cursor:
+                query = query.filter(self._condicion_cursor(
+                    CorreosMicrosoftModel.received_date, CorreosMicrosoftModel.id, cursor
+                ))
+            resultados = query.offset(0 if cursor else offset).limit(limite + 1).all()
+            hay_mas = len(resultados) > limite
+            resultados = resultados[:limite]
+
+            total = None
+            if contar:
+                if resultados:
+                    total = resultados[0].total
+                elif offset:
+                    # Página fuera de rango: la ventana no trae filas, se cuenta aparte con los mismos filtros
+                    total = self.db.query(func.count(CorreosMicrosoftModel.id)).filter(*filtros).scalar() or 0
+                else:
+                    total = 0
             
             # Convertir a formato frontend con información adicional de todos los JOINs
             tickets = []
-            for correo, estado_nombre, tecnico_nombre, prioridad_nombre, tipo_soporte_nombre, tipo_ticket_nombre, macroproceso_nombre in resultados:
-                ticket_data = correo.to_frontend_format()
-                # Agregar información del estado
-                ticket_data['estado_nombre'] = estado_nombre or '-'
-                ticket_data['estadoTicket'] = estado_nombre or '-'  # Para compatibilidad
-                # Agregar información del técnico asignado
-                ticket_data['tecnico_nombre'] = tecnico_nombre or '-'
-                ticket_data['asignadoNombre'] = tecnico_nombre or '-'  # Para compatibilidad
-                # Agregar información de prioridad
-                ticket_data['prioridad_nombre'] = prioridad_nombre or '-'
-                # Agregar información de tipo de soporte
-                ticket_data['tipo_soporte_nombre'] = tipo_soporte_nombre or '-'
-                # Agregar información de tipo de ticket
-                ticket_data['tipo_ticket_nombre'] = tipo_ticket_nombre or '-'
-                # Agregar información de macroproceso
-                ticket_data['macroproceso_nombre'] = macroproceso_nombre or '-'
-                tickets.append(ticket_data)
+            for fila in resultados:
+                tickets.append(self._formato_ticket_con_nombres(fila[:7], incluir_body=False))
             
             return {
                 'tickets': tickets,
                 'total': total,
                 'limite': limite,
                 'offset': offset,
-                'vista': vista
+                'vista': vista,
+                'siguiente_cursor': self.tools.codificar_cursor(
+                    resultados[-1][0].received_date, resultados[-1][0].id
+                ) if hay_mas else None
             }
             
         except Exception as e:
@@ -512,9 +1031,126 @@ class Querys:
                 'total': 0,
                 'limite': limite,
                 'offset': offset,
-                'vista': vista
+                'vista': vista,
+                'siguiente_cursor': None
             }
     
+    # Helper con el filtro base de la bandeja (ticket=0) o de la cola de tickets (ticket=1)
+    def _filtros_base(self, ticket):
+        """
+        activo = 1 AND ticket = 0|1 con los valores en línea y no como parámetros:
+        SQL Server solo usa los índices filtrados (idx_bandeja_*, idx_tickets_*) cuando
+        el predicado de la consulta es literal.
+        """
+        return [
+            CorreosMicrosoftModel.activo == literal_column('1'),
+            CorreosMicrosoftModel.ticket == literal_column('1' if ticket else '0')
+        ]
+
+    # Helper con los filtros de los listados de tickets por vista (una sola definición para página y total)
+    def _filtros_tickets_vista(self, vista=None, tecnico_id=None):
+        filtros = self._filtros_base(ticket=1)
+
+        # Aplicar filtros específicos por vista ('todos' solo usa el filtro base)
+        if vista == 'sin':
+            # Sin asignar: donde asignado es NULL o vacío
+            filtros.append(CorreosMicrosoftModel.asignado.is_(None))
+        elif vista == 'abiertos':
+            # Estado = 1 (Abierto)
+            filtros.append(CorreosMicrosoftModel.estado == 1)
+        elif vista == 'proceso':
+            # Estado = 2 (En Proceso)
+            filtros.append(CorreosMicrosoftModel.estado == 2)
+        elif vista == 'comp':
+            # Estado = 3 (Completado)
+            filtros.append(CorreosMicrosoftModel.estado == 3)
+        elif vista and vista.startswith('tecnico_'):
+            # Filtro por técnico específico: tecnico_1, tecnico_2, etc.
+            try:
+                filtros.append(CorreosMicrosoftModel.asignado == int(vista.replace('tecnico_', '')))
+            except ValueError:
+                # Si no es un número válido, no aplicar filtro
+                pass
+
+        # Filtro adicional por tecnico_id específico (parámetro directo)
+        if tecnico_id:
+            filtros.append(CorreosMicrosoftModel.asignado == tecnico_id)
+
+        return filtros
+
+    # Helper con la query de tickets y los JOINs de nombres (estado, técnico, prioridad, tipos, macroproceso)
+    def _query_tickets_con_nombres(self):
+        return self.db.query(
+            CorreosMicrosoftModel,
+            IntranetEstadosTickets.nombre.label('estado_nombre'),
+            IntranetUsuariosGestionTicModel.nombre.label('tecnico_nombre'),
+            IntranetTipoPrioridadModel.nombre.label('prioridad_nombre'),
+            IntranetTipoSoporteModel.nombre.label('tipo_soporte_nombre'),
+            IntranetTipoTicketModel.nombre.label('tipo_ticket_nombre'),
+            IntranetPerfilesMacroprocesoModel.nombre.label('macroproceso_nombre')
+        ).outerjoin(
+            IntranetEstadosTickets, 
+            CorreosMicrosoftModel.estado == IntranetEstadosTickets.id
+        ).outerjoin(
+            IntranetUsuariosGestionTicModel,
+            CorreosMicrosoftModel.asignado == IntranetUsuariosGestionTicModel.id
+        ).outerjoin(
+            IntranetTipoPrioridadModel,
+            CorreosMicrosoftModel.prioridad == IntranetTipoPrioridadModel.id
+        ).outerjoin(
+            IntranetTipoSoporteModel,
+            CorreosMicrosoftModel.tipo_soporte == IntranetTipoSoporteModel.id
+        ).outerjoin(
+            IntranetTipoTicketModel,
+            CorreosMicrosoftModel.tipo_ticket == IntranetTipoTicketModel.id
+        ).outerjoin(
+            IntranetPerfilesMacroprocesoModel,
+            CorreosMicrosoftModel.macroproceso == IntranetPerfilesMacroprocesoModel.id
+        )
+
+    # Helper para convertir una fila de _query_tickets_con_nombres al formato frontend
+    def _formato_ticket_con_nombres(self, fila, incluir_body=True):
+        correo, estado_nombre, tecnico_nombre, prioridad_nombre, tipo_soporte_nombre, tipo_ticket_nombre, macroproceso_nombre = fila
+        ticket_data = correo.to_frontend_format(incluir_body)
+        # Agregar información del estado
+        ticket_data['estado_nombre'] = estado_nombre or '-'
+        ticket_data['estadoTicket'] = estado_nombre or '-'  # Para compatibilidad
+        # Agregar información del técnico asignado
+        ticket_data['tecnico_nombre'] = tecnico_nombre or '-'
+        ticket_data['asignadoNombre'] = tecnico_nombre or '-'  # Para compatibilidad
+        # Agregar información de prioridad
+        ticket_data['prioridad_nombre'] = prioridad_nombre or '-'
+        # Agregar información de tipo de soporte
+        ticket_data['tipo_soporte_nombre'] = tipo_soporte_nombre or '-'
+        # Agregar información de tipo de ticket
+        ticket_data['tipo_ticket_nombre'] = tipo_ticket_nombre or '-'
+        # Agregar información de macroproceso
+        ticket_data['macroproceso_nombre'] = macroproceso_nombre or '-'
+        return ticket_data
+
+    # Query para obtener el detalle completo (con cuerpo) de un ticket o correo
+    def obtener_detalle_ticket(self, ticket_id=None, message_id=None):
+        """Busca por id del ticket o por message_id; retorna el formato frontend con body y nombres"""
+        try:
+            query = self._query_tickets_con_nombres().filter(CorreosMicrosoftModel.activo == 1)
+            if ticket_id:
+                query = query.filter(CorreosMicrosoftModel.id == ticket_id)
+            else:
+                query = query.filter(CorreosMicrosoftModel.message_id == message_id)
+
+            fila = query.first()
+            if not fila:
+                return None
+
+            detalle = self._formato_ticket_con_nombres(fila)
+            detalle['conversation_id'] = fila[0].conversation_id
+            detalle['buzon'] = fila[0].buzon
+            return detalle
+
+        except Exception as e:
+            print(f"Error obteniendo detalle del ticket: {e}")
+            return None
+
     # Query para obtener todos los estados de tickets
     def obtener_estados_tickets(self):
         """
@@ -548,25 +1184,46 @@ class Querys:
             return []
     
     # Querys para logs de sincronización
-    def obtener_ultimo_sync_exitoso(self):
-        """Obtiene información del último sync exitoso"""
+    def obtener_ultimo_sync_exitoso(self, buzon=None, carpeta=None):
+        """Obtiene información del último sync exitoso (estado 1 y finalizado), opcionalmente de un buzón/carpeta"""
         try:
-            ultimo_sync = self.db.query(SyncLogModel).filter(
-                SyncLogModel.estado == 'exitoso'
-            ).order_by(SyncLogModel.fecha_fin.desc()).first()
+            query = self.db.query(SyncLogModel).filter(
+                SyncLogModel.estado == 1,
+                SyncLogModel.fecha_fin.isnot(None)
+            )
+            if buzon:
+                query = query.filter(SyncLogModel.buzon == buzon, SyncLogModel.carpeta == carpeta)
+
+            ultimo_sync = query.order_by(SyncLogModel.fecha_fin.desc()).first()
             
             return ultimo_sync.to_dict() if ultimo_sync else None
             
         except Exception as e:
             print(f"Error obteniendo último sync: {e}")
             return None
+
+    # Query para obtener el último log de sincronización (en curso, exitoso o con error)
+    def obtener_ultimo_sync(self):
+        """Obtiene el último registro de sincronización sin importar su estado"""
+        try:
+            ultimo_sync = self.db.query(SyncLogModel).order_by(
+                SyncLogModel.id.desc()
+            ).first()
+
+            return ultimo_sync.to_dict() if ultimo_sync else None
+
+        except Exception as e:
+            print(f"Error obteniendo último log de sync: {e}")
+            return None
     
     # Query para crear un nuevo log de sincronización
-    def crear_log_sync(self, tipo_sync='incremental'):
+    def crear_log_sync(self, tipo_sync='incremental', buzon=None, carpeta=None):
         """Crea un nuevo registro de sincronización"""
         try:
             log_data = {
                 'tipo_sync': tipo_sync,
+                'buzon': buzon,
+                'carpeta': carpeta,
                 'fecha_inicio': datetime.now(),
                 'estado': 1
             }
@@ -610,17 +1267,237 @@ class Querys:
             print(f"Error finalizando log de sync: {e}")
             return None
 
-    # Querys para obtener listas de prioridades, tipos de soporte, tipos de ticket y macroprocesos
-    def obtener_prioridades(self):
-        """
-        Obtiene todas las prioridades disponibles desde IntranetPrioridades
-        """
+    # Query para obtener el estado de sincronización (deltaLink) de un buzón/carpeta
+    def obtener_estado_sync(self, buzon, carpeta):
+        """Obtiene el estado de sincronización delta de un buzón y carpeta"""
         try:
-            prioridades = self.db.query(IntranetTipoPrioridadModel).filter(
-                IntranetTipoPrioridadModel.estado == 1
-            ).all()
-            
-            return [{'id': prioridad.id, 'nombre': prioridad.nombre} for prioridad in prioridades]
+            estado_sync = self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.buzon == buzon,
+                SyncEstadoModel.carpeta == carpeta
+            ).first()
+
+            return estado_sync.to_dict() if estado_sync else None
+
+        except Exception as e:
+            print(f"Error obteniendo estado de sync: {e}")
+            return None
+
+    # Query para obtener el buzón/carpeta dueño de una suscripción de notificaciones
+    def obtener_estado_sync_por_suscripcion(self, suscripcion_id):
+        """Obtiene el estado de sincronización cuya suscripción de Graph tiene ese id"""
+        try:
+            estado_sync = self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.suscripcion_id == suscripcion_id
+            ).first()
+
+            return estado_sync.to_dict() if estado_sync else None
+
+        except Exception as e:
+            print(f"Error obteniendo estado de sync por suscripción: {e}")
+            return None
+
+    # Query para guardar el deltaLink de la última ronda delta completada
+    def guardar_delta_link(self, buzon, carpeta, delta_link):
+        """Guarda (o reemplaza) el @odata.deltaLink de un buzón y carpeta"""
+        try:
+            estado_sync = self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.buzon == buzon,
+                SyncEstadoModel.carpeta == carpeta
+            ).first()
+
+            if not estado_sync:
+                estado_sync = SyncEstadoModel({'buzon': buzon, 'carpeta': carpeta})
+                self.db.add(estado_sync)
+
+            estado_sync.delta_link = delta_link
+            estado_sync.fecha_delta = datetime.now() if delta_link else None
+            # La ronda terminó: ya no hay páginas pendientes por reanudar
+            estado_sync.checkpoint_link = None
+            estado_sync.fecha_checkpoint = None
+
+            self.db.commit()
+            return True
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando deltaLink: {e}")
+            return False
+
+    # Query para guardar el checkpoint (nextLink) de la ronda de sincronización en curso
+    def guardar_checkpoint_sync(self, buzon, carpeta, checkpoint_link):
+        """
+        Guarda el @odata.nextLink de la siguiente página por procesar, para que una
+        sincronización interrumpida se reanude desde ahí. None limpia el checkpoint.
+        """
+        try:
+            self._asegurar_estado_sync(buzon, carpeta)
+            self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.buzon == buzon,
+                SyncEstadoModel.carpeta == carpeta
+            ).update({
+                SyncEstadoModel.checkpoint_link: checkpoint_link,
+                SyncEstadoModel.fecha_checkpoint: datetime.now() if checkpoint_link else None
+            }, synchronize_session=False)
+
+            self.db.commit()
+            return True
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando checkpoint de sync: {e}")
+            return False
+
+    # Query para guardar el id de Graph de la carpeta sincronizada
+    def guardar_folder_id_sync(self, buzon, carpeta, folder_id):
+        """Guarda el folder_id resuelto para no volver a pedirlo a Graph en cada sync"""
+        try:
+            self._asegurar_estado_sync(buzon, carpeta)
+            self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.buzon == buzon,
+                SyncEstadoModel.carpeta == carpeta
+            ).update({
+                SyncEstadoModel.folder_id: folder_id
+            }, synchronize_session=False)
+
+            self.db.commit()
+            return True
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando folder_id de sync: {e}")
+            return False
+
+    # Query para asegurar que exista la fila de estado de sync de un buzón/carpeta
+    def _asegurar_estado_sync(self, buzon, carpeta):
+        """Crea la fila de intranet_sync_estado si aún no existe"""
+        existe = self.db.query(SyncEstadoModel.id).filter(
+            SyncEstadoModel.buzon == buzon,
+            SyncEstadoModel.carpeta == carpeta
+        ).first()
+
+        if not existe:
+            try:
+                self.db.add(SyncEstadoModel({'buzon': buzon, 'carpeta': carpeta}))
+                self.db.commit()
+            except Exception:
+                # Otro proceso la creó al mismo tiempo (índice único buzon/carpeta)
+                self.db.rollback()
+
+    # Query para guardar la suscripción de notificaciones de Graph de un buzón/carpeta
+    def guardar_suscripcion_sync(self, buzon, carpeta, suscripcion_id, suscripcion_expira):
+        """Guarda el id y vencimiento de la suscripción (None limpia la suscripción)"""
+        try:
+            self._asegurar_estado_sync(buzon, carpeta)
+            self.db.query(SyncEstadoModel).filter(
+                SyncEstadoModel.buzon == buzon,
+                SyncEstadoModel.carpeta == carpeta
+            ).update({
+                SyncEstadoModel.suscripcion_id: suscripcion_id,
+                SyncEstadoModel.suscripcion_expira: suscripcion_expira
+            }, synchronize_session=False)
+
+            self.db.commit()
+            return True
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error guardando suscripción de notificaciones: {e}")
+            return False
+
+    # Query para adquirir el lease de sincronización de un buzón/carpeta
+    def adquirir_lease_sync(self, buzon, carpeta, owner, segundos):
+        """
+        Intenta tomar el lease de sincronización con un UPDATE atómico condicionado a que
+        el lease esté libre, vencido o ya sea del mismo owner.
+        Returns: True si el lease quedó en manos de owner
+        """
+        try:
+            self._asegurar_estado_sync(buzon, carpeta)
+
+            sql = text("""
+                UPDATE intranet_sync_estado
+                SET lease_owner = :owner,
+                    lease_expira = DATEADD(second, :segundos, GETDATE())
+                WHERE buzon = :buzon
+                AND carpeta = :carpeta
+                AND (lease_expira IS NULL OR lease_expira < GETDATE() OR lease_owner = :owner)
+            """)
+
+            result = self.db.execute(sql, {
+                "owner": owner,
+                "segundos": segundos,
+                "buzon": buzon,
+                "carpeta": carpeta
+            })
+            self.db.commit()
+
+            return result.rowcount == 1
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error adquiriendo lease de sync: {e}")
+            return False
+
+    # Query para extender el lease de sincronización mientras el sync avanza
+    def renovar_lease_sync(self, buzon, carpeta, owner, segundos):
+        """Extiende el vencimiento del lease si sigue en manos de owner"""
+        try:
+            sql = text("""
+                UPDATE intranet_sync_estado
+                SET lease_expira = DATEADD(second, :segundos, GETDATE())
+                WHERE buzon = :buzon
+                AND carpeta = :carpeta
+                AND lease_owner = :owner
+            """)
+
+            result = self.db.execute(sql, {
+                "owner": owner,
+                "segundos": segundos,
+                "buzon": buzon,
+                "carpeta": carpeta
+            })
+            self.db.commit()
+
+            return result.rowcount == 1
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error renovando lease de sync: {e}")
+            return False
+
+    # Query para liberar el lease de sincronización
+    def liberar_lease_sync(self, buzon, carpeta, owner):
+        """Libera el lease de sincronización si está en manos de owner"""
+        try:
+            sql = text("""
+                UPDATE intranet_sync_estado
+                SET lease_owner = NULL,
+                    lease_expira = NULL
+                WHERE buzon = :buzon
+                AND carpeta = :carpeta
+                AND lease_owner = :owner
+            """)
+
+            self.db.execute(sql, {"owner": owner, "buzon": buzon, "carpeta": carpeta})
+            self.db.commit()
+            return True
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error liberando lease de sync: {e}")
+            return False
+
+    # Querys para obtener listas de prioridades, tipos de soporte, tipos de ticket y macroprocesos
+    def obtener_prioridades(self):
+        """
+        Obtiene todas las prioridades disponibles desde IntranetPrioridades
+        """
+        try:
+            prioridades = self.db.query(IntranetTipoPrioridadModel).filter(
+                IntranetTipoPrioridadModel.estado == 1
+            ).all()
+            
+            return [{'id': prioridad.id, 'nombre': prioridad.nombre} for prioridad in prioridades]
             
         except Exception as e:
             print(f"Error obteniendo prioridades: {e}")
@@ -687,17 +1564,132 @@ class Querys:
         - tipo_ticket (ID de tipo ticket) 
         - macroproceso (ID de macroproceso)
         - estado (ID numérico del estado)
+
+        La página y el total salen de una sola sentencia (COUNT(*) OVER() sobre los mismos
+        filtros). Con incluir_total=False o con cursor keyset no se cuenta: el cliente
+        conserva el total de la primera página (scroll infinito).
         """
         try:
-            # Query base con JOINs para obtener nombres
-            base_query = """
-            SELECT DISTINCT
+            params = {}
+
+            # 1. Filtros: una sola definición para la página y el total
+            # (activo/ticket en línea para que SQL Server use los índices filtrados idx_tickets_*)
+            where_clause = """
+            WHERE icm.activo = 1 
+            AND icm.ticket = 1
+            """
+
+            # Filtro de vista base
+            vista = filtros.get('vista', 'todos')
+            if vista == 'sin':
+                where_clause += " AND icm.asignado IS NULL"
+            elif vista == 'abiertos':
+                where_clause += " AND icm.estado = 1"
+            elif vista == 'proceso':
+                where_clause += " AND icm.estado = 2"
+            elif vista == 'comp':
+                where_clause += " AND icm.estado = 3"
+            elif vista.startswith('tecnico_'):
+                tecnico_id = int(vista.replace('tecnico_', ''))
+                where_clause += " AND icm.asignado = :tecnico_id"
+                params['tecnico_id'] = tecnico_id
+            
+            # 2. Filtros específicos usando campos reales
+            # Búsqueda: TCK-0123/#123 va directo por id; el texto usa el índice de texto completo
+            # (resultados por relevancia) o LIKE si la instancia no lo tiene. Un número suelto
+            # ("2024", una extensión) busca como texto y además como id de ticket
+            join_busqueda = ""
+            orden = "icm.created_at DESC, icm.id DESC"
+            por_relevancia = False
+            if filtros.get('q'):
+                ticket_id = self._ticket_id_busqueda(filtros['q'])
+                termino = self._termino_texto_completo(filtros['q'])
+                numero = PATRON_NUMERO.match(filtros['q'])
+                if numero:
+                    params['numero_busqueda'] = int(numero.group(1))
+
+                if ticket_id is not None:
+                    where_clause += " AND icm.id = :ticket_busqueda"
+                    params['ticket_busqueda'] = ticket_id
+                elif termino and self.texto_completo_disponible():
+                    params['termino_busqueda'] = termino
+                    por_relevancia = True
+                    contains = f"CONTAINSTABLE(intranet_correos_microsoft, ({COLUMNAS_TEXTO_COMPLETO}), :termino_busqueda) ft"
+                    if numero:
+                        # El ticket con ese número va primero y luego las coincidencias por relevancia
+                        join_busqueda = f"""
+            LEFT JOIN {contains}
+                ON ft.[KEY] = icm.id"""
+                        where_clause += " AND (ft.[KEY] IS NOT NULL OR icm.id = :numero_busqueda)"
+                        orden = ("CASE WHEN icm.id = :numero_busqueda THEN 0 ELSE 1 END, "
+                                 "ft.RANK DESC, icm.created_at DESC, icm.id DESC")
+                    else:
+                        join_busqueda = f"""
+            INNER JOIN {contains}
+                ON ft.[KEY] = icm.id"""
+                        orden = "ft.RANK DESC, icm.created_at DESC, icm.id DESC"
+                else:
+                    search_term = f"%{filtros['q']}%"
+                    condicion_id = " OR icm.id = :numero_busqueda" if numero else ""
+                    where_clause += f""" AND (
+                    icm.subject LIKE :search_term OR  
+                    icm.from_name LIKE :search_term OR
+                    icm.from_email LIKE :search_term{condicion_id}
+                )"""
+                    params['search_term'] = search_term
+                
+            if filtros.get('estado'):
+                where_clause += " AND icm.estado = :estado_filtro"
+                params['estado_filtro'] = filtros['estado']
+                
+            if filtros.get('asignado'):
+                where_clause += " AND icm.asignado = :asignado_filtro"
+                params['asignado_filtro'] = filtros['asignado']
+                
+            if filtros.get('tipo_soporte'):
+                where_clause += " AND icm.tipo_soporte = :tipo_soporte_filtro"
+                params['tipo_soporte_filtro'] = filtros['tipo_soporte']
+                
+            if filtros.get('macroproceso'):
+                where_clause += " AND icm.macroproceso = :macroproceso_filtro"
+                params['macroproceso_filtro'] = filtros['macroproceso']
+                
+            if filtros.get('tipo_ticket'):
+                where_clause += " AND icm.tipo_ticket = :tipo_ticket_filtro"
+                params['tipo_ticket_filtro'] = filtros['tipo_ticket']
+
+            # 3. Paginación: offset o keyset (continuar después de la última fila (created_at, id) entregada).
+            # El orden por relevancia no es keyset: las búsquedas de texto paginan por offset
+            limite = int(filtros.get('limite', 100))
+            offset = int(filtros.get('offset', 0))
+            cursor = None if por_relevancia else filtros.get('cursor')
+            condicion_cursor = ""
+
+            if cursor:
+                cursor_fecha, cursor_id = cursor
+                if cursor_fecha is None:
+                    condicion_cursor = " AND icm.id < :cursor_id"
+                else:
+                    condicion_cursor = """ AND (
+                    icm.created_at < :cursor_fecha OR
+                    (icm.created_at = :cursor_fecha AND icm.id < :cursor_id)
+                )"""
+                    params['cursor_fecha'] = cursor_fecha
+                params['cursor_id'] = cursor_id
+                offset = 0
+
+            # El total se calcula en la misma sentencia; no aplica en páginas por cursor
+            contar = filtros.get('incluir_total', True) and not cursor
+            columna_total = ",\n                COUNT(*) OVER() as total" if contar else ""
+
+            # Query con JOINs para obtener nombres (una fila por ticket: los JOIN son por id)
+            base_query = f"""
+            SELECT
                 icm.id,
                 icm.message_id,
                 icm.subject,
                 icm.from_name,
                 icm.from_email,
-                icm.body_content,
                 icm.received_date,
                 icm.created_at,
                 icm.updated_at,
@@ -725,9 +1717,9 @@ class Querys:
                     WHEN icm.estado = 3 THEN 'Completado'
                     WHEN icm.estado = 4 THEN 'Cerrado'
                     ELSE 'Abierto'
-                END as estado_nombre
+                END as estado_nombre{columna_total}
 
-            FROM intranet_correos_microsoft icm
+            FROM intranet_correos_microsoft icm{join_busqueda}
             
             -- LEFT JOINs para obtener nombres
             LEFT JOIN intranet_tipo_prioridad itp ON icm.prioridad = itp.id AND itp.estado = 1
@@ -735,155 +1727,141 @@ class Querys:
             LEFT JOIN intranet_tipo_ticket itt ON icm.tipo_ticket = itt.id AND itt.estado = 1
             LEFT JOIN intranet_perfiles_macroproceso ipm ON icm.macroproceso = ipm.id AND ipm.estado = 1
             LEFT JOIN intranet_usuarios_gestion_tic iugt ON icm.asignado = iugt.id AND iugt.estado = 1
-            
-            WHERE icm.activo = 1 
-            AND icm.ticket = 1
-            """
-            
-            params = {}
-            
-            # 1. Filtro de vista base
-            vista = filtros.get('vista', 'todos')
-            if vista == 'sin':
-                base_query += " AND icm.asignado IS NULL"
-            elif vista == 'abiertos':
-                base_query += " AND icm.estado = 1"
-            elif vista == 'proceso':
-                base_query += " AND icm.estado = 2"
-            elif vista == 'comp':
-                base_query += " AND icm.estado = 3"
-            elif vista.startswith('tecnico_'):
-                tecnico_id = int(vista.replace('tecnico_', ''))
-                base_query += " AND icm.asignado = :tecnico_id"
-                params['tecnico_id'] = tecnico_id
-            
-            # 2. Filtros específicos usando campos reales
-            if filtros.get('q'):
-                search_term = f"%{filtros['q']}%"
-                base_query += """ AND (
-                    CAST(icm.id AS NVARCHAR) LIKE :search_term OR
-                    icm.subject LIKE :search_term OR  
-                    icm.from_name LIKE :search_term OR
-                    icm.from_email LIKE :search_term
-                )"""
-                params['search_term'] = search_term
-                
-            if filtros.get('estado'):
-                base_query += " AND icm.estado = :estado_filtro"
-                params['estado_filtro'] = filtros['estado']
-                
-            if filtros.get('asignado'):
-                base_query += " AND icm.asignado = :asignado_filtro"
-                params['asignado_filtro'] = filtros['asignado']
-                
-            if filtros.get('tipo_soporte'):
-                base_query += " AND icm.tipo_soporte = :tipo_soporte_filtro"
-                params['tipo_soporte_filtro'] = filtros['tipo_soporte']
-                
-            if filtros.get('macroproceso'):
-                base_query += " AND icm.macroproceso = :macroproceso_filtro"
-                params['macroproceso_filtro'] = filtros['macroproceso']
-                
-            if filtros.get('tipo_ticket'):
-                base_query += " AND icm.tipo_ticket = :tipo_ticket_filtro"
-                params['tipo_ticket_filtro'] = filtros['tipo_ticket']
-            
-            # 3. Contar total (antes de paginación)
-            # Extraer solo la parte WHERE y filtros de la query base
-            where_clause = ""
-            if 'WHERE' in base_query:
-                where_clause = "WHERE" + base_query.split('WHERE', 1)[1]
-            
-            count_query = f"""
-            SELECT COUNT(DISTINCT icm.id) as total
-            FROM intranet_correos_microsoft icm
-            LEFT JOIN intranet_usuarios_gestion_tic iugt ON icm.asignado = iugt.id AND iugt.estado = 1
-            {where_clause}
-            """
-            
-            total_result = self.db.execute(text(count_query), params).fetchone()
-            total = total_result[0] if total_result else 0
-            
-            # 4. Agregar ordenación y paginación (SQL Server syntax)
-            limite = filtros.get('limite', 100)
-            offset = filtros.get('offset', 0)
-            
-            base_query += f"""
-            ORDER BY icm.created_at DESC
+            {where_clause}{condicion_cursor}
+            ORDER BY {orden}
             OFFSET {offset} ROWS
-            FETCH NEXT {limite} ROWS ONLY
+            FETCH NEXT {limite + 1} ROWS ONLY
             """
             
-            # 5. Ejecutar query principal
-            result = self.db.execute(text(base_query), params)
+            # 4. Ejecutar query principal (una fila extra indica si hay página siguiente)
+            filas = self.db.execute(text(base_query), params).fetchall()
+            hay_mas = len(filas) > limite
+            filas = filas[:limite]
+
+            total = None
+            if contar:
+                if filas:
+                    total = filas[0][23]
+                elif offset:
+                    # Página fuera de rango: la ventana no trae filas, se cuenta aparte con los mismos filtros
+                    count_query = f"SELECT COUNT(*) FROM intranet_correos_microsoft icm {join_busqueda} {where_clause}"
+                    total = self.db.execute(text(count_query), params).scalar() or 0
+                else:
+                    total = 0
+
             tickets = []
             
-            for row in result:
+            for row in filas:
                 ticket_dict = {
                     'id': row[0],
                     'message_id': row[1], 
                     'subject': row[2],
                     'from_name': row[3],
                     'from_email': row[4],
-                    'body': row[5],
-                    'received_at': row[6].strftime('%Y-%m-%d %H:%M:%S') if row[6] else None,
-                    'created_at': row[7].strftime('%Y-%m-%d') if row[7] else None,
-                    'updated_at': row[8].strftime('%Y-%m-%d %H:%M:%S') if row[8] else None,
+                    'received_at': row[5].strftime('%Y-%m-%d %H:%M:%S') if row[5] else None,
+                    'created_at': row[6].strftime('%Y-%m-%d') if row[6] else None,
+                    'updated_at': row[7].strftime('%Y-%m-%d %H:%M:%S') if row[7] else None,
                     'ticket_id': row[0],  # Usar ID como ticket_id
-                    'ticket': row[9],
-                    'estado': row[10],
-                    'asignado': row[11],
-                    'prioridad': row[12],
-                    'tipo_soporte': row[13],
-                    'tipo_ticket': row[14],
-                    'macroproceso': row[15],
-                    'fecha_vencimiento': row[16].strftime('%Y-%m-%d') if row[16] else None,
-                    'sla': row[17],
-                    'prioridad_nombre': row[18],
-                    'tipo_soporte_nombre': row[19],
-                    'tipo_ticket_nombre': row[20],
-                    'macroproceso_nombre': row[21],
-                    'asignadoNombre': row[22],
-                    'estadoTicket': row[23]  # Nombre del estado mapeado
+                    'ticket': row[8],
+                    'estado': row[9],
+                    'asignado': row[10],
+                    'prioridad': row[11],
+                    'tipo_soporte': row[12],
+                    'tipo_ticket': row[13],
+                    'macroproceso': row[14],
+                    'fecha_vencimiento': row[15].strftime('%Y-%m-%d') if row[15] else None,
+                    'sla': row[16],
+                    'prioridad_nombre': row[17],
+                    'tipo_soporte_nombre': row[18],
+                    'tipo_ticket_nombre': row[19],
+                    'macroproceso_nombre': row[20],
+                    'asignadoNombre': row[21],
+                    'estadoTicket': row[22]  # Nombre del estado mapeado
                 }
                 tickets.append(ticket_dict)
             
-            # 6. Preparar respuesta
+            # 5. Preparar respuesta
             return {
                 'tickets': tickets,
                 'total': total,
                 'limite': filtros.get('limite', 100),
                 'offset': filtros.get('offset', 0),
+                'siguiente_cursor': self.tools.codificar_cursor(filas[-1][6], filas[-1][0]) if hay_mas and not por_relevancia else None,
+                'hay_mas': hay_mas,
+                'orden': 'relevancia' if por_relevancia else 'fecha',
                 'filtros_aplicados': {k: v for k, v in filtros.items() 
-                                   if k not in ['limite', 'offset'] and v is not None}
+                                   if k not in ['limite', 'offset', 'cursor', 'incluir_total'] and v is not None}
             }
             
         except Exception as e:
             print(f"Error en filtrar_tickets_optimizado: {e}")
             raise e
 
+    # Helper para detectar una búsqueda explícita por número de ticket (TCK-0123 o #123)
+    def _ticket_id_busqueda(self, q):
+        coincidencia = PATRON_TICKET_ID.match(q or '')
+        return int(coincidencia.group(1)) if coincidencia else None
+
+    # Helper para convertir el texto buscado en un término de CONTAINSTABLE
+    def _termino_texto_completo(self, q):
+        """
+        Cada palabra se busca como prefijo y todas deben aparecer:
+        'impresora piso' -> '"impresora*" AND "piso*"'.
+        Solo se toman caracteres de palabra, así el texto del usuario no altera la sintaxis.
+        """
+        palabras = PATRON_PALABRAS.findall(q or '')
+        return ' AND '.join(f'"{palabra}*"' for palabra in palabras)
+
+    # Query para saber si existe el índice de texto completo de los correos
+    def texto_completo_disponible(self):
+        """
+        True si intranet_correos_microsoft tiene índice de texto completo habilitado.
+        Se consulta una vez por proceso; si la instancia no tiene Full-Text Search
+        la búsqueda de tickets usa LIKE.
+        """
+        global _texto_completo_disponible
+        if _texto_completo_disponible is None:
+            try:
+                _texto_completo_disponible = bool(self.db.execute(text("""
+                    SELECT COUNT(*) FROM sys.fulltext_indexes
+                    WHERE object_id = OBJECT_ID('intranet_correos_microsoft') AND is_enabled = 1
+                """)).scalar())
+            except Exception as e:
+                print(f"No se pudo verificar el índice de texto completo: {e}")
+                self.db.rollback()
+                _texto_completo_disponible = False
+
+        return _texto_completo_disponible
+
     # ===== FUNCIONES PARA MANEJO DE RESPUESTAS EN HILOS =====
     
     # Query para obtener un ticket por su conversation_id
     def obtener_ticket_por_conversation_id(self, conversation_id):
         """
-        Busca un ticket existente basado en el conversation_id
+        Busca el correo/ticket original (estado 1) de una conversación de Graph.
+        Búsqueda por igualdad sobre idx_conversation_id; las respuestas ya procesadas
+        (estado 2) no se consideran como ticket padre.
         Returns: dict con datos del ticket o None si no existe
         """
         try:
             if not conversation_id:
                 return None
-                
-            # Por ahora buscaremos por similitud de asunto, ya que no tenemos conversation_id en BD
-            # En el futuro se puede agregar la columna conversation_id
-            print(f"🔍 Buscando ticket por conversation_id: {conversation_id}")
-            
-            # Buscaremos cualquier ticket existente (temporalmente deshabilitado)
-            # TODO: Agregar columna conversation_id a la tabla
-            return None
-            
-            result = self.db.execute(sql, {"conversation_id": conversation_id}).fetchone()
-            
+
+            result = self.db.query(
+                CorreosMicrosoftModel.id,
+                CorreosMicrosoftModel.message_id,
+                CorreosMicrosoftModel.subject,
+                CorreosMicrosoftModel.from_email,
+                CorreosMicrosoftModel.from_name,
+                CorreosMicrosoftModel.conversation_id,
+                CorreosMicrosoftModel.created_at
+            ).filter(
+                CorreosMicrosoftModel.conversation_id == conversation_id,
+                CorreosMicrosoftModel.estado == 1
+            ).order_by(
+                CorreosMicrosoftModel.created_at.desc()
+            ).first()
+
             if result:
                 return {
                     'id': result[0],
@@ -894,13 +1872,106 @@ class Querys:
                     'conversation_id': result[5],
                     'created_at': result[6]
                 }
-                
+
             return None
-            
+
         except Exception as e:
             print(f"Error en obtener_ticket_por_conversation_id: {e}")
             return None
 
+    # Query para buscar en bloque el ticket original de varias conversaciones
+    def obtener_tickets_por_conversation_ids(self, conversation_ids):
+        """
+        Versión en lote de obtener_ticket_por_conversation_id: una sola consulta IN sobre
+        idx_conversation_id. Returns: {conversation_id: dict del correo más reciente}
+        """
+        try:
+            if not conversation_ids:
+                return {}
+
+            result = self.db.query(
+                CorreosMicrosoftModel.id,
+                CorreosMicrosoftModel.subject,
+                CorreosMicrosoftModel.from_email,
+                CorreosMicrosoftModel.conversation_id,
+                CorreosMicrosoftModel.created_at
+            ).filter(
+                CorreosMicrosoftModel.conversation_id.in_(list(conversation_ids)),
+                CorreosMicrosoftModel.estado == 1
+            ).all()
+
+            tickets = dict()
+            for row in result:
+                actual = tickets.get(row[3])
+                if actual and (actual['created_at'] or datetime.min) >= (row[4] or datetime.min):
+                    continue
+                tickets[row[3]] = {
+                    'id': row[0],
+                    'subject': row[1],
+                    'from_email': row[2],
+                    'conversation_id': row[3],
+                    'created_at': row[4]
+                }
+
+            return tickets
+
+        except Exception as e:
+            print(f"Error obteniendo tickets por conversation_ids: {e}")
+            return {}
+
+    # Query para obtener correos sin conversation_id (pendientes de completar desde Graph)
+    def obtener_message_ids_sin_conversation(self, limite=500, antes_de_id=None):
+        """
+        Retorna [(id, message_id)] de los correos sin conversation_id, del más reciente al más
+        antiguo. antes_de_id continúa después del último lote (los correos que fallaron en
+        Graph siguen pendientes y no vuelven a ocupar el lote siguiente)
+        """
+        try:
+            query = self.db.query(
+                CorreosMicrosoftModel.id,
+                CorreosMicrosoftModel.message_id
+            ).filter(
+                CorreosMicrosoftModel.conversation_id.is_(None)
+            )
+
+            if antes_de_id:
+                query = query.filter(CorreosMicrosoftModel.id < antes_de_id)
+
+            result = query.order_by(
+                CorreosMicrosoftModel.id.desc()
+            ).limit(limite).all()
+
+            return [(row[0], row[1]) for row in result]
+
+        except Exception as e:
+            print(f"Error obteniendo correos sin conversation_id: {e}")
+            return []
+
+    # Query para guardar en bloque los conversation_id obtenidos desde Graph
+    def actualizar_conversation_ids(self, conversation_ids: dict):
+        """Actualiza {message_id: conversation_id} en una sola sentencia executemany"""
+        try:
+            if not conversation_ids:
+                return 0
+
+            tabla = CorreosMicrosoftModel.__table__
+            self.db.execute(
+                update(tabla).where(tabla.c.message_id == bindparam('b_message_id')).values(
+                    conversation_id=bindparam('b_conversation_id')
+                ),
+                [
+                    {'b_message_id': message_id, 'b_conversation_id': conversation_id}
+                    for message_id, conversation_id in conversation_ids.items()
+                ]
+            )
+            self.db.commit()
+            return len(conversation_ids)
+
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error actualizando conversation_ids: {e}")
+            return 0
+
     # Query para registrar una respuesta entrante en el historial del ticket
     def registrar_respuesta_entrante_ticket(self, respuesta_data):
         """
@@ -919,6 +1990,7 @@ class Querys:
                 'received_date': respuesta_data.get('received_date'),
                 'body_preview': respuesta_data.get('subject', '')[:100],
                 'body_content': respuesta_data.get('body_content'),
+                'body_cargado': respuesta_data.get('body_cargado', 0),
                 'estado': 2  # Estado 2 = Respuesta procesada (no aparece en buzón)
             }
             
@@ -943,7 +2015,7 @@ class Querys:
         try:
             sql = text("""
                 UPDATE intranet_correos_microsoft 
-                SET updated_at = NOW()
+                SET updated_at = GETDATE()
                 WHERE id = :ticket_id
             """)
             
@@ -960,28 +2032,30 @@ class Querys:
     # Query para buscar tickets con subject similar
     def buscar_ticket_por_subject_similar(self, subject_limpio, from_email):
         """
-        Busca tickets con subject similar al proporcionado
+        Busca el ticket más reciente del remitente cuyo subject normalizado coincide
+        (búsqueda por igualdad sobre idx_subject_huella_from_email, últimos 7 días).
         Útil para detectar hilos cuando conversation_id no coincide
         """
         try:
-            sql = text("""
-                SELECT TOP 1 id, subject, from_email, conversation_id, created_at
-                FROM intranet_correos_microsoft 
-                WHERE subject LIKE :subject_pattern
-                AND from_email = :from_email
-                AND estado = 1
-                AND created_at >= DATEADD(day, -7, GETDATE())
-                ORDER BY created_at DESC
-            """)
-            
-            # Buscar con patrón LIKE para subjects similares
-            subject_pattern = f"%{subject_limpio}%"
-            
-            result = self.db.execute(sql, {
-                "subject_pattern": subject_pattern,
-                "from_email": from_email
-            }).fetchone()
-            
+            huella = huella_subject(subject_limpio)
+            if not huella or not from_email:
+                return None
+
+            result = self.db.query(
+                CorreosMicrosoftModel.id,
+                CorreosMicrosoftModel.subject,
+                CorreosMicrosoftModel.from_email,
+                CorreosMicrosoftModel.conversation_id,
+                CorreosMicrosoftModel.created_at
+            ).filter(
+                CorreosMicrosoftModel.subject_huella == huella,
+                CorreosMicrosoftModel.from_email == from_email,
+                CorreosMicrosoftModel.estado == 1,
+                CorreosMicrosoftModel.created_at >= datetime.now() - timedelta(days=7)
+            ).order_by(
+                CorreosMicrosoftModel.created_at.desc()
+            ).first()
+
             if result:
                 return {
                     'id': result[0],
@@ -990,9 +2064,9 @@ class Querys:
                     'conversation_id': result[3],
                     'created_at': result[4]
                 }
-                
+
             return None
-            
+
         except Exception as e:
             print(f"Error buscando ticket por subject similar: {e}")
             return None
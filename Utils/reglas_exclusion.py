@@ -0,0 +1,39 @@
+import re
+
+from Utils.constants import SYNC_EXCLUIR_REMITENTES, SYNC_EXCLUIR_ASUNTOS
+
+class ReglasExclusion:
+    """
+    Reglas para descartar correos automáticos y spam durante la sincronización.
+    Los prefijos se configuran en .env (SYNC_EXCLUIR_REMITENTES / SYNC_EXCLUIR_ASUNTOS)
+    y se compilan una sola vez en una expresión regular por campo.
+    - Remitente: prefijo de la dirección, sin distinguir mayúsculas (postmaster, noreply...)
+    - Asunto: prefijo literal del subject ([!!Spam], [!!Massmail]...)
+    """
+
+    def __init__(self, remitentes=SYNC_EXCLUIR_REMITENTES, asuntos=SYNC_EXCLUIR_ASUNTOS):
+        self.patron_remitente = self._compilar(remitentes, re.IGNORECASE)
+        self.patron_asunto = self._compilar(asuntos)
+
+    # Función para compilar una lista de prefijos en una sola expresión regular
+    def _compilar(self, prefijos, flags=0):
+        if not prefijos:
+            return None
+        return re.compile('|'.join(re.escape(prefijo) for prefijo in prefijos), flags)
+
+    # Función para verificar si un correo de Graph debe excluirse
+    def excluir(self, email_graph):
+        """Retorna True si el remitente o el asunto del correo coinciden con alguna regla"""
+        if self.patron_remitente:
+            remitente = ((email_graph.get('from') or {}).get('emailAddress') or {}).get('address') or ''
+            if self.patron_remitente.match(remitente):
+                return True
+
+        if self.patron_asunto:
+            if self.patron_asunto.match(email_graph.get('subject') or ''):
+                return True
+
+        return False
+
+
+reglas_exclusion = ReglasExclusion()
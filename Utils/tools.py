@@ -9,6 +9,8 @@ from dotenv import load_dotenv
 # from email import encoders
 # import json
 import os
+import json
+import base64
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -108,6 +110,23 @@ class Tools:
         valor_decimal = Decimal(value)
         return valor_decimal
 
+    # Función para generar el cursor opaco de paginación keyset a partir de la última fila
+    def codificar_cursor(self, fecha, registro_id):
+        contenido = json.dumps({
+            'fecha': fecha.isoformat() if fecha else None,
+            'id': registro_id
+        })
+        return base64.urlsafe_b64encode(contenido.encode('utf-8')).decode('ascii')
+
+    # Función para leer un cursor de paginación keyset: retorna (fecha, id)
+    def decodificar_cursor(self, cursor):
+        try:
+            contenido = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            fecha = datetime.fromisoformat(contenido['fecha']) if contenido.get('fecha') else None
+            return fecha, int(contenido['id'])
+        except Exception:
+            raise CustomException("Cursor de paginación inválido.")
+
     # Función para enviar correos electrónicos
     def send_email_individual(self, to_email, cc_emails, subject, body, logo_path=None, mail_sender=None):
         """Envía un correo electrónico a un destinatario con copia a otros y adjunta un logo si está disponible."""
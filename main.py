@@ -5,6 +5,8 @@ from Middleware.get_json import JSONMiddleware
 from Router.Graph import graph_router
 from Router.Tickets import tickets_router
 from Router.Dashboard import dashboard_router
+from Class.SyncWorker import sync_worker
+from Utils.constants import SYNC_AUTOMATICO
 from pathlib import Path
 
 route = Path.cwd()
@@ -25,6 +27,16 @@ app.include_router(dashboard_router, prefix="/dashboard")
 
 BASE.metadata.create_all(bind=engine)
 
+# Sincronización de correos en segundo plano (fuera del ciclo de las peticiones)
+@app.on_event("startup")
+def iniciar_sync_worker():
+    if SYNC_AUTOMATICO:
+        sync_worker.iniciar()
+
+@app.on_event("shutdown")
+def detener_sync_worker():
+    sync_worker.detener()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,26 +1,43 @@
 """
 Script de migración para crear las tablas de correos Microsoft
 Ejecutar este script para crear las nuevas tablas en la base de datos
+y agregar a las tablas existentes las columnas nuevas de los modelos
+
+Uso:
+    python migration_correos.py            # Migración completa
+    python migration_correos.py --indices  # Solo índices (compuestos/filtrados y texto completo)
 """
 
-from Config.db import engine, BASE
-from backend.Models.IntranetCorreosMicrosoftModel import IntranetCorreosMicrosoftModel
-from backend.Models.IntranetSyncLogModel import IntranetSyncLogModel
+from Config.db import engine, BASE, session_maker
+from Models.IntranetCorreosMicrosoftModel import IntranetCorreosMicrosoftModel
+from Models.IntranetSyncLogModel import IntranetSyncLogModel
+from Models.IntranetSyncEstadoModel import IntranetSyncEstadoModel
+from Models.IntranetCorreosAdjuntosModel import IntranetCorreosAdjuntosModel
+from Utils.querys import Querys, COLUMNAS_TEXTO_COMPLETO
+from sqlalchemy import inspect, text
 import sys
 
+# Modelos cuyas tablas administra esta migración
+MODELOS = [
+    IntranetCorreosMicrosoftModel,
+    IntranetSyncLogModel,
+    IntranetSyncEstadoModel,
+    IntranetCorreosAdjuntosModel,
+]
+
 def crear_tablas():
     """Crea las tablas de correos Microsoft y sync log"""
     try:
         print("Iniciando creación de tablas...")
-        
+
         # Crear todas las tablas definidas en los modelos
         BASE.metadata.create_all(bind=engine)
-        
+
         print("✅ Tablas creadas exitosamente:")
-        print("   - correos_microsoft")
-        print("   - sync_log")
+        for modelo in MODELOS:
+            print(f"   - {modelo.__tablename__}")
         print("\nLas tablas están listas para usar.")
-        
+
     except Exception as e:
         print(f"❌ Error creando tablas: {e}")
         sys.exit(1)
@@ -28,37 +45,170 @@ def crear_tablas():
 def verificar_tablas():
     """Verifica que las tablas existan"""
     try:
-        from sqlalchemy import inspect
-        
         inspector = inspect(engine)
         tablas_existentes = inspector.get_table_names()
-        
-        tablas_requeridas = ['correos_microsoft', 'sync_log']
+
+        tablas_requeridas = [modelo.__tablename__ for modelo in MODELOS]
         tablas_faltantes = [tabla for tabla in tablas_requeridas if tabla not in tablas_existentes]
-        
+
         if tablas_faltantes:
             print(f"⚠️  Tablas faltantes: {tablas_faltantes}")
             return False
         else:
             print("✅ Todas las tablas requeridas existen")
             return True
-            
+
     except Exception as e:
         print(f"❌ Error verificando tablas: {e}")
         return False
 
+def agregar_columnas_faltantes():
+    """
+    Agrega a las tablas existentes las columnas definidas en los modelos que aún no existen
+    (create_all solo crea tablas nuevas, no altera las existentes)
+    """
+    try:
+        inspector = inspect(engine)
+        tablas_existentes = inspector.get_table_names()
+        agregadas = 0
+
+        with engine.begin() as conn:
+            for modelo in MODELOS:
+                tabla = modelo.__table__
+                if tabla.name not in tablas_existentes:
+                    continue
+
+                columnas_existentes = {col['name'] for col in inspector.get_columns(tabla.name)}
+                for columna in tabla.columns:
+                    if columna.name in columnas_existentes:
+                        continue
+
+                    tipo = columna.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {tabla.name} ADD {columna.name} {tipo} NULL"))
+                    print(f"   + {tabla.name}.{columna.name} ({tipo})")
+                    agregadas += 1
+
+        if agregadas:
+            print(f"✅ {agregadas} columna(s) agregada(s)")
+        else:
+            print("✅ Todas las columnas requeridas existen")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error agregando columnas: {e}")
+        return False
+
+def crear_indices_faltantes():
+    """
+    Crea en las tablas existentes los índices definidos en los modelos que aún no existen
+    (create_all no crea índices nuevos sobre tablas que ya existían)
+    """
+    try:
+        inspector = inspect(engine)
+        tablas_existentes = inspector.get_table_names()
+        creados = 0
+
+        for modelo in MODELOS:
+            tabla = modelo.__table__
+            if tabla.name not in tablas_existentes:
+                continue
+
+            indices_existentes = {indice['name'] for indice in inspector.get_indexes(tabla.name)}
+            for indice in tabla.indexes:
+                if indice.name in indices_existentes:
+                    continue
+
+                indice.create(bind=engine)
+                print(f"   + {tabla.name}.{indice.name}")
+                creados += 1
+
+        if creados:
+            print(f"✅ {creados} índice(s) creado(s)")
+        else:
+            print("✅ Todos los índices requeridos existen")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error creando índices: {e}")
+        return False
+
+def crear_indice_texto_completo():
+    """
+    Crea el catálogo y el índice de texto completo de intranet_correos_microsoft que usa
+    la búsqueda de tickets (q en /filtrar_tickets). CHANGE_TRACKING AUTO lo mantiene al
+    día con cada correo ingerido. Si la instancia no tiene Full-Text Search instalado
+    no es un error: la búsqueda sigue funcionando con LIKE.
+    """
+    try:
+        # CREATE FULLTEXT CATALOG/INDEX no se permiten dentro de una transacción
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if not conn.execute(text("SELECT FULLTEXTSERVICEPROPERTY('IsFullTextInstalled')")).scalar():
+                print("⚠️ Full-Text Search no está instalado: la búsqueda de tickets usará LIKE")
+                return True
+
+            existe = conn.execute(text("""
+                SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('intranet_correos_microsoft')
+            """)).first()
+            if existe:
+                print("✅ El índice de texto completo existe")
+                return True
+
+            if not conn.execute(text("SELECT 1 FROM sys.fulltext_catalogs WHERE name = 'catalogo_correos'")).first():
+                conn.execute(text("CREATE FULLTEXT CATALOG catalogo_correos"))
+
+            # El índice de texto completo necesita una clave única de una columna: la PK (id)
+            clave = conn.execute(text("""
+                SELECT name FROM sys.indexes
+                WHERE object_id = OBJECT_ID('intranet_correos_microsoft') AND is_primary_key = 1
+            """)).scalar()
+
+            conn.execute(text(f"""
+                CREATE FULLTEXT INDEX ON intranet_correos_microsoft ({COLUMNAS_TEXTO_COMPLETO})
+                KEY INDEX [{clave}] ON catalogo_correos
+                WITH CHANGE_TRACKING AUTO
+            """))
+            print("✅ Índice de texto completo creado (se puebla en segundo plano)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error creando índice de texto completo: {e}")
+        return False
+
+def completar_datos_derivados():
+    """Completa columnas calculadas en correos existentes (huella del subject)"""
+    db = session_maker()
+    try:
+        actualizados = Querys(db).completar_subject_huella()
+        print(f"✅ subject_huella completada en {actualizados} correo(s)")
+        return True
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     print("=== MIGRACIÓN DE BASE DE DATOS - CORREOS MICROSOFT ===\n")
-    
+
+    # --indices: solo aplica los índices de los modelos y el de texto completo a una BD existente
+    if '--indices' in sys.argv[1:]:
+        if crear_indices_faltantes() and crear_indice_texto_completo():
+            print("\n🎉 Índices actualizados!")
+            sys.exit(0)
+        print("\n❌ Algo salió mal creando los índices.")
+        sys.exit(1)
+
     # Verificar si las tablas ya existen
     if verificar_tablas():
-        print("\n🎉 Las tablas ya existen. No es necesario ejecutar migración.")
+        print("\n🎉 Las tablas ya existen. Verificando columnas nuevas...")
     else:
         print("\n📦 Creando tablas faltantes...")
         crear_tablas()
-        
+
         # Verificar nuevamente
-        if verificar_tablas():
-            print("\n🎉 Migración completada exitosamente!")
-        else:
-            print("\n❌ Algo salió mal durante la migración.")
\ No newline at end of file
+        if not verificar_tablas():
+            print("\n❌ Algo salió mal durante la migración.")
+            sys.exit(1)
+
+    if (agregar_columnas_faltantes() and crear_indices_faltantes() and crear_indice_texto_completo()
+            and completar_datos_derivados()):
+        print("\n🎉 Migración completada exitosamente!")
+    else:
+        print("\n❌ Algo salió mal actualizando columnas e índices.")
@@ -0,0 +1,79 @@
+"""
+Simulador local de notificaciones de cambio de Microsoft Graph.
+Envía a /notificaciones_graph lo mismo que enviaría Graph, para probar el receptor
+sin exponer el servidor a internet:
+1. La validación de la suscripción (validationToken) y verifica que se devuelva tal cual
+2. Una notificación 'created' por cada message_id recibido como argumento
+
+Uso:
+    python simular_notificaciones.py <message_id> [<message_id> ...] [--url http://localhost:8007]
+"""
+
+import sys
+import uuid
+import requests
+from datetime import datetime, timedelta, timezone
+
+from Utils.constants import EMAIL_USER, GRAPH_NOTIFICACIONES_CLIENT_STATE
+
+def validar_suscripcion(url):
+    """Simula el handshake de validación que hace Graph al crear la suscripción"""
+    token = f"validacion-{uuid.uuid4()}"
+    response = requests.post(f"{url}/notificaciones_graph", params={'validationToken': token}, timeout=10)
+
+    if response.status_code == 200 and response.text == token:
+        print("✅ Validación de suscripción correcta")
+        return True
+
+    print(f"❌ Validación fallida: {response.status_code} - {response.text}")
+    return False
+
+def enviar_notificacion(url, message_ids, client_state=GRAPH_NOTIFICACIONES_CLIENT_STATE):
+    """Envía una notificación con el mismo formato que Graph para correos creados"""
+    suscripcion_id = str(uuid.uuid4())
+    expiracion = (datetime.now(timezone.utc) + timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    payload = {
+        'value': [
+            {
+                'subscriptionId': suscripcion_id,
+                'subscriptionExpirationDateTime': expiracion,
+                'changeType': 'created',
+                'clientState': client_state,
+                'resource': f"Users/{EMAIL_USER}/Messages/{message_id}",
+                'resourceData': {
+                    '@odata.type': '#Microsoft.Graph.Message',
+                    '@odata.id': f"Users/{EMAIL_USER}/Messages/{message_id}",
+                    'id': message_id
+                },
+                'tenantId': str(uuid.uuid4())
+            }
+            for message_id in message_ids
+        ]
+    }
+
+    response = requests.post(f"{url}/notificaciones_graph", json=payload, timeout=10)
+    if response.status_code == 202:
+        print(f"✅ Notificación aceptada ({len(message_ids)} correos encolados)")
+        return True
+
+    print(f"❌ Notificación rechazada: {response.status_code} - {response.text}")
+    return False
+
+if __name__ == "__main__":
+    argumentos = sys.argv[1:]
+    url = "http://localhost:8007"
+    if '--url' in argumentos:
+        posicion = argumentos.index('--url')
+        url = argumentos[posicion + 1].rstrip('/')
+        del argumentos[posicion:posicion + 2]
+
+    print("=== SIMULADOR DE NOTIFICACIONES DE GRAPH ===\n")
+
+    if not validar_suscripcion(url):
+        sys.exit(1)
+
+    if argumentos:
+        enviar_notificacion(url, argumentos)
+    else:
+        print("Sin message_ids: solo se probó la validación")